@@ -1,67 +1,801 @@
 #!/usr/bin/env python3
 import argparse
 import grpc
+import json
 import os
+import socket
 import sys
-from time import sleep
+import threading
+from time import monotonic, sleep, time
 
 # Import P4Runtime lib from parent utils dir
 # Probably there's a better way of doing this.
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../'))
 from p4runtime_lib.error_utils import printGrpcError
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
-import p4runtime_lib.helper
+from p4.v1 import p4runtime_pb2
+from p4ctl.aging import IdleTimeoutAger, setIdleTimeout
+from p4ctl.audit import Auditor
+from p4ctl.learning import HostLearner
+from p4ctl.linkmon import LinkMonitor
+from p4ctl.metrics import Metrics, instrument
+from p4ctl.msglog import logRequests
+from p4ctl.northbound import (DEFAULT_SOCKET as ROUTES_SOCKET, RouteService, RouteTable,
+                              serveRoutes, stopServing, switchPorts)
+from p4ctl.p4info_cache import CachedP4InfoHelper
+from p4ctl.reads import readEntries
+from p4ctl.scheduler import BULK, FAILOVER, UpdateScheduler, waitAll
+from p4ctl.shard import SwitchSpec, installSharded
+from p4ctl.switch import ControllerConnection
+from p4ctl.topology import Topology
+from p4ctl.versioned import DEFAULT_DRAIN, VERSIONS, makeBeforeBreak, otherVersion
 
-def writeIPV4LpmDefault(p4info_helper, ingress_sw, dst_ip, dst_mac, egress_port):
+SWITCHES = [
+    SwitchSpec('s1', '127.0.0.1:50051', 0),
+    SwitchSpec('s2', '127.0.0.1:50052', 1),
+    SwitchSpec('s3', '127.0.0.1:50053', 2),
+    SwitchSpec('s4', '127.0.0.1:50054', 3),
+    SwitchSpec('s5', '127.0.0.1:50055', 4),
+    SwitchSpec('s6', '127.0.0.1:50056', 5),
+]
 
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.ipv4_lpm1",
-        match_fields={
+# MRC routes per configuration, as (switch, dst_ip, dst_mac, egress_port)
+
+# default (diffserv 0)
+DEFAULT_ROUTES = [
+    # s1
+    ("s1", "10.0.1.1", "08:00:00:00:01:11", 1),
+    ("s1", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s1", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s1", "10.0.4.4", "08:00:00:00:04:00", 3),  # from s3 -> s6 -> s4
+    ("s1", "10.0.5.5", "08:00:00:00:05:00", 2),
+    ("s1", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s2
+    ("s2", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s2", "10.0.2.2", "08:00:00:00:02:22", 1),
+    ("s2", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s2", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s2", "10.0.5.5", "08:00:00:00:05:00", 4),
+    ("s2", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s3
+    ("s3", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s3", "10.0.2.2", "08:00:00:00:02:00", 3),
+    ("s3", "10.0.3.3", "08:00:00:00:03:33", 1),
+    ("s3", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s3", "10.0.5.5", "08:00:00:00:05:00", 3),
+    ("s3", "10.0.6.6", "08:00:00:00:06:00", 4),
+
+    # s4
+    ("s4", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s4", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s4", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s4", "10.0.4.4", "08:00:00:00:04:44", 1),
+    ("s4", "10.0.5.5", "08:00:00:00:05:00", 2),
+    ("s4", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s5
+    ("s5", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s5", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s5", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s5", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s5", "10.0.5.5", "08:00:00:00:05:55", 1),
+    ("s5", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s6
+    ("s6", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s6", "10.0.2.2", "08:00:00:00:02:00", 3),
+    ("s6", "10.0.3.3", "08:00:00:00:03:00", 2),
+    ("s6", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s6", "10.0.5.5", "08:00:00:00:05:00", 3),
+    ("s6", "10.0.6.6", "08:00:00:00:06:66", 1),
+]
+
+# backup1 (diffserv 4)
+BACKUP_1_ROUTES = [
+    # s1
+    ("s1", "10.0.1.1", "08:00:00:00:01:11", 1),
+    ("s1", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s1", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s1", "10.0.4.4", "08:00:00:00:04:00", 3),
+    ("s1", "10.0.5.5", "08:00:00:00:05:00", 3),
+    ("s1", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s2
+    ("s2", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s2", "10.0.2.2", "08:00:00:00:02:22", 1),
+    ("s2", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s2", "10.0.4.4", "08:00:00:00:04:00", 3),
+    ("s2", "10.0.5.5", "08:00:00:00:05:00", 3),
+    ("s2", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s3
+    ("s3", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s3", "10.0.2.2", "08:00:00:00:02:00", 3),
+    ("s3", "10.0.3.3", "08:00:00:00:03:33", 1),
+    ("s3", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s3", "10.0.5.5", "08:00:00:00:05:00", 4),
+    ("s3", "10.0.6.6", "08:00:00:00:06:00", 4),
+
+    # s4
+    ("s4", "10.0.1.1", "08:00:00:00:01:00", 3),
+    ("s4", "10.0.2.2", "08:00:00:00:02:00", 3),
+    ("s4", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s4", "10.0.4.4", "08:00:00:00:04:44", 1),
+    ("s4", "10.0.5.5", "08:00:00:00:05:00", 2),
+    ("s4", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s5
+    ("s5", "10.0.1.1", "08:00:00:00:01:00", 3),
+    ("s5", "10.0.2.2", "08:00:00:00:02:00", 3),
+    ("s5", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s5", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s5", "10.0.5.5", "08:00:00:00:05:55", 1),
+    ("s5", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s6
+    ("s6", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s6", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s6", "10.0.3.3", "08:00:00:00:03:00", 2),
+    ("s6", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s6", "10.0.5.5", "08:00:00:00:05:00", 3),
+    ("s6", "10.0.6.6", "08:00:00:00:06:66", 1),
+]
+
+# backup2 (diffserv 8)
+BACKUP_2_ROUTES = [
+    # s1
+    ("s1", "10.0.1.1", "08:00:00:00:01:11", 1),
+    ("s1", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s1", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s1", "10.0.4.4", "08:00:00:00:04:00", 2),
+    ("s1", "10.0.5.5", "08:00:00:00:05:00", 2),
+    ("s1", "10.0.6.6", "08:00:00:00:06:00", 2),
+
+    # s2
+    ("s2", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s2", "10.0.2.2", "08:00:00:00:02:22", 1),
+    ("s2", "10.0.3.3", "08:00:00:00:03:00", 2),
+    ("s2", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s2", "10.0.5.5", "08:00:00:00:05:00", 4),
+    ("s2", "10.0.6.6", "08:00:00:00:06:00", 4),
+
+    # s3
+    ("s3", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s3", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s3", "10.0.3.3", "08:00:00:00:03:33", 1),
+    ("s3", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s3", "10.0.5.5", "08:00:00:00:05:00", 4),
+    ("s3", "10.0.6.6", "08:00:00:00:06:00", 4),
+
+    # s4
+    ("s4", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s4", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s4", "10.0.3.3", "08:00:00:00:03:00", 2),
+    ("s4", "10.0.4.4", "08:00:00:00:04:44", 1),
+    ("s4", "10.0.5.5", "08:00:00:00:05:00", 2),
+    ("s4", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s5
+    ("s5", "10.0.1.1", "08:00:00:00:01:00", 2),
+    ("s5", "10.0.2.2", "08:00:00:00:02:00", 2),
+    ("s5", "10.0.3.3", "08:00:00:00:03:00", 2),
+    ("s5", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s5", "10.0.5.5", "08:00:00:00:05:55", 1),
+    ("s5", "10.0.6.6", "08:00:00:00:06:00", 3),
+
+    # s6
+    ("s6", "10.0.1.1", "08:00:00:00:01:00", 3),
+    ("s6", "10.0.2.2", "08:00:00:00:02:00", 3),
+    ("s6", "10.0.3.3", "08:00:00:00:03:00", 3),
+    ("s6", "10.0.4.4", "08:00:00:00:04:00", 4),
+    ("s6", "10.0.5.5", "08:00:00:00:05:00", 3),
+    ("s6", "10.0.6.6", "08:00:00:00:06:66", 1),
+]
+
+# The routes of each MRC configuration, default first; configuration i is
+# selected by diffserv mrcDiffserv(i). --routes replaces them from a file.
+MRC_CONFIGS = [
+    DEFAULT_ROUTES,
+    BACKUP_1_ROUTES,
+    BACKUP_2_ROUTES,
+]
+
+MRC_TABLE = "MyIngress.ipv4_mrc"
+
+# Route version bits of diffserv, stamped by mrc_version (0: not stamped)
+VERSION_SHIFT = 4
+
+# The version of a fresh install; 0 is never installed, so that a diffserv
+# of 0 only ever means a host packet no switch has stamped yet
+INITIAL_VERSION = VERSIONS[0]
+
+# Configuration and version each have two bits of diffserv
+MAX_CONFIGS = 4
+MAX_VERSION = 3
+
+# Seconds between two sweeps of the route counters (--accounting)
+DEFAULT_SWEEP = 5.0
+
+
+def mrcDiffserv(config, version=0):
+    """The diffserv value that selects MRC configuration number config."""
+    if not 0 <= config < MAX_CONFIGS:
+        raise ValueError("MRC configuration %d does not fit in diffserv" % config)
+    if not 0 <= version <= MAX_VERSION:
+        raise ValueError("route version %d does not fit in diffserv" % version)
+    return version << VERSION_SHIFT | config << 2
+
+
+def loadConfigs(routes_file_path):
+    """
+    Reads MRC configurations from a JSON file:
+
+        [[["s1", "10.0.1.1", "08:00:00:00:01:11", 1], ...],   # default
+         [...],                                               # backup 1
+         ...]
+
+    :raises ValueError: if there are more configurations than diffserv can select
+    """
+    with open(routes_file_path) as f:
+        configs = [[tuple(route) for route in routes] for routes in json.load(f)]
+    if len(configs) > MAX_CONFIGS:
+        raise ValueError("%s has %d MRC configurations, at most %d fit in diffserv"
+                         % (routes_file_path, len(configs), MAX_CONFIGS))
+    return configs
+
+
+def mrcEntry(diffserv, dst_ip, dst_mac, egress_port):
+    """The buildTableEntry arguments of one MRC route."""
+    return {
+        "table_name": MRC_TABLE,
+        "match_fields": {
             "hdr.ipv4.dstAddr": (dst_ip, 32),
-            "hdr.ipv4.diffserv": 0
+            "hdr.ipv4.diffserv": diffserv
         },
-        action_name="MyIngress.ipv4_forward",
-        action_params={
+        "action_name": "MyIngress.ipv4_forward",
+        "action_params": {
             "dstAddr": dst_mac,
             "port": egress_port
-        })
-    ingress_sw.WriteTableEntry(table_entry)
-    print("Installed ipv4_lpm1 (default) rule on %s" % ingress_sw.name)
+        },
+    }
 
-def writeBackup_1(p4info_helper, ingress_sw, dst_ip, dst_mac, egress_port):
+def writeMrcRoute(p4info_helper, ingress_sw, config, dst_ip, dst_mac, egress_port):
 
     table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.ipv4_lpm2",
-        match_fields={
-            "hdr.ipv4.dstAddr": (dst_ip, 32),
-            "hdr.ipv4.diffserv": 4
-        },
-        action_name="MyIngress.ipv4_forward",
-        action_params={
-            "dstAddr": dst_mac,
-            "port": egress_port,
-        })
+        **mrcEntry(mrcDiffserv(config, INITIAL_VERSION), dst_ip, dst_mac, egress_port))
     ingress_sw.WriteTableEntry(table_entry)
-    print("Installed ipv4_lpm2 (backup_1) rule on %s" % ingress_sw.name)
+    print("Installed ipv4_mrc configuration %d rule on %s" % (config, ingress_sw.name))
 
-def writeBackup_2(p4info_helper, ingress_sw, dst_ip, dst_mac, egress_port):
+def queueMrcRoutes(p4info_helper, schedulers, configs):
+    """
+    Installs all configurations as bulk work of the switches' UpdateSchedulers
+    and waits for them; raises the first grpc.RpcError.
+    """
+    futures = []
+    for config, routes in enumerate(configs):
+        for sw_name, dst_ip, dst_mac, egress_port in routes:
+            table_entry = p4info_helper.buildTableEntry(
+                **mrcEntry(mrcDiffserv(config, INITIAL_VERSION), dst_ip, dst_mac, egress_port))
+            futures += schedulers[sw_name].submitEntries([table_entry], priority=BULK)
+    error = waitAll(futures)
+    if error is not None:
+        raise error
+    print("Installed %d ipv4_mrc rules" % len(futures))
 
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.ipv4_lpm3",
-        match_fields={
-            "hdr.ipv4.dstAddr": (dst_ip, 32),
-            "hdr.ipv4.diffserv": 8
-        },
-        action_name="MyIngress.ipv4_forward",
-        action_params={
-            "dstAddr": dst_mac,
-            "port": egress_port
+def computeRoutes(configs, version=INITIAL_VERSION):
+    """
+    Computes the entries of all MRC configurations once, per switch.
+
+    :param configs: the routes of each configuration, default first
+    :param version: the route version the entries match on
+    :returns: switch name -> list of buildTableEntry kwargs, default
+              configuration first
+    """
+    entries = {spec.name: [] for spec in SWITCHES}
+    for config, routes in enumerate(configs):
+        for sw_name, dst_ip, dst_mac, egress_port in routes:
+            entries[sw_name].append(
+                mrcEntry(mrcDiffserv(config, version), dst_ip, dst_mac, egress_port))
+    return entries
+
+
+def versionArgs(version):
+    """The buildTableEntry arguments of the mrc_version default that stamps version."""
+    return {
+        "table_name": "MyIngress.mrc_version",
+        "default_action": True,
+        "action_name": "MyIngress.set_version",
+        "action_params": {"version": version},
+    }
+
+
+def ingressEntries(topo, version=INITIAL_VERSION):
+    """
+    What every switch needs to admit host packets, as buildTableEntry kwargs
+    per switch: the mrc_edge entries of its host-facing ports, and the
+    mrc_version default that stamps version on what enters there.
+    """
+    entries = {spec.name: [versionArgs(version)] for spec in SWITCHES}
+    for sw_name, port in sorted(topo.hostPorts()):
+        entries[sw_name].append({
+            "table_name": "MyIngress.mrc_edge",
+            "match_fields": {"standard_metadata.ingress_port": port},
+            "action_name": "MyIngress.host_ingress",
         })
-    ingress_sw.WriteTableEntry(table_entry)
-    print("Installed ipv4_lpm3 (backup_2) rule on %s" % ingress_sw.name)
+    return entries
+
+
+def versionEntry(p4info_helper, version):
+    """The mrc_version default entry that makes a switch stamp version."""
+    return p4info_helper.buildTableEntry(**versionArgs(version))
+
+
+def stampedVersion(p4info_helper, sw):
+    """The route version a switch currently stamps, 0 if none."""
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = sw.device_id
+    table_entry = request.entities.add().table_entry
+    table_entry.table_id = p4info_helper.get_tables_id("MyIngress.mrc_version")
+    table_entry.is_default_action = True
+    set_version = p4info_helper.get_actions_id("MyIngress.set_version")
+    for response in sw.client_stub.Read(request):
+        for entity in response.entities:
+            action = entity.table_entry.action.action
+            if action.action_id == set_version and action.params:
+                return int.from_bytes(action.params[0].value, 'big')
+    return 0
+
+
+def updateRoutes(p4info_helper, switches, configs, drain=DEFAULT_DRAIN):
+    """
+    Replaces the routes on running switches without a mixed state.
+
+    The routes go in under the next route version next to the current ones,
+    every switch then starts stamping that version, and the entries of the
+    previous version are removed once the packets carrying it are gone (see
+    p4ctl.versioned).
+    """
+    stamped = {name: stampedVersion(p4info_helper, sw) for name, sw in switches.items()}
+    if len(set(stamped.values())) > 1:
+        # An earlier update was interrupted while flipping; both of its
+        # versions are in use, so neither may be overwritten yet
+        print("Switches stamp different route versions: %s; flip them to one first" % (
+            ", ".join("%s %d" % item for item in sorted(stamped.items()))))
+        return
+    version = otherVersion(next(iter(stamped.values())))
+
+    diffserv_field_id = p4info_helper.get_match_field(MRC_TABLE, "hdr.ipv4.diffserv").id
+    table_id = p4info_helper.get_tables_id(MRC_TABLE)
+    remove = {}
+    for name, sw in switches.items():
+        stale, old = [], []
+        for response in sw.ReadTableEntries(table_id=table_id):
+            for entity in response.entities:
+                entry = entity.table_entry
+                fields = {match.field_id: match for match in entry.match}
+                diffserv = int.from_bytes(fields[diffserv_field_id].exact.value, 'big')
+                (stale if diffserv >> VERSION_SHIFT == version else old).append(entry)
+        if stale:
+            # Left over from an update that failed before its flip
+            sw.DeleteTableEntries(stale)
+        remove[name] = old
+
+    entries = computeRoutes(configs, version)
+    install = {name: [p4info_helper.buildTableEntry(**kwargs) for kwargs in entries[name]]
+               for name in switches}
+    flip = {name: versionEntry(p4info_helper, version) for name in switches}
+    print("Updating routes to version %d" % version)
+    makeBeforeBreak(switches, install, flip, remove, drain)
+
+
+def fabricNextHops(routes, edge_switches):
+    """
+    The transit part of one configuration's routes.
+
+    Every route towards a host that is not attached to the switch itself says
+    how that switch reaches the host's edge switch, and which router MAC the
+    packet gets on the way.
+
+    :param edge_switches: host IP -> the switch it is attached to
+    :returns: (switch, edge switch) -> (egress port, dst MAC)
+    """
+    next_hops = {}
+    for sw_name, dst_ip, dst_mac, egress_port in routes:
+        edge = edge_switches[dst_ip]
+        if sw_name != edge:
+            next_hops[(sw_name, edge)] = (egress_port, dst_mac)
+    return next_hops
+
+
+def sourceEntry(p4info_helper, host):
+    """The mrc_source entry that stops a learned host's packets being punted."""
+    return p4info_helper.buildTableEntry(
+        table_name="MyIngress.mrc_source",
+        match_fields={"hdr.ipv4.srcAddr": host.ip,
+                      "standard_metadata.ingress_port": host.port},
+        action_name="NoAction")
+
+
+def installHosts(p4info_helper, switches, next_hops, changes, idle_timeout=0):
+    """
+    Installs the routes of learned hosts in every configuration.
+
+    The edge switch delivers to the host's port and MAC; the others forward
+    towards the edge switch the way that configuration does. The edge switch
+    also stops punting the host's own packets, and a host that moved is
+    punted again at its old port. Entries are upserted: a host whose install
+    failed partway is learned again from its next packet, and goes in even
+    though some switches already hold its entries.
+
+    :param next_hops: fabricNextHops() of each configuration
+    :param changes: [(host, previous location or None), ...] from HostLearner
+    :param idle_timeout: if set, the edge switch entries age out after this
+                         many idle seconds (see LearnedHostAging)
+    """
+    inserts = {name: [] for name in switches}
+    modifies = {name: [] for name in switches}
+    sources = {name: [] for name in switches}
+    moved_sources = {name: [] for name in switches}
+    for host, previous in changes:
+        sources[host.switch].append(sourceEntry(p4info_helper, host))
+        if previous:
+            moved_sources[previous.switch].append(sourceEntry(p4info_helper, previous))
+        for config, config_next_hops in enumerate(next_hops):
+            for sw_name in switches:
+                if sw_name == host.switch:
+                    egress_port, dst_mac = host.port, host.mac
+                else:
+                    egress_port, dst_mac = config_next_hops[(sw_name, host.switch)]
+                entry = p4info_helper.buildTableEntry(
+                    **mrcEntry(mrcDiffserv(config, INITIAL_VERSION), host.ip, dst_mac,
+                               egress_port))
+                if idle_timeout and sw_name == host.switch:
+                    setIdleTimeout(entry, idle_timeout)
+                (modifies if previous else inserts)[sw_name].append(entry)
+    for sw_name, sw in switches.items():
+        if inserts[sw_name]:
+            sw.UpsertTableEntries(inserts[sw_name])
+        if modifies[sw_name]:
+            sw.UpsertTableEntries(modifies[sw_name], update_type=p4runtime_pb2.Update.MODIFY)
+    # Routes first, so that the host's packets are punted until they can be
+    # answered
+    for sw_name, sw in switches.items():
+        if moved_sources[sw_name]:
+            sw.UpsertTableEntries(moved_sources[sw_name], update_type=p4runtime_pb2.Update.DELETE)
+    for sw_name, sw in switches.items():
+        if sources[sw_name]:
+            sw.UpsertTableEntries(sources[sw_name])
+
+
+class LearnedHostAging(object):
+    """
+    Removes learned hosts that went quiet, from every switch.
+
+    Only the edge switch entries of a host carry an idle timeout. Traffic
+    takes one configuration at a time, so the host is removed once its edge
+    entries have idled in all configurations, each notification being at most
+    two timeouts old; until then the notified entries are just remembered.
+    """
+
+    def __init__(self, p4info_helper, switches, learner, idle_timeout, num_configs):
+        self.p4info_helper = p4info_helper
+        self.switches = switches
+        self.learner = learner
+        self.idle_timeout = idle_timeout
+        self.diffservs = set(mrcDiffserv(config, INITIAL_VERSION)
+                             for config in range(num_configs))
+        self.idle = {}
+        self.dst_field_id = p4info_helper.get_match_field(MRC_TABLE, "hdr.ipv4.dstAddr").id
+        self.diffserv_field_id = p4info_helper.get_match_field(MRC_TABLE, "hdr.ipv4.diffserv").id
+
+    def expire(self, sw_name, table_entries):
+        now = monotonic()
+        for table_entry in table_entries:
+            fields = {match.field_id: match for match in table_entry.match}
+            ip = socket.inet_ntoa(fields[self.dst_field_id].lpm.value)
+            diffserv = int.from_bytes(fields[self.diffserv_field_id].exact.value, 'big')
+            host = self.learner.hosts.get(ip)
+            # Ignore notifications from before a host moved
+            if host is not None and host.switch == sw_name:
+                self.idle.setdefault(ip, {})[diffserv] = now
+
+        gone = [ip for ip, marks in self.idle.items()
+                if self.diffservs <= {d for d, at in marks.items()
+                                      if now - at < 2 * self.idle_timeout}]
+        if not gone:
+            return
+        for sw in self.switches.values():
+            sw.DeleteTableEntries([
+                self.p4info_helper.buildTableEntry(
+                    table_name=MRC_TABLE,
+                    match_fields={"hdr.ipv4.dstAddr": (ip, 32), "hdr.ipv4.diffserv": diffserv})
+                for ip in gone for diffserv in sorted(self.diffservs)])
+        sources = {}
+        for ip in gone:
+            host = self.learner.hosts.get(ip)
+            if host is not None:
+                sources.setdefault(host.switch, []).append(sourceEntry(self.p4info_helper, host))
+        for sw_name, entries in sources.items():
+            self.switches[sw_name].DeleteTableEntries(entries)
+        self.learner.forget(gone)
+        for ip in gone:
+            del self.idle[ip]
+            print("Expired idle host %s" % ip)
+
+
+def learnHosts(p4info_helper, switches, configs, topo, idle_timeout=0):
+    """
+    Installs host routes as hosts show up instead of from the route tables.
+
+    Packets to unknown destinations are punted; their senders are learned and
+    routed in all configurations. With idle_timeout, hosts that stop sending
+    are removed again.
+
+    :returns: the running HostLearner
+    """
+    edge_switches = topo.edgeSwitches()
+    next_hops = [fabricNextHops(routes, edge_switches) for routes in configs]
+
+    for sw in switches.values():
+        sw.WriteTableEntries([
+            p4info_helper.buildTableEntry(
+                table_name=table_name,
+                default_action=True,
+                action_name="MyIngress.send_to_cpu")
+            for table_name in (MRC_TABLE, "MyIngress.mrc_source")])
+        print("Punting unknown destinations and senders to the controller on %s" % sw.name)
+
+    learner = HostLearner(switches, p4info_helper,
+                          lambda changes: installHosts(p4info_helper, switches, next_hops,
+                                                       changes, idle_timeout),
+                          fabric_ports=topo.fabricPorts())
+    learner.start()
+    if idle_timeout:
+        aging = LearnedHostAging(p4info_helper, switches, learner, idle_timeout, len(configs))
+        IdleTimeoutAger(switches, aging.expire).start()
+    return learner
+
+
+class MrcProtection(object):
+    """
+    Steers traffic around failed links into MRC backup configurations.
+
+    When a link goes down, both of its switches get an mrc_select entry for
+    every destination whose default route leaves through it, re-marking that
+    traffic into the first backup configuration whose path from there avoids
+    all failed links. mrc_select re-marks packets from local hosts and transit
+    packets still in the default configuration alike, so traffic from any
+    source is steered; downstream switches just follow the new diffserv. When
+    links come back the entries are removed again. Each change is one Write
+    per affected switch, sent to all of them at once in the failover class of
+    their UpdateScheduler, ahead of any route install still queued there.
+    """
+
+    def __init__(self, p4info_helper, switches, configs, topo, schedulers):
+        self.p4info_helper = p4info_helper
+        self.switches = switches
+        self.schedulers = schedulers
+        self.egress_ports = [{(sw_name, dst_ip): egress_port
+                              for sw_name, dst_ip, _, egress_port in routes}
+                             for routes in configs]
+        self.link_at = {}
+        for link in topo.links:
+            self.link_at[(link.switch1, link.port1)] = link
+            self.link_at[(link.switch2, link.port2)] = link
+        self.failed = set()
+        self.steering = {name: {} for name in switches}
+
+    def path(self, config, sw_name, dst_ip):
+        """The links traffic for dst_ip takes from sw_name in a configuration."""
+        links = []
+        for _ in range(len(self.switches)):
+            egress_port = self.egress_ports[config].get((sw_name, dst_ip))
+            if egress_port is None:
+                return None
+            link = self.link_at.get((sw_name, egress_port))
+            if link is None:
+                # Delivered to the host
+                return links
+            links.append(link)
+            sw_name = link.switch2 if link.switch1 == sw_name else link.switch1
+        return None
+
+    def desiredSteering(self):
+        """Switch name -> {destination: configuration} for the failed links."""
+        desired = {name: {} for name in self.switches}
+        for link in self.failed:
+            for sw_name, port in ((link.switch1, link.port1), (link.switch2, link.port2)):
+                for (route_sw, dst_ip), egress_port in self.egress_ports[0].items():
+                    if route_sw != sw_name or egress_port != port:
+                        continue
+                    for config in range(1, len(self.egress_ports)):
+                        path = self.path(config, sw_name, dst_ip)
+                        if path is not None and not self.failed.intersection(path):
+                            desired[sw_name][dst_ip] = config
+                            break
+                    else:
+                        print("No backup configuration reaches %s from %s" % (dst_ip, sw_name))
+        return desired
+
+    def selectEntry(self, dst_ip, config=None):
+        # set_config only rewrites the configuration bits of diffserv
+        return self.p4info_helper.buildTableEntry(
+            table_name="MyIngress.mrc_select",
+            match_fields={"hdr.ipv4.dstAddr": (dst_ip, 32)},
+            action_name="MyIngress.set_config" if config is not None else None,
+            action_params={"config": config} if config is not None else None)
+
+    def onLinkChange(self, link, up):
+        print("Link %s-p%d <-> %s-p%d is %s" % (link.switch1, link.port1, link.switch2,
+                                                 link.port2, "up" if up else "DOWN"))
+        if up:
+            self.failed.discard(link)
+        else:
+            self.failed.add(link)
+
+        desired = self.desiredSteering()
+        submitted = {}
+        for sw_name in self.switches:
+            current, wanted = self.steering[sw_name], desired[sw_name]
+            updates = []
+            for dst_ip, config in sorted(wanted.items()):
+                if current.get(dst_ip) != config:
+                    update = p4runtime_pb2.Update()
+                    update.type = (p4runtime_pb2.Update.MODIFY if dst_ip in current
+                                   else p4runtime_pb2.Update.INSERT)
+                    update.entity.table_entry.CopyFrom(self.selectEntry(dst_ip, config))
+                    updates.append(update)
+            for dst_ip in sorted(set(current) - set(wanted)):
+                update = p4runtime_pb2.Update()
+                update.type = p4runtime_pb2.Update.DELETE
+                update.entity.table_entry.CopyFrom(self.selectEntry(dst_ip))
+                updates.append(update)
+            submitted[sw_name] = [self.schedulers[sw_name].submit(update, FAILOVER)
+                                  for update in updates]
+        for sw_name, futures in submitted.items():
+            wanted = desired[sw_name]
+            if futures:
+                error = waitAll(futures)
+                if error is not None:
+                    print("Steering on %s failed: %s (%s)" % (sw_name, error.details(),
+                                                              error.code().name))
+                    continue
+                print("Steering on %s: %s" % (sw_name, ", ".join(
+                    "%s -> config %d" % item for item in sorted(wanted.items())) or "none"))
+            self.steering[sw_name] = wanted
+
+
+def routeAuditor(p4info_helper, switches, configs):
+    """
+    An Auditor holding the MRC routes each switch should have, of the route
+    version the switches stamp now.
+    """
+    version = stampedVersion(p4info_helper, next(iter(switches.values())))
+    entries = computeRoutes(configs, version)
+    return Auditor(p4info_helper, switches,
+                   {name: [p4info_helper.buildTableEntry(**kwargs) for kwargs in entries[name]]
+                    for name in switches})
+
+
+def auditRoutes(p4info_helper, auditor):
+    """Compares every switch with its routes and prints what drifted."""
+    drifted = 0
+    for name, drift in sorted(auditor.audit().items()):
+        if drift:
+            drifted += 1
+            print(drift.describe(p4info_helper, auditor.prefix_bits))
+    print("Audited %d switches: %d drifted" % (len(auditor.expected), drifted))
+
+
+class RouteAccounting(object):
+    """
+    Sweeps the direct counters of ipv4_mrc every `interval` seconds and
+    appends the traffic per (switch, destination, configuration) to a
+    memory-mapped p4ctl.timeseries file; print its rates with
+    ``python3 -m p4ctl.timeseries <file>``.
+
+    The file holds running totals: each sweep adds what every entry counted
+    since the previous one, so entries replaced by --update or aged out do
+    not make the totals go back, and a restarted controller carries on from
+    the last sample. The first sweep only takes the counters as a baseline.
+    """
+
+    def __init__(self, p4info_helper, switches, configs, path, interval=DEFAULT_SWEEP):
+        # NumPy is only needed here
+        from p4ctl.timeseries import TimeSeries
+
+        self.p4info_helper = p4info_helper
+        self.switches = switches
+        self.interval = interval
+        self.names = sorted(switches)
+        dsts = sorted(set(dst_ip for routes in configs for _, dst_ip, _, _ in routes),
+                      key=socket.inet_aton)
+        self.dsts = {dst_ip: i for i, dst_ip in enumerate(dsts)}
+        self.series = TimeSeries.openOrCreate(path, [
+            ('switch', self.names), ('dst', dsts), ('config', list(range(len(configs))))])
+        self.packets, self.octets = self.series.totals()
+        self.dst_field = p4info_helper.get_match_field_id(MRC_TABLE, "hdr.ipv4.dstAddr")
+        self.diffserv_field = p4info_helper.get_match_field_id(MRC_TABLE, "hdr.ipv4.diffserv")
+        self.last = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='route-accounting', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops sweeping, once a sweep in progress has been appended."""
+        self.stopped.set()
+        self.thread.join()
+
+    def _cell(self, entry):
+        """The (destination, configuration) index of an entry, or None."""
+        fields = {m.field_id: m for m in entry.match}
+        if self.dst_field not in fields or self.diffserv_field not in fields:
+            return None
+        dst_ip = socket.inet_ntoa(fields[self.dst_field].lpm.value.rjust(4, b'\0'))
+        diffserv = int.from_bytes(fields[self.diffserv_field].exact.value, 'big')
+        config = (diffserv & ((1 << VERSION_SHIFT) - 1)) >> 2
+        if dst_ip not in self.dsts or config >= self.series.shape[2]:
+            return None
+        return self.dsts[dst_ip], config
+
+    def sweep(self):
+        """Reads every switch's route counters and appends one sample."""
+        seen = {}
+        for s, name in enumerate(self.names):
+            for entry in readEntries(self.switches[name], self.p4info_helper, [MRC_TABLE]):
+                cell = self._cell(entry)
+                if cell is None:
+                    continue
+                key = (name, tuple(sorted(m.SerializeToString(deterministic=True)
+                                          for m in entry.match)))
+                counts = (entry.counter_data.packet_count, entry.counter_data.byte_count)
+                seen[key] = counts
+                if self.last is None:
+                    continue
+                # An entry that is new, or was replaced, counted from zero
+                last = self.last.get(key, (0, 0))
+                if counts[0] < last[0] or counts[1] < last[1]:
+                    last = (0, 0)
+                self.packets[(s,) + cell] += counts[0] - last[0]
+                self.octets[(s,) + cell] += counts[1] - last[1]
+        first, self.last = self.last is None, seen
+        if not first:
+            self.series.append(time(), self.packets, self.octets)
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except grpc.RpcError as e:
+                printGrpcError(e)
+            if self.stopped.wait(self.interval):
+                return
+
+
+def routeService(p4info_helper, switches, configs, topo, schedulers=None, auditor=None):
+    """
+    A RouteService for ipv4_mrc: feeds send routes of configuration i, which
+    go in under the route version the switches stamp now. With --protect the
+    routes queue behind steering in the switches' UpdateSchedulers, and with
+    --audit they join the routes the auditor expects.
+    """
+    version = stampedVersion(p4info_helper, next(iter(switches.values())))
+    table = RouteTable(p4info_helper, MRC_TABLE, config_field="hdr.ipv4.diffserv",
+                       config_values=[mrcDiffserv(config, version)
+                                      for config in range(len(configs))])
+    return RouteService(p4info_helper, switches, table, switchPorts(topo),
+                        schedulers=schedulers,
+                        on_written=auditor.applyUpdates if auditor else None)
 
 
 def readTableRules(p4info_helper, sw):
@@ -81,229 +815,126 @@ def readTableRules(p4info_helper, sw):
             print('-----')
 
 
-def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+def writeMetrics(metrics, metrics_file_path):
+    metrics.printSummary()
+    metrics.write(metrics_file_path)
+    print("Wrote RPC metrics to %s" % metrics_file_path)
+
+
+def main(p4info_file_path, bmv2_file_path, configs, workers, metrics_file_path=None,
+         topo_file_path='./topology.json', learn=False, idle_timeout=0, protect=False,
+         update=False, drain=DEFAULT_DRAIN, audit=0, accounting_file_path=None,
+         sweep=DEFAULT_SWEEP, northbound=None):
+    # Phases are always timed; RPCs only on request, so that without
+    # --metrics nothing is hooked into the channels
+    metrics = Metrics()
+    topo = Topology.load(topo_file_path)
+
+    if workers > 1:
+        # Routes are computed once here; each worker process installs its
+        # share of the switches while holding their mastership
+        with metrics.phase('compute'):
+            entries = computeRoutes(configs)
+            for name, ingress in ingressEntries(topo).items():
+                entries[name] = ingress + entries[name]
+        with metrics.phase('install'):
+            installSharded(SWITCHES, entries, p4info_file_path, bmv2_file_path,
+                           workers=workers,
+                           metrics=metrics if metrics_file_path else None)
+        if metrics_file_path:
+            writeMetrics(metrics, metrics_file_path)
+        return
+
+    # Instantiate a P4Runtime helper from the p4info file (or its cache)
+    p4info_helper = CachedP4InfoHelper(p4info_file_path)
+    accounting = None
+    feeds = None
 
     try:
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
-        s4 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s4',
-            address='127.0.0.1:50054',
-            device_id=3,
-            proto_dump_file='logs/s4-p4runtime-requests.txt')
-        s5 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s5',
-            address='127.0.0.1:50055',
-            device_id=4,
-            proto_dump_file='logs/s5-p4runtime-requests.txt')
-        s6 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s6',
-            address='127.0.0.1:50056',
-            device_id=5,
-            proto_dump_file='logs/s6-p4runtime-requests.txt')
-
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
-        s4.MasterArbitrationUpdate()
-        s5.MasterArbitrationUpdate()
-        s6.MasterArbitrationUpdate()
-
-
-        # Install the P4 program on the switches
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-        s4.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s4")
-        s5.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s5")
-
-        s6.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s6")
-
-        # ====================================================================== default (ipv4_lpm1) ============================================
-        #write S1 rules
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:11", egress_port=1)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=3) #from s3 -> s6 -> s4
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S2 rules
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:22", egress_port=1)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=4)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S3 rules
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:33", egress_port=1)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=4)
-
-        #write S4 rules
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:44", egress_port=1)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S5 rules
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:55", egress_port=1)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S6 rules
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=2)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=3)
-        writeIPV4LpmDefault(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:66", egress_port=1)
-
-        # ============================================================backup1 (ipv4_lpm2)=========================================================
-        #write S1 rules
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:11", egress_port=1)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=3) 
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S2 rules
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:22", egress_port=1)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S3 rules
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:33", egress_port=1)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=4)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=4)
-
-        #write S4 rules
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:44", egress_port=1)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=2)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S5 rules
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:55", egress_port=1)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S6 rules
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=2)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=3)
-        writeBackup_1(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:66", egress_port=1)
-
-
-        #================================================================== backup2 (ipv4_lpm3) =============================================
-        #write S1 rules
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:11", egress_port=1)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=2) 
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s1, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=2)
-
-        #write S2 rules
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:22", egress_port=1)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=4)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s2, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=4)
-
-        #write S3 rules
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:33", egress_port=1)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=4)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s3, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=4)
-
-        #write S4 rules
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:44", egress_port=1)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s4, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S5 rules
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=2)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:55", egress_port=1)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s5, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:00", egress_port=3)
-
-        #write S6 rules
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.1.1", dst_mac="08:00:00:00:01:00", egress_port=3)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.2.2", dst_mac="08:00:00:00:02:00", egress_port=3)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.3.3", dst_mac="08:00:00:00:03:00", egress_port=3)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.4.4", dst_mac="08:00:00:00:04:00", egress_port=4)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.5.5", dst_mac="08:00:00:00:05:00", egress_port=3)
-        writeBackup_2(p4info_helper=p4info_helper, ingress_sw=s6, dst_ip="10.0.6.6", dst_mac="08:00:00:00:06:66", egress_port=1)
-
-
-
-        # TODO Uncomment the following two lines to read table entries from s1 and s2
-        # readTableRules(p4info_helper, s1)
-        # readTableRules(p4info_helper, s2)
-        # readTableRules(p4info_helper, s3)
-        # readTableRules(p4info_helper, s4)
-        # readTableRules(p4info_helper, s5)
-        # readTableRules(p4info_helper, s6)
+        with metrics.phase('bring-up'):
+            switches = {}
+            for spec in SWITCHES:
+                switches[spec.name] = ControllerConnection(
+                    name=spec.name,
+                    address=spec.address,
+                    device_id=spec.device_id)
+                logRequests(switches[spec.name], 'logs/%s-p4runtime-requests.bin' % spec.name)
+                if metrics_file_path:
+                    instrument(switches[spec.name], metrics, p4info_helper)
+
+            for sw in switches.values():
+                sw.MasterArbitrationUpdate()
+
+
+            # Install the P4 program on the switches (--update keeps the
+            # running one and its entries)
+            if not update:
+                for sw in switches.values():
+                    sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                                   bmv2_json_file_path=bmv2_file_path)
+                    print("Installed P4 Program using SetForwardingPipelineConfig on %s" % sw.name)
+                for name, ingress in ingressEntries(topo).items():
+                    switches[name].WriteTableEntries(
+                        [p4info_helper.buildTableEntry(**kwargs) for kwargs in ingress])
+                    print("Marked %d host ports on %s, stamping route version %d" % (
+                        len(ingress) - 1, name, INITIAL_VERSION))
+
+        schedulers = {}
+        if protect:
+            # Monitoring starts before the install, whose routes are queued as
+            # bulk work behind any steering a link failure calls for
+            for name, sw in switches.items():
+                schedulers[name] = UpdateScheduler(sw)
+                schedulers[name].start()
+            protection = MrcProtection(p4info_helper, switches, configs, topo, schedulers)
+            LinkMonitor(switches, p4info_helper, topo.links, protection.onLinkChange).start()
+            print("Monitoring %d links" % len(topo.links))
+
+        learner = None
+        if update:
+            with metrics.phase('update'):
+                updateRoutes(p4info_helper, switches, configs, drain)
+        elif learn:
+            learner = learnHosts(p4info_helper, switches, configs, topo, idle_timeout)
+        elif schedulers:
+            with metrics.phase('install'):
+                queueMrcRoutes(p4info_helper, schedulers, configs)
+        else:
+            with metrics.phase('install'):
+                # All configurations go into ipv4_mrc, told apart by diffserv
+                for config, routes in enumerate(configs):
+                    for sw_name, dst_ip, dst_mac, egress_port in routes:
+                        writeMrcRoute(p4info_helper=p4info_helper, ingress_sw=switches[sw_name],
+                                      config=config, dst_ip=dst_ip, dst_mac=dst_mac,
+                                      egress_port=egress_port)
+
+        auditor = routeAuditor(p4info_helper, switches, configs) if audit else None
+
+        if accounting_file_path:
+            accounting = RouteAccounting(p4info_helper, switches, configs,
+                                         accounting_file_path, sweep)
+            accounting.start()
+            print("Sweeping route counters into %s every %g s" % (accounting_file_path, sweep))
+
+        if northbound:
+            routes = routeService(p4info_helper, switches, configs, topo, schedulers, auditor)
+            feeds = serveRoutes(routes, northbound)
+            print("Taking route feeds on %s" % northbound)
+
+        while learn or protect or auditor or accounting or feeds:
+            sleep(audit or 10)
+            if learner:
+                print("packet-ins: %(packet_ins)d, rate limited: %(rate_limited)d, "
+                      "duplicates: %(duplicates)d, learned: %(learned)d, "
+                      "moved: %(moved)d" % learner.stats)
+            if auditor:
+                auditRoutes(p4info_helper, auditor)
+            if feeds:
+                print(routes.describe())
+
+        # TODO Uncomment the following line to read table entries from all switches
+        # for sw in switches.values():
+        #     readTableRules(p4info_helper, sw)
 
 
     except KeyboardInterrupt:
@@ -311,7 +942,14 @@ def main(p4info_file_path, bmv2_file_path):
     except grpc.RpcError as e:
         printGrpcError(e)
 
+    if feeds:
+        stopServing(feeds, routes)
+        print(routes.describe())
+    if accounting:
+        accounting.stop()
     ShutdownAllSwitchConnections()
+    if metrics_file_path:
+        writeMetrics(metrics, metrics_file_path)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='P4Runtime Controller')
@@ -321,6 +959,50 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/mrc.json')
+    parser.add_argument('--workers', help='install with this many worker processes',
+                        type=int, action="store", required=False,
+                        default=1)
+    parser.add_argument('--metrics', help='write RPC latency metrics to this file '
+                        '(.json for JSON, otherwise Prometheus text format)',
+                        type=str, action="store", required=False,
+                        default=None)
+    parser.add_argument('--learn', help='learn hosts from packet-ins instead of installing '
+                        'the static routes; needs the switches to run with --cpu-port 255',
+                        action="store_true", required=False)
+    parser.add_argument('--protect', help='monitor links with probes and steer traffic into '
+                        'MRC backup configurations when they fail; needs --cpu-port 255',
+                        action="store_true", required=False)
+    parser.add_argument('--topo', help='topology file: the host ports, and the links for '
+                        '--learn and --protect',
+                        type=str, action="store", required=False,
+                        default='./topology.json')
+    parser.add_argument('--idle-timeout', help='with --learn, remove hosts idle for this '
+                        'many seconds', type=float, action="store", required=False,
+                        default=0)
+    parser.add_argument('--routes', help='JSON file with the routes of each MRC configuration '
+                        '(default: the built-in default and two backups)',
+                        type=str, action="store", required=False,
+                        default=None)
+    parser.add_argument('--update', help='replace the routes of running switches with '
+                        '--routes make-before-break, without pushing the pipeline',
+                        action="store_true", required=False)
+    parser.add_argument('--drain', help='with --update, seconds between flipping to the new '
+                        'routes and removing the old ones', type=float, action="store",
+                        required=False, default=DEFAULT_DRAIN)
+    parser.add_argument('--audit', help='after installing or updating the routes, check '
+                        'every this many seconds that the switches still hold them',
+                        type=float, action="store", required=False, default=0)
+    parser.add_argument('--accounting', help='keep sweeping the route counters into this '
+                        'time series file, per switch, destination and configuration '
+                        '(show it with: python3 -m p4ctl.timeseries <file>)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--sweep', help='with --accounting, seconds between two sweeps',
+                        type=float, action="store", required=False, default=DEFAULT_SWEEP)
+    parser.add_argument('--northbound', help='after installing the routes, take more from '
+                        'route feeds on this unix socket (default: %s; feed a dump with: '
+                        'python3 -m p4ctl.northbound <file>)' % ROUTES_SOCKET,
+                        type=str, action="store", required=False, nargs='?',
+                        const=ROUTES_SOCKET, default=None)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -331,4 +1013,23 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
+    try:
+        configs = loadConfigs(args.routes) if args.routes else MRC_CONFIGS
+    except ValueError as e:
+        parser.error(str(e))
+    if args.update and (args.learn or args.protect):
+        parser.error("--update replaces static routes; it cannot be combined with "
+                     "--learn or --protect")
+    if args.audit and (args.learn or args.protect):
+        parser.error("--audit checks static routes; it cannot be combined with "
+                     "--learn or --protect")
+    if args.workers > 1 and (args.learn or args.protect or args.update or args.audit
+                             or args.accounting or args.northbound):
+        parser.error("--workers only applies to the initial install; it cannot be "
+                     "combined with --learn, --protect, --update, --audit, --accounting "
+                     "or --northbound")
+    if args.northbound and args.learn:
+        parser.error("--northbound feeds static routes; it cannot be combined with --learn")
+    main(args.p4info, args.bmv2_json, configs, args.workers, args.metrics,
+         args.topo, args.learn, args.idle_timeout, args.protect, args.update, args.drain,
+         args.audit, args.accounting, args.sweep, args.northbound)
@@ -10,10 +10,15 @@ from time import sleep
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../'))
 import p4runtime_lib.bmv2
 from p4runtime_lib.error_utils import printGrpcError
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
-import p4runtime_lib.helper
+from p4ctl.msglog import logRequests
+from p4ctl.p4info_cache import CachedP4InfoHelper
 
 
 def writeForwardRules(p4info_helper, ingress_sw, dst_eth_addr,
@@ -41,26 +46,26 @@ def printGrpcError(e):
 
 
 def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    # Instantiate a P4Runtime helper from the p4info file (or its cache)
+    p4info_helper = CachedP4InfoHelper(p4info_file_path)
 
     try:
 
         s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s1',
             address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
+            device_id=0)
+        logRequests(s1, 'logs/s1-p4runtime-requests.bin')
         s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s2',
             address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
+            device_id=1)
+        logRequests(s2, 'logs/s2-p4runtime-requests.bin')
         s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s3',
             address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+            device_id=2)
+        logRequests(s3, 'logs/s3-p4runtime-requests.bin')
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
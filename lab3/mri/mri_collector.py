@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Collector for sampled MRI (mri.p4 with mycontroller.py --sample).
+
+With sampling on, the switch where a packet enters from a host traces only
+one packet in N (``packets``), or every packet of one flow in N (``flows``,
+a hash of the address pair and protocol); the others travel without the MRI
+option. N is set per switch and per destination prefix by a
+``SamplingPlan``, which the controller installs and this collector reads to
+scale what it sees: each traced packet stands for N packets, so packet
+counts are multiplied by N and queue depths averaged with N as the weight.
+
+The switch that decided is the first hop, whose record is the last of the
+trace (each hop pushes its own in front); switch IDs are taken to be those
+mycontroller.py gives, ``i`` for ``si``.
+
+Run on a host, next to or instead of receive.py:
+
+    ./mri_collector.py --sample 16
+    ./mri_collector.py --sampling sampling.json --interval 10
+
+Sampling plan JSON, per switch a default and per-prefix exceptions:
+
+    {"s1": {"one_in": 16, "mode": "packets",
+            "prefixes": {"10.0.3.0/24": {"one_in": 4, "mode": "flows"}}},
+     "s2": {"one_in": 16}}
+"""
+import argparse
+import collections
+import json
+import os
+import socket
+import struct
+import sys
+from time import monotonic
+
+IPV4_OPTION_MRI = 31
+ETH_P_IP = 0x0800
+
+SAMPLE_MODES = ('packets', 'flows')
+
+Rate = collections.namedtuple('Rate', ['one_in', 'mode'])
+
+
+def _ip2int(addr):
+    return struct.unpack('!I', socket.inet_aton(addr))[0]
+
+
+def _rate(spec, default=Rate(1, 'packets')):
+    """A Rate from N or {"one_in": N, "mode": ...}, missing keys from default."""
+    if isinstance(spec, int):
+        rate = Rate(spec, default.mode)
+    else:
+        rate = Rate(int(spec.get('one_in', default.one_in)), spec.get('mode', default.mode))
+    if rate.one_in < 1 or rate.mode not in SAMPLE_MODES:
+        raise ValueError("bad sampling rate %r" % (spec,))
+    return rate
+
+
+class SamplingPlan(object):
+    """
+    Which packets each switch traces: switch name -> (default Rate,
+    list of (prefix, prefix length, Rate)); the name '*' stands for any
+    switch not listed.
+    """
+
+    def __init__(self, switches):
+        self.switches = switches
+
+    @classmethod
+    def uniform(cls, one_in, mode='packets'):
+        return cls({'*': (_rate({'one_in': one_in, 'mode': mode}), [])})
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            plan = json.load(f)
+        switches = {}
+        for name, spec in plan.items():
+            default = _rate(spec)
+            prefixes = []
+            exceptions = spec.get('prefixes', {}) if isinstance(spec, dict) else {}
+            for prefix, rate in exceptions.items():
+                addr, _, length = prefix.partition('/')
+                socket.inet_aton(addr)
+                prefixes.append((addr, int(length or 32), _rate(rate, default)))
+            switches[name] = (default, prefixes)
+        return cls(switches)
+
+    def rules(self, name):
+        """The (prefix, prefix length, Rate) of a switch, the default as prefix length 0."""
+        if name not in self.switches:
+            name = '*'
+            if name not in self.switches:
+                return []
+        default, prefixes = self.switches[name]
+        return [('0.0.0.0', 0, default)] + prefixes
+
+    def oneIn(self, name, dst):
+        """N for a packet to dst that entered at switch `name` (1 if not sampled)."""
+        dst = _ip2int(dst)
+        best, one_in = -1, 1
+        for prefix, length, rate in self.rules(name):
+            mask = (0xffffffff << (32 - length)) & 0xffffffff
+            if length > best and (dst ^ _ip2int(prefix)) & mask == 0:
+                best, one_in = length, rate.one_in
+        return one_in
+
+
+def parseMri(frame):
+    """
+    The MRI trace of an Ethernet frame.
+
+    :returns: (src, dst, list of (swid, qdepth), last hop first), or None if
+              the frame carries no MRI option
+    """
+    if len(frame) < 34 or struct.unpack_from('!H', frame, 12)[0] != ETH_P_IP:
+        return None
+    ihl = frame[14] & 0x0f
+    if ihl <= 5 or len(frame) < 14 + 4 * ihl or frame[34] & 0x1f != IPV4_OPTION_MRI:
+        return None
+    src = socket.inet_ntoa(frame[26:30])
+    dst = socket.inet_ntoa(frame[30:34])
+    count = struct.unpack_from('!H', frame, 36)[0]
+    hops = [struct.unpack_from('!II', frame, 38 + 8 * i) for i in range(count)
+            if 38 + 8 * (i + 1) <= len(frame)]
+    return src, dst, hops
+
+
+class MriStats(object):
+    """Traced packets of an interval, scaled by their sampling rate."""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.reset()
+
+    def reset(self):
+        self.traced = 0
+        self.estimated = 0
+        # swid -> [weighted qdepth sum, weight, max qdepth, samples]
+        self.queues = collections.defaultdict(lambda: [0, 0, 0, 0])
+
+    def add(self, src, dst, hops):
+        if not hops:
+            return
+        one_in = self.plan.oneIn('s%d' % hops[-1][0], dst) if self.plan else 1
+        self.traced += 1
+        self.estimated += one_in
+        for swid, qdepth in hops:
+            queue = self.queues[swid]
+            queue[0] += qdepth * one_in
+            queue[1] += one_in
+            queue[2] = max(queue[2], qdepth)
+            queue[3] += 1
+
+    def report(self, seconds):
+        print('\n----- last %.1f s -----' % seconds)
+        print('traced %d packets, standing for about %d packets (%.1f/s)' % (
+            self.traced, self.estimated, self.estimated / seconds if seconds else 0.0))
+        for swid, (total, weight, deepest, samples) in sorted(self.queues.items()):
+            print('s%d: qdepth mean %.2f, max %d over %d samples' % (
+                swid, total / weight, deepest, samples))
+
+
+def capture(iface):
+    """Frames received on an interface (needs root, as receive.py)."""
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+    sock.bind((iface, 0))
+    sock.settimeout(1.0)
+    while True:
+        try:
+            yield sock.recv(65535)
+        except socket.timeout:
+            yield None
+
+
+def main(iface, plan, interval):
+    stats = MriStats(plan)
+    started = monotonic()
+    print("Collecting MRI on %s" % iface)
+    try:
+        for frame in capture(iface):
+            trace = parseMri(frame) if frame is not None else None
+            if trace is not None:
+                stats.add(*trace)
+            now = monotonic()
+            if now - started >= interval:
+                stats.report(now - started)
+                stats.reset()
+                started = now
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sampled MRI collector')
+    parser.add_argument('--iface', help='interface to listen on (default: the first eth)',
+                        type=str, action="store", required=False, default=None)
+    rates = parser.add_mutually_exclusive_group()
+    rates.add_argument('--sample', help='every switch traces 1 in this many packets',
+                       type=int, action="store", default=None)
+    rates.add_argument('--sampling', help='sampling plan JSON, as given to mycontroller.py',
+                       type=str, action="store", default=None)
+    parser.add_argument('--interval', help='seconds between reports',
+                        type=float, action="store", required=False, default=5.0)
+    args = parser.parse_args()
+
+    if args.sampling:
+        plan = SamplingPlan.load(args.sampling)
+    elif args.sample:
+        plan = SamplingPlan.uniform(args.sample)
+    else:
+        plan = None
+    iface = args.iface
+    if iface is None:
+        ifaces = [i for i in os.listdir('/sys/class/net/') if 'eth' in i]
+        if not ifaces:
+            sys.exit("no eth interface found; use --iface")
+        iface = ifaces[0]
+    main(iface, plan, args.interval)
@@ -10,11 +10,39 @@ from time import sleep
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../'))
 import p4runtime_lib.bmv2
 from p4runtime_lib.error_utils import printGrpcError
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
-import p4runtime_lib.helper
-
+from p4ctl.msglog import logRequests
+from p4ctl.northbound import (DEFAULT_SOCKET as ROUTES_SOCKET, RouteService, RouteTable,
+                              serveRoutes, stopServing)
+from p4ctl.p4info_cache import CachedP4InfoHelper
+from mri_collector import SamplingPlan
+
+# Ports facing hosts: where packets enter the network, and where MRI
+# sampling decides whether they carry a trace
+HOST_PORTS = {
+    's1': [1, 2],
+    's2': [1, 2],
+    's3': [1],
+}
+
+# Ports towards the other switches; with HOST_PORTS, the ports routes from
+# --northbound feeds may use
+FABRIC_PORTS = {
+    's1': [3, 4],
+    's2': [3, 4],
+    's3': [2, 3],
+}
+
+SAMPLE_ACTIONS = {
+    'packets': "MyIngress.mri_sample_packets",
+    'flows': "MyIngress.mri_sample_flows",
+}
 
 
 def writeForwardRules(p4info_helper, ingress_sw, dst_eth_addr,
@@ -48,6 +76,31 @@ def writeForwardRules(p4info_helper, ingress_sw, dst_eth_addr,
 
 
 
+def writeSamplingRules(p4info_helper, ingress_sw, host_ports, rules):
+    """
+    Makes a switch trace only some of the packets entering from its hosts.
+
+    :param rules: (prefix, prefix length, Rate) as SamplingPlan.rules()
+                  gives them; prefix length 0 is the switch default
+    """
+    for port in host_ports:
+        for prefix, length, rate in rules:
+            match_fields = {"standard_metadata.ingress_port": port}
+            if length:
+                # A zero-length LPM match is left out (don't care)
+                match_fields["hdr.ipv4.dstAddr"] = (prefix, length)
+            table_entry = p4info_helper.buildTableEntry(
+                table_name="MyIngress.mri_sample",
+                match_fields=match_fields,
+                action_name=SAMPLE_ACTIONS[rate.mode],
+                action_params={
+                    "one_in": rate.one_in
+                })
+            ingress_sw.WriteTableEntry(table_entry)
+    print("Installed %d mri_sample rules on %s" % (len(host_ports) * len(rules),
+                                                   ingress_sw.name))
+
+
 def printGrpcError(e):
     print("gRPC Error:", e.details(), end=' ')
     status_code = e.code()
@@ -57,27 +110,28 @@ def printGrpcError(e):
 
 
 
-def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+def main(p4info_file_path, bmv2_file_path, sampling=None, northbound=None):
+    # Instantiate a P4Runtime helper from the p4info file (or its cache)
+    p4info_helper = CachedP4InfoHelper(p4info_file_path)
+    feeds = None
 
     try:
 
         s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s1',
             address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
+            device_id=0)
+        logRequests(s1, 'logs/s1-p4runtime-requests.bin')
         s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s2',
             address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
+            device_id=1)
+        logRequests(s2, 'logs/s2-p4runtime-requests.bin')
         s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s3',
             address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+            device_id=2)
+        logRequests(s3, 'logs/s3-p4runtime-requests.bin')
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
@@ -125,6 +179,24 @@ def main(p4info_file_path, bmv2_file_path):
         writeForwardRules(p4info_helper, ingress_sw=s3, dst_eth_addr="08:00:00:00:02:00",
                                     dst_ip_addr="10.0.2.0", port=3, swid=3, match=24)
 
+        # Trace only a sample of the packets (default: all that ask for it)
+        if sampling is not None:
+            for sw in (s1, s2, s3):
+                if sampling.rules(sw.name):
+                    writeSamplingRules(p4info_helper, sw, HOST_PORTS[sw.name],
+                                       sampling.rules(sw.name))
+
+        # Routes beyond the ones above come from route feeds
+        if northbound:
+            routes = RouteService(p4info_helper, {'s1': s1, 's2': s2, 's3': s3},
+                                  RouteTable(p4info_helper, "MyIngress.ipv4_lpm"),
+                                  {name: HOST_PORTS[name] + FABRIC_PORTS[name]
+                                   for name in HOST_PORTS})
+            feeds = serveRoutes(routes, northbound)
+            print("Taking route feeds on %s" % northbound)
+            while True:
+                sleep(10)
+                print(routes.describe())
 
 
     except KeyboardInterrupt:
@@ -132,6 +204,9 @@ def main(p4info_file_path, bmv2_file_path):
     except grpc.RpcError as e:
         printGrpcError(e)
 
+    if feeds:
+        stopServing(feeds, routes)
+        print(routes.describe())
     ShutdownAllSwitchConnections()
 
 if __name__ == '__main__':
@@ -142,6 +217,20 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/mri.json')
+    rates = parser.add_mutually_exclusive_group()
+    rates.add_argument('--sample', help='trace only 1 in this many packets entering '
+                       'from hosts, on every switch (read them with mri_collector.py)',
+                       type=int, action="store", required=False, default=None)
+    rates.add_argument('--sampling', help='sampling plan JSON with rates per switch and '
+                       'destination prefix (see mri_collector.py)',
+                       type=str, action="store", required=False, default=None)
+    parser.add_argument('--sample-flows', help='with --sample, trace all packets of 1 in '
+                        'N flows instead of 1 in N packets',
+                        action="store_true", required=False)
+    parser.add_argument('--northbound', help='after installing the routes, take more from '
+                        'route feeds on this unix socket (default: %s)' % ROUTES_SOCKET,
+                        type=str, action="store", required=False, nargs='?',
+                        const=ROUTES_SOCKET, default=None)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -152,4 +241,13 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    sampling = None
+    try:
+        if args.sampling:
+            sampling = SamplingPlan.load(args.sampling)
+        elif args.sample is not None:
+            sampling = SamplingPlan.uniform(args.sample,
+                                            'flows' if args.sample_flows else 'packets')
+    except (OSError, ValueError) as e:
+        parser.error("bad sampling plan: %s" % e)
+    main(args.p4info, args.bmv2_json, sampling, args.northbound)
\ No newline at end of file
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Offline model of the ECMP member selection of load_balance.p4.
+
+``set_ecmp_select`` picks the ecmp_nhop entry of a packet with
+
+    hash(meta.ecmp_select, HashAlgorithm.crc16, ecmp_base,
+         { srcAddr, dstAddr, protocol, tcp.srcPort, tcp.dstPort }, ecmp_count);
+
+i.e. ``ecmp_base + crc16(13 key bytes) % ecmp_count``. This tool computes the
+same hash for whole arrays of flow tuples (p4ctl.sketch.crc16, in chunks) and
+reports how they spread over the members before anything is installed: the
+load of every member, the worst imbalance against what a random assignment
+of as many flows would give, and for other group sizes the imbalance and the
+share of flows that would move to another member.
+
+The parser only extracts TCP, so for any other protocol the port fields are
+invalid and hash as 0, as on the switch. Rows of a pcap are packets, so its
+loads are packet loads; .npz/.npy files and --synthetic are one row per flow.
+
+Example:
+    ./ecmp_analyzer.py --synthetic 20000000 --count 2 --compare 3,4
+    ./ecmp_analyzer.py --pcap trace.pcap --count 3 --fields src,dst
+"""
+import argparse
+import math
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../'))
+from p4ctl.pcap import PROTO_TCP, loadFlows, syntheticFlows
+from p4ctl.sketch import crc16, crc32, packColumns
+
+# Hashable fields: flow column, bytes on the wire
+HASH_FIELDS = {
+    'src': ('src', 4),
+    'dst': ('dst', 4),
+    'proto': ('proto', 1),
+    'sport': ('sport', 2),
+    'dport': ('dport', 2),
+}
+# The field list of set_ecmp_select, in order
+DEFAULT_FIELDS = ('src', 'dst', 'proto', 'sport', 'dport')
+
+ALGORITHMS = {
+    'crc16': crc16,
+    'crc32': crc32,
+}
+
+CHUNK_SIZE = 1 << 18
+
+
+def flowHashes(flows, fields=DEFAULT_FIELDS, algorithm='crc16'):
+    """
+    The hash of every flow, before the modulo.
+
+    :param fields: names from HASH_FIELDS, in the order of the P4 field list
+    :param algorithm: a name from ALGORITHMS
+    :returns: uint32 array
+    """
+    hash_function = ALGORITHMS[algorithm]
+    hashes = np.empty(len(flows), dtype=np.uint32)
+    for start in range(0, len(flows), CHUNK_SIZE):
+        chunk = flows[start:start + CHUNK_SIZE]
+        tcp = chunk['proto'] == PROTO_TCP
+        columns = []
+        for name in fields:
+            column, width = HASH_FIELDS[name]
+            values = chunk[column]
+            if column in ('sport', 'dport'):
+                values = np.where(tcp, values, 0)
+            columns.append((values, width))
+        hashes[start:start + CHUNK_SIZE] = hash_function(packColumns(columns))
+    return hashes
+
+
+def memberLoads(hashes, count):
+    """Flows per member: index i is the ecmp_nhop entry ecmp_base + i."""
+    return np.bincount(hashes % np.uint32(count), minlength=count)
+
+
+def imbalance(loads):
+    """The busiest member's load over the mean load."""
+    mean = loads.sum() / len(loads)
+    return loads.max() / mean if mean else 0.0
+
+
+def randomImbalance(total, count):
+    """
+    About the imbalance() a uniformly random assignment of `total` flows to
+    `count` members gives (normal approximation of the largest bin).
+    """
+    if count < 2 or not total:
+        return 1.0
+    mean = total / count
+    deviation = math.sqrt(mean * (1 - 1 / count))
+    return (mean + deviation * math.sqrt(2 * math.log(count))) / mean
+
+
+def movedShare(hashes, old_count, new_count):
+    """The share of flows whose member changes from one group size to another."""
+    moved = 0
+    for start in range(0, len(hashes), CHUNK_SIZE):
+        chunk = hashes[start:start + CHUNK_SIZE]
+        moved += np.count_nonzero(chunk % np.uint32(old_count) != chunk % np.uint32(new_count))
+    return moved / len(hashes) if len(hashes) else 0.0
+
+
+def _share(part, total):
+    return 100.0 * part / total if total else 0.0
+
+
+def printReport(hashes, count, compare):
+    total = len(hashes)
+    loads = memberLoads(hashes, count)
+    print('\n----- ecmp_count %d -----' % count)
+    for member, load in enumerate(loads):
+        print('member %d: %d (%.2f%%)' % (member, load, _share(load, total)))
+    print('imbalance (max/mean): %.4f, random assignment: about %.4f' % (
+        imbalance(loads), randomImbalance(total, count)))
+    print('least loaded member: %.4f of the mean' % (
+        loads.min() / (total / count) if total else 0.0))
+
+    if compare:
+        print('\n----- other group sizes -----')
+        for other in compare:
+            other_loads = memberLoads(hashes, other)
+            print('ecmp_count %d: imbalance %.4f (random: about %.4f), '
+                  '%.2f%% of flows change member' % (
+                      other, imbalance(other_loads), randomImbalance(total, other),
+                      100.0 * movedShare(hashes, count, other)))
+
+
+def main(args):
+    if args.pcap:
+        flows = loadFlows(args.pcap)
+    elif args.flows:
+        flows = loadFlows(args.flows)
+    else:
+        # h1 to the load-balanced address, as in the exercise
+        flows = syntheticFlows(args.synthetic, seed=args.seed, dst_addrs=['10.0.0.1'],
+                               dst_ports=[80, 443, 5001], udp_fraction=0)
+
+    start = perf_counter()
+    hashes = flowHashes(flows, args.fields, args.algorithm)
+    elapsed = perf_counter() - start
+
+    print('%s over %s' % (args.algorithm, ', '.join(args.fields)))
+    printReport(hashes, args.count, args.compare)
+    print('\nhashed %d flows in %.3f s (%.1f Mflows/s)' % (
+        len(flows), elapsed, len(flows) / elapsed / 1e6 if elapsed else 0.0))
+
+
+def _fieldList(text):
+    fields = tuple(text.split(','))
+    unknown = [name for name in fields if name not in HASH_FIELDS]
+    if unknown or not fields:
+        raise argparse.ArgumentTypeError("unknown hash fields %s; choose from %s" % (
+            ', '.join(unknown), ', '.join(HASH_FIELDS)))
+    return fields
+
+
+def _countList(text):
+    counts = [int(value) for value in text.split(',')]
+    if any(count < 1 for count in counts):
+        raise argparse.ArgumentTypeError("group sizes must be positive: %r" % text)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline ECMP hash distribution analyzer')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--pcap', help='libpcap capture to analyze',
+                        type=str, action="store")
+    source.add_argument('--flows', help='.npz/.npy flow tuples to analyze',
+                        type=str, action="store")
+    source.add_argument('--synthetic', help='number of synthetic flows to analyze',
+                        type=int, action="store", default=1000000)
+    parser.add_argument('--seed', help='seed for --synthetic',
+                        type=int, action="store", default=0)
+    parser.add_argument('--count', help='ecmp_count of the group',
+                        type=int, action="store", default=2)
+    parser.add_argument('--compare', help='other group sizes to compare, e.g. 1,3,4',
+                        type=_countList, action="store", default=[])
+    parser.add_argument('--fields', help='hash field list, in order (default: %s)' %
+                        ','.join(DEFAULT_FIELDS),
+                        type=_fieldList, action="store", default=DEFAULT_FIELDS)
+    parser.add_argument('--algorithm', help='hash algorithm',
+                        choices=sorted(ALGORITHMS), default='crc16')
+    args = parser.parse_args()
+
+    if args.count < 1:
+        parser.error("--count must be positive")
+    main(args)
@@ -10,14 +10,37 @@ from time import sleep
 sys.path.append(
     os.path.join(os.path.dirname(os.path.abspath(__file__)),
                  '../../utils/'))
-import p4runtime_lib.bmv2
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../'))
 from p4runtime_lib.error_utils import printGrpcError
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
-import p4runtime_lib.helper
+from p4.v1 import p4runtime_pb2
+from p4ctl.msglog import logRequests
+from p4ctl.p4info_cache import CachedP4InfoHelper
+from p4ctl.switch import ControllerConnection
+
+
 
+def ecmpGroupAction(ecmp_count, flowlet_timeout=0):
+    """
+    The action of an ecmp_group entry: per-flow hashing, or with a flowlet
+    timeout (microseconds), hashing per flowlet.
+    """
+    if flowlet_timeout:
+        return "MyIngress.set_ecmp_flowlet", {
+            "ecmp_base": 0,
+            "ecmp_count": ecmp_count,
+            "flowlet_timeout": flowlet_timeout
+        }
+    return "MyIngress.set_ecmp_select", {
+        "ecmp_base": 0,
+        "ecmp_count": ecmp_count
+    }
 
 
-def writeEcmpGroupRules(p4info_helper, ingress_sw, dst_ip_addr, ecmp_count):
+def writeEcmpGroupRules(p4info_helper, ingress_sw, dst_ip_addr, ecmp_count, flowlet_timeout=0):
 
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyIngress.ecmp_group",
@@ -26,20 +49,33 @@ def writeEcmpGroupRules(p4info_helper, ingress_sw, dst_ip_addr, ecmp_count):
         action_params={})
     ingress_sw.WriteTableEntry(table_entry)
 
+    action_name, action_params = ecmpGroupAction(ecmp_count, flowlet_timeout)
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyIngress.ecmp_group",
         match_fields={
             "hdr.ipv4.dstAddr": (dst_ip_addr, 32)
         },
-        action_name="MyIngress.set_ecmp_select",
-        action_params={
-            "ecmp_base": 0,
-            "ecmp_count": ecmp_count
-        })
+        action_name=action_name,
+        action_params=action_params)
     ingress_sw.WriteTableEntry(table_entry)
     print("Installed ingress ecmp_group rule on %s" % ingress_sw.name)
 
 
+def setFlowletTimeout(p4info_helper, ingress_sw, dst_ip_addr, ecmp_count, flowlet_timeout):
+    """Retunes the flowlet timeout of an installed group (0: per-flow hashing)."""
+    action_name, action_params = ecmpGroupAction(ecmp_count, flowlet_timeout)
+    table_entry = p4info_helper.buildTableEntry(
+        table_name="MyIngress.ecmp_group",
+        match_fields={
+            "hdr.ipv4.dstAddr": (dst_ip_addr, 32)
+        },
+        action_name=action_name,
+        action_params=action_params)
+    ingress_sw.WriteTableEntries([table_entry], update_type=p4runtime_pb2.Update.MODIFY)
+    print("Set flowlet timeout of %s on %s to %d us" % (
+        dst_ip_addr, ingress_sw.name, flowlet_timeout))
+
+
 def writeEcmpNhopRules(p4info_helper, ingress_sw, ecmp_select, nhop_dmac, nhop_ipv4, port):
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyIngress.ecmp_nhop",
@@ -80,27 +116,27 @@ def printGrpcError(e):
 
 
 
-def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+def main(p4info_file_path, bmv2_file_path, flowlet_timeout=0, retune=False):
+    # Instantiate a P4Runtime helper from the p4info file (or its cache)
+    p4info_helper = CachedP4InfoHelper(p4info_file_path)
 
     try:
 
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+        s1 = ControllerConnection(
             name='s1',
             address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+            device_id=0)
+        logRequests(s1, 'logs/s1-p4runtime-requests.bin')
+        s2 = ControllerConnection(
             name='s2',
             address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+            device_id=1)
+        logRequests(s2, 'logs/s2-p4runtime-requests.bin')
+        s3 = ControllerConnection(
             name='s3',
             address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+            device_id=2)
+        logRequests(s3, 'logs/s3-p4runtime-requests.bin')
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
@@ -108,6 +144,12 @@ def main(p4info_file_path, bmv2_file_path):
         s2.MasterArbitrationUpdate()
         s3.MasterArbitrationUpdate()
 
+        if retune:
+            # Only s1 balances over more than one path
+            setFlowletTimeout(p4info_helper, s1, dst_ip_addr="10.0.0.1", ecmp_count=2,
+                              flowlet_timeout=flowlet_timeout)
+            ShutdownAllSwitchConnections()
+            return
 
         # Install the P4 program on the switches
         s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
@@ -121,7 +163,8 @@ def main(p4info_file_path, bmv2_file_path):
         print("Installed P4 Program using SetForwardingPipelineConfig on s3")
 
         # s1
-        writeEcmpGroupRules(p4info_helper, ingress_sw=s1, dst_ip_addr="10.0.0.1", ecmp_count=2)
+        writeEcmpGroupRules(p4info_helper, ingress_sw=s1, dst_ip_addr="10.0.0.1", ecmp_count=2,
+                            flowlet_timeout=flowlet_timeout)
         writeEcmpNhopRules(p4info_helper, ingress_sw=s1, ecmp_select=0, nhop_dmac="08:00:00:00:01:02", nhop_ipv4="10.0.2.2", port=2)
         writeEcmpNhopRules(p4info_helper, ingress_sw=s1, ecmp_select=1, nhop_dmac="08:00:00:00:01:03", nhop_ipv4="10.0.3.3", port=3)
         writeSendFrameRules(p4info_helper, ingress_sw=s1, egress_port=2, smac="00:00:00:01:02:00")
@@ -156,14 +199,20 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/load_balance.json')
+    parser.add_argument('--flowlet-timeout', help='balance s1 per flowlet: a flow may change '
+                        'path after a pause of this many microseconds (a few times the '
+                        'difference in path delays, e.g. 50000); 0 hashes per flow',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--retune', help='only set --flowlet-timeout on the running s1',
+                        action="store_true", required=False)
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
         parser.print_help()
         print("\np4info file not found: %s\nHave you run 'make'?" % args.p4info)
         parser.exit(1)
-    if not os.path.exists(args.bmv2_json):
+    if not args.retune and not os.path.exists(args.bmv2_json):
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    main(args.p4info, args.bmv2_json, args.flowlet_timeout, args.retune)
\ No newline at end of file
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Offline model of the ACL exercise pipeline (acl.p4).
+
+Loads the ``MyIngress.ipv4_lpm`` and ``MyIngress.acl`` entries from a runtime
+file such as ``topo/s1-acl.json`` and classifies flow tuples the way the switch
+would, without starting BMv2:
+
+    ipv4_lpm.apply();   // longest prefix on hdr.ipv4.dstAddr, default drop
+    acl.apply();        // ternary on dstAddr/udp.dstPort, highest priority wins
+
+The ternary table is compiled into a bit-vector classifier: rules are sorted by
+priority, and for every 8-bit slice of every key field a 256-row table holds
+the bitmap of rules that slice value can match. Classifying a flow is one AND
+per slice and a find-first-set, done for whole arrays of flows at once.
+
+Example:
+    ./acl_classifier.py --runtime topo/s1-acl.json --pcap trace.pcap
+    ./acl_classifier.py --runtime new-acl.json --baseline topo/s1-acl.json \\
+                        --flows sample.npz
+"""
+import argparse
+import json
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../'))
+from p4ctl.pcap import PROTO_UDP, int2ip, ip2int, loadFlows, syntheticFlows
+
+LPM_TABLE = "MyIngress.ipv4_lpm"
+ACL_TABLE = "MyIngress.acl"
+DROP_ACTION = "MyIngress.drop"
+
+# acl key field -> (flow column, bitwidth)
+ACL_KEY_FIELDS = {
+    "hdr.ipv4.dstAddr": ('dst', 32),
+    "hdr.udp.dstPort": ('dport', 16),
+}
+
+CHUNK_SIZE = 1 << 18
+
+
+def parseValue(value):
+    """Decodes a runtime JSON match value (int, dotted quad or MAC)."""
+    if isinstance(value, int):
+        return value
+    if '.' in value:
+        return ip2int(value)
+    if ':' in value:
+        return int(value.replace(':', ''), 16)
+    return int(value, 0)
+
+
+class AclRule(object):
+    """One ternary entry of the acl table."""
+
+    def __init__(self, index, priority, action_name, values, masks):
+        self.index = index
+        self.priority = priority
+        self.action_name = action_name
+        self.values = values
+        self.masks = masks
+
+    def __str__(self):
+        keys = []
+        for field, (column, bitwidth) in ACL_KEY_FIELDS.items():
+            if self.masks[column]:
+                value = self.values[column]
+                if bitwidth == 32:
+                    value = int2ip(value)
+                keys.append("%s=%s&&&0x%x" % (field, value, self.masks[column]))
+        return "%s prio %d -> %s" % (' '.join(keys) or '*', self.priority,
+                                     self.action_name)
+
+
+class BitVectorClassifier(object):
+    """
+    Priority-ordered ternary classifier over a fixed set of key columns.
+
+    :param rules: AclRule objects; ties in priority keep their input order
+    :param fields: list of (column, bitwidth) making up the key
+    """
+
+    def __init__(self, rules, fields):
+        self.rules = sorted(rules, key=lambda r: -r.priority)
+        self.fields = fields
+        self.words = max(1, (len(self.rules) + 63) // 64)
+        self.tables = []
+        byte_values = np.arange(256, dtype=np.uint64)[:, None]
+        for column, bitwidth in fields:
+            values = np.array([r.values[column] for r in self.rules], dtype=np.uint64)
+            masks = np.array([r.masks[column] for r in self.rules], dtype=np.uint64)
+            for shift in range(0, bitwidth, 8):
+                v = (values >> np.uint64(shift)) & np.uint64(0xff)
+                m = (masks >> np.uint64(shift)) & np.uint64(0xff)
+                matches = (byte_values & m[None, :]) == (v & m)[None, :]
+                self.tables.append((column, shift, self._pack(matches)))
+
+    def _pack(self, matches):
+        bits = np.zeros((256, self.words * 64), dtype=bool)
+        bits[:, :matches.shape[1]] = matches
+        packed = np.packbits(bits, axis=1, bitorder='little')
+        return np.ascontiguousarray(packed).view('<u8')
+
+    def classify(self, keys):
+        """
+        Finds the highest-priority matching rule for every flow.
+
+        :param keys: dict of column -> uint array, all the same length
+        :returns: int32 array of rule indices into self.rules, -1 on miss
+        """
+        count = len(next(iter(keys.values())))
+        result = np.empty(count, dtype=np.int32)
+        for start in range(0, count, CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, count)
+            acc = None
+            for column, shift, table in self.tables:
+                slices = (keys[column][start:stop] >> shift) & 0xff
+                hits = table[slices]
+                if acc is None:
+                    acc = hits
+                else:
+                    acc &= hits
+            result[start:stop] = self._firstSet(acc)
+        return result
+
+    def _firstSet(self, acc):
+        nonzero = acc != 0
+        word_idx = np.argmax(nonzero, axis=1)
+        word = acc[np.arange(len(acc)), word_idx]
+        lowest = word & (~word + np.uint64(1))
+        bit = np.log2(np.maximum(lowest, 1).astype(np.float64)).astype(np.int32)
+        first = word_idx.astype(np.int32) * 64 + bit
+        first[~nonzero.any(axis=1)] = -1
+        return first
+
+
+class LpmClassifier(object):
+    """
+    Longest-prefix match over 32-bit addresses.
+
+    Prefixes are grouped by length; each group is a sorted array searched with
+    np.searchsorted, longest group first, for the flows still unresolved.
+
+    :param prefixes: list of (address int, prefix length, entry index)
+    """
+
+    def __init__(self, prefixes):
+        self.groups = []
+        for length in sorted({p[1] for p in prefixes}, reverse=True):
+            mask = ((1 << 32) - 1) ^ ((1 << (32 - length)) - 1)
+            keyed = {}
+            for addr, plen, index in prefixes:
+                if plen == length:
+                    keyed.setdefault(addr & mask, index)
+            keys = np.array(sorted(keyed), dtype=np.uint32)
+            indices = np.array([keyed[k] for k in keys.tolist()], dtype=np.int32)
+            self.groups.append((np.uint32(mask), keys, indices))
+
+    def lookup(self, addrs):
+        result = np.full(len(addrs), -1, dtype=np.int32)
+        pending = np.arange(len(addrs))
+        for mask, keys, indices in self.groups:
+            if not len(pending):
+                break
+            masked = addrs[pending] & mask
+            pos = np.minimum(np.searchsorted(keys, masked), len(keys) - 1)
+            hit = keys[pos] == masked
+            result[pending[hit]] = indices[pos[hit]]
+            pending = pending[~hit]
+        return result
+
+
+class AclPipeline(object):
+    """The ipv4_lpm + acl control flow of acl.p4, built from runtime entries."""
+
+    def __init__(self, table_entries):
+        self.entries = table_entries
+        self.lpm_default = DROP_ACTION
+        prefixes = []
+        rules = []
+        for index, entry in enumerate(table_entries):
+            if entry['table'] == LPM_TABLE:
+                if entry.get('default_action'):
+                    self.lpm_default = entry['action_name']
+                    continue
+                addr, length = entry['match']['hdr.ipv4.dstAddr']
+                prefixes.append((parseValue(addr), length, index))
+            elif entry['table'] == ACL_TABLE:
+                if entry.get('default_action'):
+                    raise ValueError("entry %d: changing the acl default action "
+                                     "is not modelled" % index)
+                values = {}
+                masks = {}
+                for field, (column, _) in ACL_KEY_FIELDS.items():
+                    value, mask = entry.get('match', {}).get(field, (0, 0))
+                    masks[column] = parseValue(mask)
+                    values[column] = parseValue(value) & masks[column]
+                unknown = set(entry.get('match', {})) - set(ACL_KEY_FIELDS)
+                if unknown:
+                    raise ValueError("entry %d: unknown acl key %s" % (index, sorted(unknown)))
+                rules.append(AclRule(index, entry.get('priority', 0),
+                                     entry['action_name'], values, masks))
+        self.lpm = LpmClassifier(prefixes)
+        self.acl = BitVectorClassifier(rules, list(ACL_KEY_FIELDS.values()))
+        self._acl_entry = np.array([r.index for r in self.acl.rules] + [-1], dtype=np.int32)
+        self._acl_drops = np.array([r.action_name == DROP_ACTION for r in self.acl.rules] +
+                                   [False])
+        self._lpm_drops = np.zeros(len(table_entries) + 1, dtype=bool)
+        for _, _, index in prefixes:
+            self._lpm_drops[index] = table_entries[index]['action_name'] == DROP_ACTION
+        self._lpm_drops[-1] = self.lpm_default == DROP_ACTION
+
+    @classmethod
+    def fromRuntimeJson(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)['table_entries'])
+
+    def classify(self, flows):
+        """
+        Runs flows through the pipeline.
+
+        hdr.udp is only valid for UDP packets; reading a field of an invalid
+        header is unspecified in P4_16, and the model reads it as 0.
+
+        :param flows: a p4ctl.pcap.FLOW_DTYPE array
+        :returns: (lpm entry index, acl entry index, dropped) arrays; entry
+                  indices point into the runtime file's table_entries, -1
+                  means the table missed
+        """
+        keys = {
+            'dst': flows['dst'],
+            'dport': np.where(flows['proto'] == PROTO_UDP, flows['dport'], 0).astype(np.uint16),
+        }
+        lpm_entry = self.lpm.lookup(flows['dst'])
+        acl_rule = self.acl.classify(keys)
+        acl_entry = self._acl_entry[acl_rule]
+        dropped = self._lpm_drops[lpm_entry] | self._acl_drops[acl_rule]
+        return lpm_entry, acl_entry, dropped
+
+
+def _share(count, total):
+    return 100.0 * count / total if total else 0.0
+
+
+def printReport(pipeline, flows, lpm_entry, acl_entry, dropped):
+    total = len(flows)
+    entries = pipeline.entries
+    print('\n----- %s -----' % LPM_TABLE)
+    hits = np.bincount(lpm_entry + 1, minlength=len(entries) + 1)
+    for index, entry in enumerate(entries):
+        if entry['table'] == LPM_TABLE and not entry.get('default_action'):
+            addr, length = entry['match']['hdr.ipv4.dstAddr']
+            print('#%d %s/%d -> %s: %d flows (%.2f%%)' % (
+                index, addr, length, entry['action_name'],
+                hits[index + 1], _share(hits[index + 1], total)))
+    print('miss -> %s: %d flows (%.2f%%)' % (pipeline.lpm_default, hits[0],
+                                              _share(hits[0], total)))
+
+    print('\n----- %s -----' % ACL_TABLE)
+    hits = np.bincount(acl_entry + 1, minlength=len(entries) + 1)
+    for rule in pipeline.acl.rules:
+        print('#%d %s: %d flows (%.2f%%)' % (rule.index, rule, hits[rule.index + 1],
+                                            _share(hits[rule.index + 1], total)))
+    print('miss -> NoAction: %d flows (%.2f%%)' % (hits[0], _share(hits[0], total)))
+
+    print('\n----- verdict -----')
+    acl_dropped = np.isin(acl_entry, [r.index for r in pipeline.acl.rules
+                                      if r.action_name == DROP_ACTION])
+    print('dropped: %d of %d flows (%.2f%%)' % (dropped.sum(), total,
+                                                _share(dropped.sum(), total)))
+    print('  by %s: %d' % (LPM_TABLE, (dropped & ~acl_dropped).sum()))
+    print('  by %s: %d' % (ACL_TABLE, acl_dropped.sum()))
+
+
+def printVerdictChanges(flows, baseline_dropped, dropped, limit=10):
+    newly_dropped = dropped & ~baseline_dropped
+    newly_forwarded = baseline_dropped & ~dropped
+    print('\n----- changes against baseline -----')
+    print('newly dropped: %d flows, newly forwarded: %d flows' % (
+        newly_dropped.sum(), newly_forwarded.sum()))
+    for label, selected in (('dropped', newly_dropped), ('forwarded', newly_forwarded)):
+        for flow in flows[selected][:limit]:
+            print('  now %s: %s -> %s proto %d dport %d' % (
+                label, int2ip(flow['src']), int2ip(flow['dst']), flow['proto'], flow['dport']))
+
+
+def main(args):
+    if args.pcap:
+        flows = loadFlows(args.pcap)
+    elif args.flows:
+        flows = loadFlows(args.flows)
+    else:
+        flows = syntheticFlows(args.synthetic, seed=args.seed,
+                               dst_addrs=['10.0.1.%d' % i for i in range(1, 6)],
+                               dst_ports=[53, 80, 443, 8080])
+
+    pipeline = AclPipeline.fromRuntimeJson(args.runtime)
+    start = perf_counter()
+    lpm_entry, acl_entry, dropped = pipeline.classify(flows)
+    elapsed = perf_counter() - start
+
+    printReport(pipeline, flows, lpm_entry, acl_entry, dropped)
+    print('\nclassified %d flows in %.3f s (%.1f Mflows/s)' % (
+        len(flows), elapsed, len(flows) / elapsed / 1e6 if elapsed else 0.0))
+
+    if args.baseline:
+        _, _, baseline_dropped = AclPipeline.fromRuntimeJson(args.baseline).classify(flows)
+        printVerdictChanges(flows, baseline_dropped, dropped)
+
+    if args.output:
+        np.savez(args.output, lpm_entry=lpm_entry, acl_entry=acl_entry, dropped=dropped)
+        print('per-flow results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline ACL pipeline classifier')
+    parser.add_argument('--runtime', help='runtime JSON with the table entries',
+                        type=str, action="store", required=False,
+                        default='topo/s1-acl.json')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--pcap', help='libpcap capture to classify',
+                        type=str, action="store")
+    source.add_argument('--flows', help='.npz/.npy flow tuples to classify',
+                        type=str, action="store")
+    source.add_argument('--synthetic', help='number of synthetic flows to classify',
+                        type=int, action="store", default=1000000)
+    parser.add_argument('--seed', help='seed for --synthetic',
+                        type=int, action="store", default=0)
+    parser.add_argument('--baseline', help='runtime JSON to compare verdicts against',
+                        type=str, action="store", required=False)
+    parser.add_argument('--output', help='write per-flow results to this .npz',
+                        type=str, action="store", required=False)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.runtime):
+        parser.print_help()
+        print("\nruntime file not found: %s" % args.runtime)
+        parser.exit(1)
+    main(args)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Controller for the ACL exercise (acl.p4) that keeps the acl priorities sparse.
+
+The runtime file (``topo/s1-acl.json``) gives the precedence of the acl rules:
+higher ``priority`` first, ties in file order, as in ``acl_classifier.py``.
+The priorities actually written to the switch come from a
+``p4ctl.priority.PriorityAllocator``, so editing the rule list later touches
+only the rules that changed, plus now and then a few neighbours that get
+respaced, instead of renumbering everything below an inserted rule.
+
+Example:
+    ./acl_controller.py                              # install s1 from scratch
+    ./acl_controller.py --sync new-acl.json          # apply an edited rule list
+    ./acl_controller.py --sync new-acl.json --dry-run
+"""
+import argparse
+import grpc
+import json
+import os
+import sys
+
+# Import P4Runtime lib from parent utils dir
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../utils/'))
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../'))
+from p4runtime_lib.error_utils import printGrpcError
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from p4.v1 import p4runtime_pb2
+from p4ctl.p4info_cache import CachedP4InfoHelper
+from p4ctl.pool import borrowConnection
+from p4ctl.priority import PriorityAllocator, deleteUpdate, insertUpdate, moveUpdates
+from p4ctl.reads import canonicalEntry, canonicalValue
+
+ACL_TABLE = "MyIngress.acl"
+
+
+def loadRuntime(p4info_helper, path):
+    """
+    Runtime file -> (other table entries, acl entries in precedence order).
+
+    The acl entries are returned without a priority.
+    """
+    with open(path) as f:
+        runtime = json.load(f)
+    others, acl = [], []
+    for index, rule in enumerate(runtime['table_entries']):
+        entry = p4info_helper.buildTableEntry(
+            table_name=rule['table'],
+            match_fields={field: tuple(value) if isinstance(value, list) else value
+                          for field, value in rule.get('match', {}).items()},
+            default_action=rule.get('default_action', False),
+            action_name=rule['action_name'],
+            action_params=rule['action_params'])
+        if rule['table'] == ACL_TABLE:
+            acl.append((-rule.get('priority', 0), index, entry))
+        else:
+            others.append(entry)
+    return others, [entry for _, _, entry in sorted(acl, key=lambda r: r[:2])]
+
+
+def ruleKey(entry):
+    """What identifies an acl rule regardless of its priority: its match."""
+    return tuple(sorted((m.field_id, canonicalValue(m.ternary.value),
+                         canonicalValue(m.ternary.mask)) for m in entry.match))
+
+
+def _sameAction(a, b):
+    return canonicalEntry(a).action == canonicalEntry(b).action
+
+
+def _modifyUpdate(entry, priority):
+    update = p4runtime_pb2.Update(type=p4runtime_pb2.Update.MODIFY)
+    update.entity.table_entry.CopyFrom(entry)
+    update.entity.table_entry.priority = priority
+    return update
+
+
+def _longestIncreasing(sequence):
+    """Indices into `sequence` of one of its longest increasing subsequences."""
+    tails, previous = [], [None] * len(sequence)
+    for i, value in enumerate(sequence):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if sequence[tails[mid]] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        previous[i] = tails[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+    result = []
+    i = tails[-1] if tails else None
+    while i is not None:
+        result.append(i)
+        i = previous[i]
+    return result[::-1]
+
+
+def syncAcl(p4info_helper, sw, desired, dry_run=False):
+    """
+    Makes the acl table of a switch hold `desired`, in that order.
+
+    Rules already installed in the right relative order keep their priority;
+    of the others, as few as possible are re-inserted at a new one. A rule
+    only ever changes priority by being inserted at the new one before it is
+    deleted at the old one, so no packet misses a rule while this runs.
+    """
+    table_id = p4info_helper.get_tables_id(ACL_TABLE)
+    installed = {}
+    for response in sw.ReadTableEntries(table_id=table_id):
+        for entity in response.entities:
+            installed[ruleKey(entity.table_entry)] = entity.table_entry
+
+    entries, order = {}, []
+    for entry in desired:
+        key = ruleKey(entry)
+        if key in entries:
+            raise ValueError("%s has the same match twice: %s" % (ACL_TABLE, entry))
+        entries[key] = entry
+        order.append(key)
+
+    allocator = PriorityAllocator()
+    allocator.load({key: entry.priority for key, entry in installed.items()})
+
+    # Kept rules in the longest run that is already in the right order stay
+    # where they are; the other kept rules are placed again like new ones
+    kept = [key for key in order if key in installed]
+    current = [allocator.index(key) for key in kept]
+    staying = set(kept[i] for i in _longestIncreasing(current))
+    for key in list(allocator.order):
+        if key not in staying:
+            allocator.remove(key)
+
+    updates, counts = [], dict(inserted=0, moved=0, modified=0, deleted=0)
+    for position, key in enumerate(order):
+        if key in staying:
+            if not _sameAction(installed[key], entries[key]):
+                # Respaced by now, if at all, with the new action already
+                updates.append(_modifyUpdate(entries[key], allocator.priorities[key]))
+                counts['modified'] += 1
+            continue
+        index = allocator.index(order[position - 1]) + 1 if position else 0
+        priority, moves = allocator.insert(key, index)
+        updates.extend(moveUpdates(entries, moves))
+        counts['moved'] += len(moves)
+        if key not in installed:
+            updates.append(insertUpdate(entries[key], priority))
+            counts['inserted'] += 1
+        elif priority != installed[key].priority:
+            updates.append(insertUpdate(entries[key], priority))
+            updates.append(deleteUpdate(installed[key], installed[key].priority))
+            counts['moved'] += 1
+        elif not _sameAction(installed[key], entries[key]):
+            # Landed on its old priority: already in place
+            updates.append(_modifyUpdate(entries[key], priority))
+            counts['modified'] += 1
+
+    # Stale rules go last, once everything that replaces them is in
+    for key, entry in installed.items():
+        if key not in entries:
+            updates.append(deleteUpdate(entry, entry.priority))
+            counts['deleted'] += 1
+
+    print("%s %s: %d inserted, %d moved, %d modified, %d deleted in %d updates%s" % (
+        sw.name, ACL_TABLE, counts['inserted'], counts['moved'], counts['modified'],
+        counts['deleted'], len(updates), " (dry run)" if dry_run else ""))
+    if updates:
+        # Applied in order: a rule is always in place before the one it
+        # replaces goes
+        sw.WriteUpdates(updates, dry_run=dry_run)
+    return counts
+
+
+def main(p4info_file_path, bmv2_file_path, runtime_file, address, device_id,
+         sync=False, dry_run=False):
+    # Instantiate a P4Runtime helper from the p4info file (or its cache)
+    p4info_helper = CachedP4InfoHelper(p4info_file_path)
+
+    try:
+        s1 = borrowConnection('s1', address, device_id)
+        if not dry_run:
+            s1.MasterArbitrationUpdate()
+
+        others, acl = loadRuntime(p4info_helper, runtime_file)
+        if not sync:
+            s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                           bmv2_json_file_path=bmv2_file_path,
+                                           dry_run=dry_run)
+            print("Installed P4 Program using SetForwardingPipelineConfig on s1")
+            s1.WriteTableEntries(others, dry_run=dry_run)
+            print("Installed %d forwarding rules on s1" % len(others))
+        syncAcl(p4info_helper, s1, acl, dry_run=dry_run)
+
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    except grpc.RpcError as e:
+        printGrpcError(e)
+
+    ShutdownAllSwitchConnections()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ACL exercise controller')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/acl.p4.p4info.txt')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/acl.json')
+    parser.add_argument('--runtime', help='runtime file with the rules to install',
+                        type=str, action="store", required=False,
+                        default='./topo/s1-acl.json')
+    parser.add_argument('--sync', help='only bring the acl of a running switch in line '
+                        'with this runtime file',
+                        type=str, action="store", required=False, metavar='RUNTIME')
+    parser.add_argument('--dry-run', help='print what would change, write nothing',
+                        action="store_true")
+    parser.add_argument('--address', help='P4Runtime address of s1',
+                        type=str, action="store", default='127.0.0.1:50051')
+    parser.add_argument('--device-id', help='P4Runtime device id of s1',
+                        type=int, action="store", default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.p4info):
+        parser.print_help()
+        print("\np4info file not found: %s\nHave you run 'make'?" % args.p4info)
+        parser.exit(1)
+    if not args.sync and not os.path.exists(args.bmv2_json):
+        parser.print_help()
+        print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.sync or args.runtime, args.address,
+         args.device_id, sync=bool(args.sync), dry_run=args.dry_run)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Finds the heaviest UDP flows through the ACL switch, and optionally blocks them.
+
+acl.p4 keeps a count-min sketch of UDP traffic per (dstAddr, udp.dstPort) in
+the counter arrays ``MyIngress.cms_row*``. Every epoch this harvests the
+sketch (p4ctl.sketch), estimates every (host, port) pair for the hosts in the
+runtime file's ipv4_lpm entries, all 65536 ports each, and prints the top-k.
+With ``--block``, flows above that many bytes per epoch get a drop rule in
+``MyIngress.acl``, all of an epoch in one write, below the existing rules.
+
+Estimates never undercount; a flow sharing its cells with heavy ones in every
+row is overestimated, so keep ``--block`` well above the normal rates.
+
+Example:
+    ./heavy_hitters.py --interval 5 --top 10
+    ./heavy_hitters.py --block 50000000          # > 10 MB/s at 5 s epochs
+"""
+import argparse
+import grpc
+import json
+import os
+import sys
+from time import sleep
+
+import numpy as np
+
+# Import P4Runtime lib from parent utils dir
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../utils/'))
+# Import the shared controller helpers from the repository root
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../'))
+from p4runtime_lib.error_utils import printGrpcError
+from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from p4ctl.p4info_cache import CachedP4InfoHelper
+from p4ctl.pcap import int2ip, ip2int
+from p4ctl.pool import borrowConnection
+from p4ctl.priority import PriorityAllocator, insertUpdate, moveUpdates
+from p4ctl.sketch import SketchHarvester, crc16, crc32, packColumns, topK
+from acl_controller import ACL_TABLE, ruleKey
+
+SKETCH_PREFIX = "MyIngress.cms_row"
+LPM_TABLE = "MyIngress.ipv4_lpm"
+
+
+def candidateFlows(runtime_file):
+    """(dst, dport) columns: every port of every host the switch routes to."""
+    with open(runtime_file) as f:
+        runtime = json.load(f)
+    hosts = sorted(set(ip2int(rule['match']['hdr.ipv4.dstAddr'][0])
+                       for rule in runtime['table_entries']
+                       if rule['table'] == LPM_TABLE and 'match' in rule))
+    dst = np.repeat(np.array(hosts, dtype=np.uint32), 1 << 16)
+    dport = np.tile(np.arange(1 << 16, dtype=np.uint32), len(hosts))
+    return dst, dport
+
+
+def sketchHashes(dst, dport):
+    """The hash of every flow in each sketch row, as cms_count() in acl.p4."""
+    key = packColumns([(dst, 4), (dport, 2)])
+    return [crc32(key), crc16(key), crc32(packColumns([(dport, 2), (dst, 4)]))]
+
+
+def blockFlows(p4info_helper, sw, flows):
+    """Adds a drop rule to the acl for each (dst, dport) not blocked yet."""
+    table_id = p4info_helper.get_tables_id(ACL_TABLE)
+    installed = {}
+    for response in sw.ReadTableEntries(table_id=table_id):
+        for entity in response.entities:
+            installed[ruleKey(entity.table_entry)] = entity.table_entry
+
+    new = {}
+    for dst, dport in flows:
+        entry = p4info_helper.buildTableEntry(
+            table_name=ACL_TABLE,
+            match_fields={"hdr.ipv4.dstAddr": (int2ip(dst), 0xffffffff),
+                          "hdr.udp.dstPort": (int(dport), 0xffff)},
+            action_name="MyIngress.drop",
+            action_params={})
+        if ruleKey(entry) not in installed:
+            new[ruleKey(entry)] = entry
+    if not new:
+        return 0
+
+    allocator = PriorityAllocator()
+    allocator.load({key: entry.priority for key, entry in installed.items()})
+    added, moves = allocator.extend(new)
+    updates = moveUpdates(installed, moves)
+    updates.extend(insertUpdate(new[key], priority) for key, priority in added)
+    sw.WriteUpdates(updates)
+    return len(new)
+
+
+def main(p4info_file_path, runtime_file, address, device_id, interval, top, block):
+    # Instantiate a P4Runtime helper from the p4info file (or its cache)
+    p4info_helper = CachedP4InfoHelper(p4info_file_path)
+
+    try:
+        s1 = borrowConnection('s1', address, device_id)
+        if block:
+            s1.MasterArbitrationUpdate()
+
+        harvester = SketchHarvester(s1, p4info_helper, SKETCH_PREFIX)
+        dst, dport = candidateFlows(runtime_file)
+        index = harvester.index(sketchHashes(dst, dport))
+        print("Sketch of %d x %d cells, %d candidate flows" % (
+            harvester.rows, harvester.width, len(dst)))
+
+        harvester.harvest()
+        while True:
+            sleep(interval)
+            packets, octets = harvester.harvest()
+            estimates = harvester.estimate(octets, index)
+            heaviest = [i for i in topK(estimates, top) if estimates[i] > 0]
+            print("\n----- Top %d UDP flows, bytes in the last %g s -----" % (top, interval))
+            for i in heaviest:
+                print("%s:%d\t%d" % (int2ip(dst[i]), dport[i], estimates[i]))
+            if block:
+                offenders = [(dst[i], dport[i]) for i in heaviest if estimates[i] > block]
+                if offenders:
+                    print("Blocked %d new flows" % blockFlows(p4info_helper, s1, offenders))
+
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    except grpc.RpcError as e:
+        printGrpcError(e)
+
+    ShutdownAllSwitchConnections()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ACL heavy-hitter harvester')
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default='./build/acl.p4.p4info.txt')
+    parser.add_argument('--runtime', help='runtime file whose ipv4_lpm hosts are watched',
+                        type=str, action="store", required=False,
+                        default='./topo/s1-acl.json')
+    parser.add_argument('--interval', help='seconds per epoch',
+                        type=float, action="store", default=5.0)
+    parser.add_argument('--top', help='flows to print per epoch',
+                        type=int, action="store", default=10)
+    parser.add_argument('--block', help='drop top flows with more than this many bytes '
+                        'per epoch', type=int, action="store", default=0)
+    parser.add_argument('--address', help='P4Runtime address of s1',
+                        type=str, action="store", default='127.0.0.1:50051')
+    parser.add_argument('--device-id', help='P4Runtime device id of s1',
+                        type=int, action="store", default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.p4info):
+        parser.print_help()
+        print("\np4info file not found: %s\nHave you run 'make'?" % args.p4info)
+        parser.exit(1)
+    main(args.p4info, args.runtime, args.address, args.device_id, args.interval,
+         args.top, args.block)
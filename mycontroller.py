@@ -13,7 +13,9 @@ sys.path.append(
 import p4runtime_lib.bmv2
 from p4runtime_lib.error_utils import printGrpcError
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
-import p4runtime_lib.helper
+from p4ctl.msglog import logRequests
+from p4ctl.p4info_cache import CachedP4InfoHelper
+from p4ctl.reads import readEntries
 
 SWITCH_TO_HOST_PORT = 1
 SWITCH_S1_TO_S2_PORT = 2
@@ -69,32 +71,35 @@ def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
     print("Installed egress tunnel rule on %s" % egress_sw.name)
 
 
-def readTableRules(p4info_helper, sw):
+def readTableRules(p4info_helper, sw, table_names=None, match_filter=None):
     """
-    Reads the table entries from all tables on the switch.
+    Reads the table entries from the switch, with their direct counters.
 
     :param p4info_helper: the P4Info helper
     :param sw: the switch connection
+    :param table_names: only these tables (default: all)
+    :param match_filter: only entries passing this p4ctl.reads.MatchFilter
     """
     print('\n----- Reading tables rules for %s -----' % sw.name)
-    for response in sw.ReadTableEntries():
-        for entity in response.entities:
-            entry = entity.table_entry
-            # TODO For extra credit, you can use the p4info_helper to translate
-            #      the IDs in the entry to names
-            table_name = p4info_helper.get_tables_name(entry.table_id)
-            print('%s: ' % table_name, end=' ')
-            for m in entry.match:
-                print(p4info_helper.get_match_field_name(table_name, m.field_id), end=' ')
-                print('%r' % (p4info_helper.get_match_field_value(m),), end=' ')
-            action = entry.action.action
-            action_name = p4info_helper.get_actions_name(action.action_id)
-            print('->', action_name, end=' ')
-            for p in action.params:
-                print(p4info_helper.get_action_param_name(action_name, p.param_id), end=' ')
-                print('%r' % p.value, end=' ')
-            print()
-            print('-----')
+    for entry in readEntries(sw, p4info_helper, table_names, match_filter):
+        # TODO For extra credit, you can use the p4info_helper to translate
+        #      the IDs in the entry to names
+        table_name = p4info_helper.get_tables_name(entry.table_id)
+        print('%s: ' % table_name, end=' ')
+        for m in entry.match:
+            print(p4info_helper.get_match_field_name(table_name, m.field_id), end=' ')
+            print('%r' % (p4info_helper.get_match_field_value(m),), end=' ')
+        action = entry.action.action
+        action_name = p4info_helper.get_actions_name(action.action_id)
+        print('->', action_name, end=' ')
+        for p in action.params:
+            print(p4info_helper.get_action_param_name(action_name, p.param_id), end=' ')
+            print('%r' % p.value, end=' ')
+        if entry.HasField('counter_data'):
+            print('[%d packets, %d bytes]' % (entry.counter_data.packet_count,
+                                              entry.counter_data.byte_count), end=' ')
+        print()
+        print('-----')
 
 
 def printCounter(p4info_helper, sw, counter_name, index):
@@ -117,28 +122,29 @@ def printCounter(p4info_helper, sw, counter_name, index):
             ))
 
 def main(p4info_file_path, bmv2_file_path):
-    # Instantiate a P4Runtime helper from the p4info file
-    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    # Instantiate a P4Runtime helper from the p4info file (or its cache)
+    p4info_helper = CachedP4InfoHelper(p4info_file_path)
 
     try:
         # Create a switch connection object for s1 and s2;
         # this is backed by a P4Runtime gRPC connection.
-        # Also, dump all P4Runtime messages sent to switch to given txt files.
+        # Also, log all P4Runtime messages sent to switch to given binary files
+        # (render them with: python3 -m p4ctl.msglog <file>).
         s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s1',
             address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
+            device_id=0)
+        logRequests(s1, 'logs/s1-p4runtime-requests.bin')
         s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s2',
             address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
+            device_id=1)
+        logRequests(s2, 'logs/s2-p4runtime-requests.bin')
         s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
             name='s3',
             address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+            device_id=2)
+        logRequests(s3, 'logs/s3-p4runtime-requests.bin')
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
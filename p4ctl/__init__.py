@@ -0,0 +1,15 @@
+"""
+Controller-side helpers shared by the LearnP4 exercises.
+
+The exercise controllers (``mycontroller.py``, ``final/mrc_controller.py``,
+``lab*/*/mycontroller.py``) stay self-contained scripts; anything they have in
+common lives here. Scripts put the repository root on ``sys.path`` the same way
+they already do for ``../../utils/`` and import the modules they need, e.g.::
+
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../'))
+    from p4ctl.pcap import loadFlows
+
+Day-to-day operations on a running exercise (install, dump, poll, reconcile)
+do not need a script of their own; see ``python3 -m p4ctl --help``.
+"""
@@ -0,0 +1,3 @@
+from p4ctl.cli import main
+
+main()
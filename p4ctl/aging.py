@@ -0,0 +1,86 @@
+"""
+Idle-timeout aging of table entries.
+
+Entries written with ``idle_timeout_ns`` (into tables declared with
+``support_timeout = true``) are reported by the switch in an
+IdleTimeoutNotification once they have not been hit for that long.
+``IdleTimeoutAger`` collects those notifications from the stream channels and,
+every ``interval`` seconds, hands everything that expired on a switch to
+``expire(switch name, table entries)`` in one call. The default just deletes
+the entries, batched into as few Write RPCs as possible:
+
+    ager = IdleTimeoutAger(switches)
+    ager.start()
+
+Controllers that own more state than the entry itself (e.g. a learned host
+with routes on every switch) pass their own ``expire``.
+"""
+import collections
+import threading
+
+import grpc
+
+from p4ctl.stream import streamDispatcher
+
+NS_PER_SECOND = 1000000000
+
+
+def setIdleTimeout(table_entry, seconds):
+    table_entry.idle_timeout_ns = int(seconds * NS_PER_SECOND)
+    return table_entry
+
+
+class IdleTimeoutAger(object):
+    """
+    Batches idle-timeout notifications into deletions.
+
+    :param switches: switch name -> ControllerConnection, already master
+    :param expire: called as expire(switch name, [TableEntry, ...]) from the
+                   ager thread; deletes the entries by default
+    :param interval: seconds between batches
+    """
+
+    def __init__(self, switches, expire=None, interval=1.0):
+        self.switches = switches
+        self.expire = expire or self.deleteEntries
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.expired = collections.defaultdict(list)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = collections.Counter()
+
+    def start(self):
+        for name, sw in self.switches.items():
+            dispatcher = streamDispatcher(sw)
+            dispatcher.subscribe('idle_timeout_notification', lambda notification, name=name:
+                                 self.handleNotification(name, notification))
+            dispatcher.start()
+        self.thread = threading.Thread(target=self._run, name='idle-timeout-ager',
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def handleNotification(self, switch_name, notification):
+        with self.lock:
+            self.expired[switch_name].extend(notification.table_entry)
+            self.stats['notified'] += len(notification.table_entry)
+
+    def deleteEntries(self, switch_name, table_entries):
+        self.switches[switch_name].DeleteTableEntries(table_entries)
+        self.stats['deleted'] += len(table_entries)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                expired, self.expired = self.expired, collections.defaultdict(list)
+            for switch_name, table_entries in expired.items():
+                try:
+                    self.expire(switch_name, table_entries)
+                except grpc.RpcError as e:
+                    # Typically entries someone else deleted meanwhile
+                    print("Failed to expire %d entries on %s: %s (%s)" % (
+                        len(table_entries), switch_name, e.details(), e.code().name))
+                    self.stats['failed'] += len(table_entries)
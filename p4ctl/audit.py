@@ -0,0 +1,260 @@
+"""
+Consistency audit of switch tables against what the controller installed.
+
+The controller keeps an ``EntryTree`` of the entries each switch should hold:
+a Merkle tree with the tables at the top, under each table buckets of entries
+whose first match field shares its leading ``prefix_bits`` (a /24 of the
+destination address for ipv4_mrc), and the entry digests as leaves. Bucket
+digests are cached and only recomputed after an entry in the bucket changed.
+
+An audit reads the audited tables back, builds the same tree from the answer
+and compares top-down: equal roots end the audit of a switch, and only the
+tables and buckets whose digests differ are descended into to find the
+missing and unexpected entries.
+
+BMv2 cannot hash its tables, so every audited table is still read once per
+audit; what the tree saves is comparing, keeping and reporting the entries
+one by one. Tables the controller has no expected entries for are not read,
+and default entries are not audited.
+
+    auditor = Auditor(p4info_helper, switches,
+                      {name: [table_entry, ...] for name in switches})
+    for name, drift in auditor.audit().items():
+        if drift:
+            print(drift.describe(p4info_helper))
+"""
+import hashlib
+import threading
+
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.reads import canonicalEntry
+
+DEFAULT_PREFIX_BITS = 24
+
+
+def keyDigest(entry):
+    """Digest of which entry a table entry is: table, match and priority."""
+    canonical = canonicalEntry(entry, action=False)
+    return hashlib.sha256(canonical.SerializeToString(deterministic=True)).digest()
+
+
+def entryDigest(entry):
+    """
+    Digest of what a table entry is: table, match, priority and action.
+
+    Counters, meters and the byte encoding of values do not count, so an
+    entry read back from the switch digests the same as the one written.
+    """
+    canonical = canonicalEntry(entry)
+    return hashlib.sha256(canonical.SerializeToString(deterministic=True)).digest()
+
+
+def _hash(parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+    return h.digest()
+
+
+class EntryTree(object):
+    """
+    Merkle tree over the table entries of one switch.
+
+    :param p4info_helper: for the bitwidths of the bucketing match fields
+    :param prefix_bits: leading bits of the first match field that make a bucket
+    """
+
+    def __init__(self, p4info_helper, prefix_bits=DEFAULT_PREFIX_BITS):
+        self.p4info_helper = p4info_helper
+        self.prefix_bits = prefix_bits
+        # (table_id, prefix) -> {entry digest: entry}
+        self.leaves = {}
+        # (table_id, prefix) -> bucket digest, for unchanged buckets
+        self.digests = {}
+        self._widths = {}
+
+    @classmethod
+    def fromEntries(cls, p4info_helper, entries, prefix_bits=DEFAULT_PREFIX_BITS):
+        tree = cls(p4info_helper, prefix_bits)
+        for entry in entries:
+            tree.add(entry)
+        return tree
+
+    def bucket(self, entry):
+        """(table_id, prefix) of the bucket an entry belongs in."""
+        if not entry.match:
+            return entry.table_id, None
+        match = min(entry.match, key=lambda m: m.field_id)
+        width = self._width(entry.table_id, match.field_id)
+        kind = getattr(match, match.WhichOneof('field_match_type'))
+        value = int.from_bytes(getattr(kind, 'value', None) or getattr(kind, 'low', b''), 'big')
+        return entry.table_id, value >> max(0, width - self.prefix_bits)
+
+    def add(self, entry):
+        bucket = self.bucket(entry)
+        self.leaves.setdefault(bucket, {})[entryDigest(entry)] = entry
+        self.digests.pop(bucket, None)
+
+    def discard(self, entry):
+        """Removes the entry with the match and priority of entry, whatever its action."""
+        bucket = self.bucket(entry)
+        leaves = self.leaves.get(bucket, {})
+        key = keyDigest(entry)
+        for digest in [d for d, leaf in leaves.items() if keyDigest(leaf) == key]:
+            del leaves[digest]
+        if not leaves:
+            self.leaves.pop(bucket, None)
+        self.digests.pop(bucket, None)
+
+    def tableIds(self):
+        return set(table_id for table_id, _ in self.leaves)
+
+    def bucketDigests(self, table_id):
+        """prefix -> digest of the buckets of one table."""
+        result = {}
+        for bucket, leaves in self.leaves.items():
+            if bucket[0] == table_id:
+                if bucket not in self.digests:
+                    self.digests[bucket] = _hash(sorted(leaves))
+                result[bucket[1]] = self.digests[bucket]
+        return result
+
+    def tableDigests(self):
+        """table_id -> digest of the table."""
+        return {table_id: _hash(repr(prefix).encode() + digest for prefix, digest in
+                                sorted(self.bucketDigests(table_id).items(),
+                                       key=lambda item: repr(item[0])))
+                for table_id in self.tableIds()}
+
+    def rootDigest(self):
+        return _hash(b'%d' % table_id + digest
+                     for table_id, digest in sorted(self.tableDigests().items()))
+
+    def _width(self, table_id, field_id):
+        if (table_id, field_id) not in self._widths:
+            table_name = self.p4info_helper.get_tables_name(table_id)
+            self._widths[table_id, field_id] = self.p4info_helper.get_match_field(
+                table_name, id=field_id).bitwidth
+        return self._widths[table_id, field_id]
+
+
+class Drift(object):
+    """What one switch holds differently from what it should."""
+
+    def __init__(self, name):
+        self.name = name
+        # (table_id, prefix) -> (missing entries, unexpected entries)
+        self.buckets = {}
+        self.buckets_compared = 0
+
+    def __bool__(self):
+        return bool(self.buckets)
+
+    @property
+    def missing(self):
+        return [entry for missing, _ in self.buckets.values() for entry in missing]
+
+    @property
+    def unexpected(self):
+        return [entry for _, unexpected in self.buckets.values() for entry in unexpected]
+
+    def describe(self, p4info_helper, prefix_bits=DEFAULT_PREFIX_BITS):
+        lines = []
+        for (table_id, prefix), (missing, unexpected) in sorted(
+                self.buckets.items(), key=lambda item: repr(item[0])):
+            lines.append("%s: %s %s: %d missing, %d unexpected" % (
+                self.name, p4info_helper.get_tables_name(table_id),
+                _prefixName(p4info_helper, table_id, prefix, prefix_bits),
+                len(missing), len(unexpected)))
+        return '\n'.join(lines)
+
+
+def _prefixName(p4info_helper, table_id, prefix, prefix_bits):
+    if prefix is None:
+        return '*'
+    field = min(p4info_helper.get('tables', id=table_id).match_fields,
+                key=lambda f: f.id)
+    if field.bitwidth == 32 and prefix_bits < 32:
+        address = (prefix << (32 - prefix_bits)).to_bytes(4, 'big')
+        return '%s/%d' % ('.'.join(str(b) for b in address), prefix_bits)
+    return '0x%x/%d' % (prefix, min(prefix_bits, field.bitwidth))
+
+
+def compare(name, expected, actual):
+    """
+    Compares two trees top-down, descending only where the digests differ.
+
+    :returns: Drift, false if the trees are equal
+    """
+    drift = Drift(name)
+    if expected.rootDigest() == actual.rootDigest():
+        return drift
+    expected_tables, actual_tables = expected.tableDigests(), actual.tableDigests()
+    for table_id in set(expected_tables) | set(actual_tables):
+        if expected_tables.get(table_id) == actual_tables.get(table_id):
+            continue
+        expected_buckets = expected.bucketDigests(table_id)
+        actual_buckets = actual.bucketDigests(table_id)
+        for prefix in set(expected_buckets) | set(actual_buckets):
+            drift.buckets_compared += 1
+            if expected_buckets.get(prefix) == actual_buckets.get(prefix):
+                continue
+            want = expected.leaves.get((table_id, prefix), {})
+            have = actual.leaves.get((table_id, prefix), {})
+            drift.buckets[table_id, prefix] = (
+                [entry for digest, entry in want.items() if digest not in have],
+                [entry for digest, entry in have.items() if digest not in want])
+    return drift
+
+
+class Auditor(object):
+    """
+    Audits a set of switches against their expected entries.
+
+    :param switches: switch name -> connection
+    :param expected: switch name -> iterable of TableEntry; keep the trees in
+                     ``self.expected`` up to date with add()/discard(), or
+                     applyUpdates() from other threads, when the controller
+                     changes entries later
+    """
+
+    def __init__(self, p4info_helper, switches, expected, prefix_bits=DEFAULT_PREFIX_BITS):
+        self.p4info_helper = p4info_helper
+        self.switches = switches
+        self.prefix_bits = prefix_bits
+        self.expected = {name: EntryTree.fromEntries(p4info_helper, entries, prefix_bits)
+                         for name, entries in expected.items()}
+        self.lock = threading.Lock()
+
+    def applyUpdates(self, name, updates):
+        """
+        Follows p4runtime_pb2.Update messages written to a switch. A Write
+        that lands while that switch is audited may show up as drift once.
+        """
+        with self.lock:
+            tree = self.expected[name]
+            for update in updates:
+                if not update.entity.HasField('table_entry'):
+                    continue
+                tree.discard(update.entity.table_entry)
+                if update.type != p4runtime_pb2.Update.DELETE:
+                    tree.add(update.entity.table_entry)
+
+    def readTree(self, sw, table_ids):
+        """The tree of what a switch holds in some tables."""
+        tree = EntryTree(self.p4info_helper, self.prefix_bits)
+        for table_id in table_ids:
+            for response in sw.ReadTableEntries(table_id=table_id):
+                for entity in response.entities:
+                    tree.add(entity.table_entry)
+        return tree
+
+    def audit(self):
+        """:returns: switch name -> Drift"""
+        result = {}
+        for name, expected in self.expected.items():
+            with self.lock:
+                actual = self.readTree(self.switches[name], sorted(expected.tableIds()))
+                result[name] = compare(name, expected, actual)
+        return result
@@ -0,0 +1,316 @@
+"""
+One entry point for the everyday controller operations:
+
+    python3 -m p4ctl install   --entries entries.json [--bmv2-json build/x.json]
+    python3 -m p4ctl dump      [--table MyIngress.ipv4_lpm] [--match hdr.ipv4.dstAddr=10.0.3.0/24]
+    python3 -m p4ctl poll      --counter MyIngress.ingressTunnelCounter [--index 102]
+    python3 -m p4ctl reconcile --entries entries.json [--dry-run]
+
+Every command takes ``--switch name=address[,device_id]`` (repeatable,
+default s1..s3 on 50051..50053) and ``--p4info`` (default: the only
+``build/*.p4info.txt`` of the current exercise). Entries files map switch
+names to lists of ``buildTableEntry`` keyword arguments, LPM values as
+``[address, prefix length]``:
+
+    {"s1": [{"table_name": "MyIngress.ipv4_lpm",
+             "match_fields": {"hdr.ipv4.dstAddr": ["10.0.1.1", 32]},
+             "action_name": "MyIngress.ipv4_forward",
+             "action_params": {"dstAddr": "08:00:00:00:01:11", "port": 1}}]}
+
+Connections are borrowed from a running ``p4ctl.pool`` when there is one.
+
+Only argparse is imported up front: grpc, protobuf and p4runtime_lib are
+loaded once the arguments are valid, so ``--help`` and usage errors cost no
+more than Python itself. Read-only commands (dump, poll) do not arbitrate.
+"""
+import argparse
+import glob
+import os
+import sys
+
+DEFAULT_SWITCHES = ['s%d=127.0.0.1:%d,%d' % (i, 50050 + i, i - 1) for i in (1, 2, 3)]
+
+
+def _p4infoHelper(args):
+    from p4ctl.p4info_cache import CachedP4InfoHelper
+
+    return CachedP4InfoHelper(args.p4info)
+
+
+def _connect(args, arbitrate):
+    """Borrowed connections to the selected switches, name -> connection."""
+    from p4ctl.pool import borrowConnection
+
+    switches = {}
+    for spec in args.switches:
+        sw = borrowConnection(spec.name, spec.address, spec.device_id,
+                              pool=args.pool, election_id=args.election_id)
+        if arbitrate:
+            sw.MasterArbitrationUpdate()
+        switches[spec.name] = sw
+    return switches
+
+
+def _loadEntries(path, p4info_helper):
+    """Entries file -> switch name -> list of TableEntry."""
+    import json
+
+    with open(path) as f:
+        entries = json.load(f)
+    return {name: [p4info_helper.buildTableEntry(**kwargs) for kwargs in entry_list]
+            for name, entry_list in entries.items()}
+
+
+def formatTableEntry(p4info_helper, entry):
+    table_name = p4info_helper.get_tables_name(entry.table_id)
+    words = [table_name + ':']
+    for m in entry.match:
+        words.append(p4info_helper.get_match_field_name(table_name, m.field_id))
+        words.append('%r' % (p4info_helper.get_match_field_value(m),))
+    if entry.priority:
+        words.append('priority %d' % entry.priority)
+    action = entry.action.action
+    action_name = p4info_helper.get_actions_name(action.action_id)
+    words.append('-> ' + action_name)
+    for p in action.params:
+        words.append(p4info_helper.get_action_param_name(action_name, p.param_id))
+        words.append('%r' % p.value)
+    return ' '.join(words)
+
+
+def entryKey(entry):
+    """
+    What identifies a table entry on the switch: table, match and priority,
+    the same for an entry as written and as read back.
+    """
+    from p4ctl.reads import canonicalEntry
+
+    return canonicalEntry(entry, action=False).SerializeToString(deterministic=True)
+
+
+def cmdInstall(args):
+    from p4ctl.switch import DEFAULT_BATCH_SIZE
+
+    p4info_helper = _p4infoHelper(args)
+    entries = _loadEntries(args.entries, p4info_helper)
+    for name, sw in _connect(args, arbitrate=True).items():
+        if args.bmv2_json:
+            sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                           bmv2_json_file_path=args.bmv2_json)
+            print("Installed P4 Program using SetForwardingPipelineConfig on %s" % name)
+        table_entries = entries.get(name, [])
+        rpcs = sw.WriteTableEntries(table_entries, batch_size=args.batch_size or DEFAULT_BATCH_SIZE)
+        print("Installed %d entries on %s in %d writes" % (len(table_entries), name, rpcs))
+
+
+def _formatCounted(p4info_helper, entry):
+    text = formatTableEntry(p4info_helper, entry)
+    if entry.HasField('counter_data'):
+        text += ' [%d packets, %d bytes]' % (entry.counter_data.packet_count,
+                                            entry.counter_data.byte_count)
+    return text
+
+
+def cmdDump(args):
+    from time import sleep
+
+    from p4ctl.reads import CounterWatch, readEntries
+
+    p4info_helper = _p4infoHelper(args)
+    tables = args.tables or None
+    match_filter = args.match
+    switches = _connect(args, arbitrate=False)
+    if not args.changed:
+        for name, sw in switches.items():
+            print('\n----- Reading tables rules for %s -----' % name)
+            for entry in readEntries(sw, p4info_helper, tables, match_filter):
+                print(_formatCounted(p4info_helper, entry))
+        return
+
+    watches = {name: CounterWatch(sw, p4info_helper, tables, match_filter)
+               for name, sw in switches.items()}
+    polls = 0
+    while True:
+        for name, watch in watches.items():
+            for entry in watch.poll():
+                print('%s %s' % (name, _formatCounted(p4info_helper, entry)))
+        polls += 1
+        if args.count and polls >= args.count:
+            return
+        sleep(args.interval)
+
+
+def cmdPoll(args):
+    from time import sleep
+
+    p4info_helper = _p4infoHelper(args)
+    counter_id = p4info_helper.get_counters_id(args.counter)
+    switches = _connect(args, arbitrate=False)
+    polls = 0
+    while True:
+        for name, sw in switches.items():
+            for response in sw.ReadCounters(counter_id, args.index):
+                for entity in response.entities:
+                    counter = entity.counter_entry
+                    print("%s %s %d: %d packets (%d bytes)" % (
+                        name, args.counter, counter.index.index,
+                        counter.data.packet_count, counter.data.byte_count))
+        polls += 1
+        if args.count and polls >= args.count:
+            return
+        sleep(args.interval)
+
+
+def cmdReconcile(args):
+    """Makes the tables named in the entries file hold exactly those entries."""
+    from p4.v1 import p4runtime_pb2
+
+    from p4ctl.reads import canonicalEntry
+
+    p4info_helper = _p4infoHelper(args)
+    entries = _loadEntries(args.entries, p4info_helper)
+    for name, sw in _connect(args, arbitrate=not args.dry_run).items():
+        desired = {}
+        defaults = []
+        for entry in entries.get(name, []):
+            if entry.is_default_action:
+                # Not returned by a wildcard read; rewriting it is harmless
+                defaults.append(entry)
+            else:
+                desired[entryKey(entry)] = entry
+
+        actual = {}
+        for table_id in set(e.table_id for e in entries.get(name, [])):
+            for response in sw.ReadTableEntries(table_id=table_id):
+                for entity in response.entities:
+                    actual[entryKey(entity.table_entry)] = entity.table_entry
+
+        updates = []
+
+        def update(update_type, entry):
+            u = p4runtime_pb2.Update(type=update_type)
+            u.entity.table_entry.CopyFrom(entry)
+            updates.append(u)
+
+        for key, entry in desired.items():
+            if key not in actual:
+                update(p4runtime_pb2.Update.INSERT, entry)
+            elif canonicalEntry(actual[key]).action != canonicalEntry(entry).action:
+                update(p4runtime_pb2.Update.MODIFY, entry)
+        if not args.keep_extra:
+            for key, entry in actual.items():
+                if key not in desired:
+                    update(p4runtime_pb2.Update.DELETE, entry)
+        for entry in defaults:
+            update(p4runtime_pb2.Update.MODIFY, entry)
+
+        counts = {t: sum(1 for u in updates if u.type == t) for t in
+                  (p4runtime_pb2.Update.INSERT, p4runtime_pb2.Update.MODIFY,
+                   p4runtime_pb2.Update.DELETE)}
+        print("%s: %d to insert, %d to modify, %d to delete%s" % (
+            name, counts[p4runtime_pb2.Update.INSERT], counts[p4runtime_pb2.Update.MODIFY],
+            counts[p4runtime_pb2.Update.DELETE], " (dry run)" if args.dry_run else ""))
+        if not args.dry_run and updates:
+            # Deletes first, so a full table has room for the inserts
+            updates.sort(key=lambda u: u.type != p4runtime_pb2.Update.DELETE)
+            sw.WriteUpdates(updates)
+
+
+def _defaultP4Info():
+    found = glob.glob('./build/*.p4info.txt')
+    return found[0] if len(found) == 1 else None
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog='python3 -m p4ctl',
+                                     description='P4Runtime controller operations')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--switch', help='name=address[,device_id], repeatable '
+                        '(default: s1..s3 on 127.0.0.1:50051..50053)',
+                        type=str, action='append', dest='switches')
+    common.add_argument('--p4info', help='p4info proto in text format from p4c',
+                        type=str, action="store", required=False,
+                        default=_defaultP4Info())
+    common.add_argument('--pool', help='Socket of a running p4ctl.pool',
+                        type=str, action="store", required=False,
+                        default='unix:/tmp/p4ctl-pool.sock')
+    common.add_argument('--election-id', help='Election ID for arbitration and writes',
+                        type=int, action="store", required=False, default=1)
+
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    install = commands.add_parser('install', parents=[common],
+                                  help='Write the entries of an entries file')
+    install.add_argument('--entries', help='JSON entries file', required=True)
+    install.add_argument('--bmv2-json', help='BMv2 JSON file from p4c; pushes the pipeline first',
+                         type=str, action="store", required=False)
+    install.add_argument('--batch-size', help='Updates per WriteRequest',
+                         type=int, action="store", required=False)
+    install.set_defaults(run=cmdInstall)
+
+    dump = commands.add_parser('dump', parents=[common],
+                               help='Print table entries with their direct counters')
+    dump.add_argument('--table', help='Only this table, repeatable', type=str,
+                      action='append', dest='tables')
+    dump.add_argument('--match', help='Only entries that can match field=value[/len], '
+                      'e.g. hdr.ipv4.dstAddr=10.0.3.0/24; tables without the field are '
+                      'not read', type=str, required=False)
+    dump.add_argument('--changed', help='Keep reading; print only entries that are new '
+                      'or whose counters changed', action='store_true')
+    dump.add_argument('--interval', help='With --changed, seconds between reads',
+                      type=float, default=2.0)
+    dump.add_argument('--count', help='With --changed, stop after this many reads',
+                      type=int, default=0)
+    dump.set_defaults(run=cmdDump)
+
+    poll = commands.add_parser('poll', parents=[common], help='Print counters periodically')
+    poll.add_argument('--counter', help='Counter name', type=str, required=True)
+    poll.add_argument('--index', help='Counter index (default: all)', type=int, required=False)
+    poll.add_argument('--interval', help='Seconds between reads', type=float, default=2.0)
+    poll.add_argument('--count', help='Stop after this many reads', type=int, default=0)
+    poll.set_defaults(run=cmdPoll)
+
+    reconcile = commands.add_parser('reconcile', parents=[common],
+                                    help='Make the switch tables match an entries file')
+    reconcile.add_argument('--entries', help='JSON entries file', required=True)
+    reconcile.add_argument('--keep-extra', help='Do not delete entries missing from the file',
+                           action='store_true')
+    reconcile.add_argument('--dry-run', help='Only print what would change',
+                           action='store_true')
+    reconcile.set_defaults(run=cmdReconcile)
+    return parser
+
+
+def main(argv=None):
+    parser = buildParser()
+    args = parser.parse_args(argv)
+    if not args.p4info or not os.path.exists(args.p4info):
+        parser.error("p4info file not found: %s\nHave you run 'make'?" % args.p4info)
+
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+    import grpc
+    from p4ctl.pool import parseSwitch
+    from p4runtime_lib.error_utils import printGrpcError
+    from p4runtime_lib.switch import ShutdownAllSwitchConnections
+
+    try:
+        args.switches = [parseSwitch(text) for text in args.switches or DEFAULT_SWITCHES]
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if getattr(args, 'match', None):
+        from p4ctl.reads import MatchFilter
+        try:
+            args.match = MatchFilter.parse(args.match)
+        except ValueError as e:
+            parser.error(str(e))
+    try:
+        args.run(args)
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    except grpc.RpcError as e:
+        printGrpcError(e)
+        ShutdownAllSwitchConnections()
+        sys.exit(1)
+    ShutdownAllSwitchConnections()
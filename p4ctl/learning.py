@@ -0,0 +1,211 @@
+"""
+Host learning from PacketIn messages.
+
+A program punts packets it has no route for, and packets from senders it
+does not know at their ingress port (``send_to_cpu`` in final/mrc.p4, with a
+``packet_in`` controller header carrying the ingress port), so that a host
+is learned from whatever it sends first, a reply to a known host included.
+``HostLearner`` subscribes to the packet-ins of every switch and, for each
+punted IPv4 packet that came in on a host-facing port, learns where its
+sender lives: (IP, MAC, switch, port).
+
+What gets installed for a learned host is up to the controller, through the
+``install`` callback. The learner only makes sure a burst of packet-ins does
+not become a burst of writes:
+
+* each switch gets a token bucket; packet-ins over the rate are dropped
+  (the host will send again),
+* a host already installed, or queued for installation, at the same location
+  is a duplicate and costs a dict lookup,
+* hosts are installed from a single thread, which takes everything that
+  queued up meanwhile in one ``install`` call so it can batch the writes.
+
+A host whose install failed is not remembered, so its next packet-in tries
+again as for a new host; ``install`` has to accept that a failed call may
+have left some of the host's entries behind (e.g. with
+``ControllerConnection.UpsertTableEntries``).
+"""
+import collections
+import queue
+import socket
+import threading
+from time import monotonic
+
+import grpc
+
+from p4ctl.stream import streamDispatcher
+
+Host = collections.namedtuple('Host', ['ip', 'mac', 'switch', 'port'])
+
+TYPE_IPV4 = 0x0800
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = monotonic()
+
+    def allow(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def packetInMetadata(p4info_helper, packet):
+    """The controller_header("packet_in") fields of a PacketIn, name -> int."""
+    header = p4info_helper.get('controller_packet_metadata', name='packet_in')
+    names = {m.id: m.name for m in header.metadata}
+    return {names.get(m.metadata_id, m.metadata_id): int.from_bytes(m.value, 'big')
+            for m in packet.metadata}
+
+
+def ipv4Source(payload):
+    """(source MAC, source IP) of an Ethernet/IPv4 frame, or None."""
+    if len(payload) < 34 or int.from_bytes(payload[12:14], 'big') != TYPE_IPV4:
+        return None
+    mac = ':'.join('%02x' % b for b in payload[6:12])
+    return mac, socket.inet_ntoa(payload[26:30])
+
+
+class HostLearner(object):
+    """
+    Learns host locations from the packet-ins of a set of switches.
+
+    :param switches: switch name -> connection, already master
+    :param p4info_helper: the P4Info helper, to decode the packet_in header
+    :param install: called as install([(host, previous), ...]) from the
+                    installer thread; previous is the Host it replaces, or None
+    :param fabric_ports: (switch, port) pairs of inter-switch links; packets
+                         that came in on these are not learned from
+    :param rate: packet-ins handled per second and switch
+    :param burst: token bucket depth
+    """
+
+    def __init__(self, switches, p4info_helper, install, fabric_ports=(),
+                 rate=50.0, burst=20):
+        self.switches = switches
+        self.p4info_helper = p4info_helper
+        self.install = install
+        self.fabric_ports = set(fabric_ports)
+        self.buckets = {name: TokenBucket(rate, burst) for name in switches}
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.pending = {}
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stats = collections.Counter()
+
+    def seed(self, hosts):
+        """Marks hosts as already installed, e.g. from static routes."""
+        with self.lock:
+            for host in hosts:
+                self.hosts[host.ip] = host
+
+    def forget(self, ips):
+        """Drops hosts whose routes were removed, so they are learned again."""
+        with self.lock:
+            for ip in ips:
+                self.hosts.pop(ip, None)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._installLoop, name='host-installer',
+                                       daemon=True)
+        self.thread.start()
+        for name, sw in self.switches.items():
+            dispatcher = streamDispatcher(sw)
+            dispatcher.subscribe('packet', lambda packet, name=name:
+                                 self.handlePacketIn(name, packet))
+            dispatcher.start()
+
+    def stop(self):
+        self.queue.put(None)
+
+    def handlePacketIn(self, switch_name, packet):
+        self.stats['packet_ins'] += 1
+        source = ipv4Source(packet.payload)
+        if source is None:
+            # Not ours, e.g. a link probe
+            self.stats['ignored'] += 1
+            return
+        if not self.buckets[switch_name].allow():
+            self.stats['rate_limited'] += 1
+            return
+        port = packetInMetadata(self.p4info_helper, packet).get('ingress_port')
+        if port is None or (switch_name, port) in self.fabric_ports:
+            self.stats['ignored'] += 1
+            return
+        host = Host(source[1], source[0], switch_name, port)
+        with self.lock:
+            if self.hosts.get(host.ip) == host or self.pending.get(host.ip) == host:
+                self.stats['duplicates'] += 1
+                return
+            self.pending[host.ip] = host
+        self.queue.put(host)
+
+    def _installLoop(self):
+        while True:
+            host = self.queue.get()
+            if host is None:
+                return
+            batch = [host]
+            while True:
+                try:
+                    host = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if host is None:
+                    self.queue.put(None)
+                    break
+                batch.append(host)
+
+            with self.lock:
+                # A host that moved again while queued only needs its last location
+                latest = {h.ip: h for h in batch}
+                changes = [(h, self.hosts.get(h.ip)) for h in latest.values()
+                           if self.pending.get(h.ip) == h]
+            changes = self._install(changes)
+            with self.lock:
+                for host, previous in changes:
+                    self.hosts[host.ip] = host
+                    if self.pending.get(host.ip) == host:
+                        del self.pending[host.ip]
+                    self.stats['moved' if previous else 'learned'] += 1
+                    print("%s host %s (%s) at %s port %d" % (
+                        "Moved" if previous else "Learned", host.ip, host.mac,
+                        host.switch, host.port))
+
+    def _failed(self, hosts, reason):
+        self.stats['failed'] += len(hosts)
+        with self.lock:
+            for host in hosts:
+                if self.pending.get(host.ip) == host:
+                    del self.pending[host.ip]
+        if len(hosts) == 1:
+            print("Failed to install host %s at %s port %d: %s" % (
+                hosts[0].ip, hosts[0].switch, hosts[0].port, reason))
+        else:
+            print("Failed to install %d hosts: %s" % (len(hosts), reason))
+
+    def _install(self, changes):
+        """Calls install; returns the changes that went in."""
+        try:
+            self.install(changes)
+            return changes
+        except grpc.RpcError as e:
+            self._failed([host for host, _ in changes],
+                         "%s (%s)" % (e.details(), e.code().name))
+            return []
+        except Exception as e:
+            if len(changes) == 1:
+                self._failed([changes[0][0]], repr(e))
+                return []
+        # Something about one host (e.g. no route towards its switch) must not
+        # keep the others out, nor stop the installer
+        return [change for one in changes for change in self._install([one])]
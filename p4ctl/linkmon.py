@@ -0,0 +1,125 @@
+"""
+Link liveness monitoring with packet-out probes.
+
+BMv2 does not report port status over P4Runtime, so ``LinkMonitor`` probes
+every inter-switch link itself: each ``interval`` it sends a small frame
+(EtherType PROBE_ETHERTYPE) as a PacketOut out of both ends of the link, and
+the program on the neighbour punts it back as a PacketIn (see final/mrc.p4).
+A direction that has not delivered a probe for ``misses`` intervals takes its
+link down; the first probe that makes it again brings the link back.
+
+    monitor = LinkMonitor(switches, p4info_helper, topo.links, onLinkChange)
+    monitor.start()
+
+``on_change(link, up)`` runs on a thread of its own, one change after the
+other in the order they were seen, so a callback that waits for its writes
+(e.g. behind a bulk Write in an UpdateScheduler) never delays the probes;
+if it did, every other link would miss its deadline and be taken down too.
+"""
+import queue
+import struct
+import threading
+from time import monotonic
+
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.stream import streamDispatcher
+
+PROBE_ETHERTYPE = 0x88B5
+
+# dst MAC, src MAC, EtherType, then the probe: link index, direction, sequence
+_PROBE = struct.Struct('!6s6sHHBI')
+
+
+def packetOut(p4info_helper, payload, **metadata):
+    """A StreamMessageRequest carrying a PacketOut with controller_header("packet_out")."""
+    header = p4info_helper.get('controller_packet_metadata', name='packet_out')
+    request = p4runtime_pb2.StreamMessageRequest()
+    request.packet.payload = payload
+    for m in header.metadata:
+        if m.name in metadata:
+            meta = request.packet.metadata.add()
+            meta.metadata_id = m.id
+            meta.value = metadata[m.name].to_bytes((m.bitwidth + 7) // 8, 'big')
+    return request
+
+
+class LinkMonitor(object):
+    """
+    Probes inter-switch links and reports them going down and up.
+
+    :param switches: switch name -> connection, already master
+    :param p4info_helper: the P4Info helper, for the controller headers
+    :param links: p4ctl.topology.Link list
+    :param on_change: called as on_change(link, up)
+    :param interval: seconds between probes
+    :param misses: probe intervals without a probe before a link is down
+    """
+
+    def __init__(self, switches, p4info_helper, links, on_change, interval=0.02, misses=3):
+        self.switches = switches
+        self.p4info_helper = p4info_helper
+        self.links = list(links)
+        self.on_change = on_change
+        self.interval = interval
+        self.misses = misses
+        self.up = [True] * len(self.links)
+        # Per link and direction (0: switch1 -> switch2, 1: back)
+        self.last_seen = [[monotonic(), monotonic()] for _ in self.links]
+        self.sequence = 0
+        self.stopped = threading.Event()
+        self.changes = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        for name in set(l.switch1 for l in self.links) | set(l.switch2 for l in self.links):
+            dispatcher = streamDispatcher(self.switches[name])
+            dispatcher.subscribe('packet', self.handlePacketIn)
+            dispatcher.start()
+        threading.Thread(target=self._notify, name='link-changes', daemon=True).start()
+        self.thread = threading.Thread(target=self._run, name='link-monitor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.changes.put(None)
+
+    def handlePacketIn(self, packet):
+        payload = packet.payload
+        if len(payload) < _PROBE.size:
+            return
+        _, _, ethertype, index, direction, _ = _PROBE.unpack_from(payload)
+        if ethertype == PROBE_ETHERTYPE and index < len(self.links) and direction < 2:
+            self.last_seen[index][direction] = monotonic()
+
+    def _sendProbes(self):
+        self.sequence = (self.sequence + 1) & 0xffffffff
+        for index, link in enumerate(self.links):
+            for direction, (name, port) in enumerate(((link.switch1, link.port1),
+                                                      (link.switch2, link.port2))):
+                payload = _PROBE.pack(b'\xff' * 6, b'\x00' * 6, PROBE_ETHERTYPE,
+                                      index, direction, self.sequence)
+                self.switches[name].requests_stream.put(
+                    packetOut(self.p4info_helper, payload, egress_port=port))
+
+    def _run(self):
+        deadline = self.interval * self.misses
+        while not self.stopped.wait(self.interval):
+            self._sendProbes()
+            now = monotonic()
+            for index, link in enumerate(self.links):
+                up = all(now - seen <= deadline for seen in self.last_seen[index])
+                if up != self.up[index]:
+                    self.up[index] = up
+                    self.changes.put((link, up))
+
+    def _notify(self):
+        while True:
+            change = self.changes.get()
+            if change is None:
+                return
+            try:
+                self.on_change(*change)
+            except Exception as e:
+                # The next change still has to be handled
+                print("Handling link %s failed: %r" % ("up" if change[1] else "down", e))
@@ -0,0 +1,313 @@
+"""
+Timing instrumentation for P4Runtime controllers.
+
+``instrument(sw, metrics)`` hooks a switch connection the same way
+``proto_dump_file`` does, with a gRPC client interceptor on its channel, and
+records for every Write, Read and SetForwardingPipelineConfig call
+
+* a latency histogram per (switch, RPC, table),
+* the number of calls, failed calls and request bytes.
+
+MasterArbitrationUpdate goes over the stream channel, which interceptors do
+not see, so it is timed by wrapping the method. Controller phases (bring-up,
+compute, install, ...) are timed with ``metrics.phase(name)``.
+
+Everything is in-memory counters and fixed-bucket histograms; ``write(path)``
+exports them as JSON (``.json``) or Prometheus text format (anything else).
+
+    metrics = Metrics()
+    with metrics.phase('bring-up'):
+        instrument(s1, metrics, p4info_helper)
+        s1.MasterArbitrationUpdate()
+    ...
+    metrics.write('logs/metrics.prom')
+"""
+import bisect
+import json
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.switch import attachInterceptor
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return float('inf')
+
+    def toDict(self):
+        return {'counts': self.counts, 'count': self.count, 'sum': self.sum}
+
+    @classmethod
+    def fromDict(cls, d):
+        h = cls()
+        h.counts = list(d['counts'])
+        h.count = d['count']
+        h.sum = d['sum']
+        return h
+
+
+class RpcStats(object):
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.request_bytes = 0
+
+
+class Metrics(object):
+    """RPC and phase statistics of one controller process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rpcs = {}
+        self.phases = {}
+
+    def observeRpc(self, switch, method, table, seconds, request_bytes, failed=False):
+        key = (switch, method, table)
+        with self.lock:
+            stats = self.rpcs.get(key)
+            if stats is None:
+                stats = self.rpcs[key] = RpcStats()
+            stats.latency.observe(seconds)
+            stats.request_bytes += request_bytes
+            if failed:
+                stats.errors += 1
+
+    def observePhase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observePhase(name, perf_counter() - start)
+
+    def toDict(self):
+        with self.lock:
+            return {
+                'rpcs': [{
+                    'switch': switch, 'method': method, 'table': table,
+                    'latency': stats.latency.toDict(),
+                    'errors': stats.errors, 'request_bytes': stats.request_bytes,
+                } for (switch, method, table), stats in sorted(self.rpcs.items())],
+                'phases': dict(self.phases),
+                'buckets': list(BUCKETS),
+            }
+
+    def merge(self, d):
+        """Adds the toDict() output of another Metrics, e.g. from a worker."""
+        with self.lock:
+            for rpc in d['rpcs']:
+                key = (rpc['switch'], rpc['method'], rpc['table'])
+                stats = self.rpcs.get(key)
+                if stats is None:
+                    stats = self.rpcs[key] = RpcStats()
+                stats.latency.merge(Histogram.fromDict(rpc['latency']))
+                stats.errors += rpc['errors']
+                stats.request_bytes += rpc['request_bytes']
+            for name, seconds in d['phases'].items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def toJson(self):
+        return json.dumps(self.toDict(), indent=2)
+
+    def toPrometheus(self):
+        lines = [
+            '# TYPE p4rt_rpc_duration_seconds histogram',
+        ]
+        counters = []
+        with self.lock:
+            for (switch, method, table), stats in sorted(self.rpcs.items()):
+                labels = 'switch="%s",method="%s",table="%s"' % (switch, method, table)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), stats.latency.counts):
+                    cumulative += count
+                    lines.append('p4rt_rpc_duration_seconds_bucket{%s,le="%s"} %d' % (
+                        labels, bound, cumulative))
+                lines.append('p4rt_rpc_duration_seconds_sum{%s} %.9f' % (labels, stats.latency.sum))
+                lines.append('p4rt_rpc_duration_seconds_count{%s} %d' % (labels, stats.latency.count))
+                counters.append((labels, stats))
+            lines.append('# TYPE p4rt_rpc_errors_total counter')
+            for labels, stats in counters:
+                lines.append('p4rt_rpc_errors_total{%s} %d' % (labels, stats.errors))
+            lines.append('# TYPE p4rt_request_bytes_total counter')
+            for labels, stats in counters:
+                lines.append('p4rt_request_bytes_total{%s} %d' % (labels, stats.request_bytes))
+            lines.append('# TYPE controller_phase_seconds gauge')
+            for name, seconds in sorted(self.phases.items()):
+                lines.append('controller_phase_seconds{phase="%s"} %.6f' % (name, seconds))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.toJson() if path.endswith('.json') else self.toPrometheus())
+
+    def printSummary(self):
+        print('\n----- P4Runtime RPC latency -----')
+        with self.lock:
+            items = sorted(self.rpcs.items())
+            phases = sorted(self.phases.items())
+        for (switch, method, table), stats in items:
+            h = stats.latency
+            print('%s %s %s: %d calls, %d errors, mean %.3f ms, p50 <= %.3f ms, '
+                  'p99 <= %.3f ms, %d bytes' % (
+                      switch, method, table or '-', h.count, stats.errors,
+                      1000 * h.sum / h.count if h.count else 0.0,
+                      1000 * h.quantile(0.5), 1000 * h.quantile(0.99),
+                      stats.request_bytes))
+        for name, seconds in phases:
+            print('phase %s: %.3f s' % (name, seconds))
+
+
+def _tableLabel(request, table_names):
+    if not isinstance(request, p4runtime_pb2.WriteRequest) and \
+            not isinstance(request, p4runtime_pb2.ReadRequest):
+        return ''
+    entities = (request.entities if isinstance(request, p4runtime_pb2.ReadRequest)
+                else [u.entity for u in request.updates])
+    label = None
+    for entity in entities:
+        kind = entity.WhichOneof('entity')
+        if kind == 'table_entry':
+            table_id = entity.table_entry.table_id
+            name = table_names.get(table_id, str(table_id)) if table_id else '*'
+        elif kind == 'counter_entry':
+            name = table_names.get(entity.counter_entry.counter_id, kind)
+        else:
+            name = kind or ''
+        if label is None:
+            label = name
+        elif label != name:
+            return 'mixed'
+    return label or ''
+
+
+class MetricsInterceptor(grpc.UnaryUnaryClientInterceptor,
+                         grpc.UnaryStreamClientInterceptor):
+    """gRPC interceptor timing the unary and server-streaming P4Runtime calls."""
+
+    def __init__(self, metrics, switch_name, table_names=None):
+        self.metrics = metrics
+        self.switch_name = switch_name
+        self.table_names = table_names or {}
+
+    def _describe(self, client_call_details, request):
+        method = client_call_details.method.rsplit('/', 1)[-1]
+        if isinstance(request, bytes):
+            # Pre-serialized requests (p4ctl.bulk) are not decoded again
+            return method, '', len(request)
+        return method, _tableLabel(request, self.table_names), request.ByteSize()
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        method, table, size = self._describe(client_call_details, request)
+        start = perf_counter()
+        response = continuation(client_call_details, request)
+        failed = response.exception() is not None
+        self.metrics.observeRpc(self.switch_name, method, table,
+                                perf_counter() - start, size, failed)
+        return response
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        method, table, size = self._describe(client_call_details, request)
+        start = perf_counter()
+        responses = continuation(client_call_details, request)
+        return _TimedStream(responses, lambda failed: self.metrics.observeRpc(
+            self.switch_name, method, table, perf_counter() - start, size, failed))
+
+
+class _TimedStream(object):
+    """Response iterator that reports its total duration once exhausted."""
+
+    def __init__(self, responses, done):
+        self._responses = responses
+        self._done = done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._responses)
+        except StopIteration:
+            self._finish(False)
+            raise
+        except grpc.RpcError:
+            self._finish(True)
+            raise
+
+    def _finish(self, failed):
+        if self._done is not None:
+            self._done(failed)
+            self._done = None
+
+    def __getattr__(self, attr):
+        return getattr(self._responses, attr)
+
+
+def tableNames(p4info_helper):
+    """ID -> name for tables and counters, for labelling RPCs."""
+    names = {t.preamble.id: t.preamble.name for t in p4info_helper.p4info.tables}
+    names.update({c.preamble.id: c.preamble.name for c in p4info_helper.p4info.counters})
+    return names
+
+
+def instrument(sw, metrics, p4info_helper=None):
+    """
+    Records the RPCs of a switch connection in metrics.
+
+    :param sw: the switch connection
+    :param metrics: a Metrics object, possibly shared by many switches
+    :param p4info_helper: optional, to label RPCs with table names
+    """
+    names = tableNames(p4info_helper) if p4info_helper is not None else {}
+    attachInterceptor(sw, MetricsInterceptor(metrics, sw.name, names))
+
+    arbitrate = sw.MasterArbitrationUpdate
+
+    def MasterArbitrationUpdate(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return arbitrate(*args, **kwargs)
+        finally:
+            metrics.observeRpc(sw.name, 'MasterArbitrationUpdate', '',
+                               perf_counter() - start, 0)
+
+    sw.MasterArbitrationUpdate = MasterArbitrationUpdate
+    return sw
@@ -0,0 +1,286 @@
+"""
+Asynchronous binary P4Runtime request log.
+
+``proto_dump_file`` makes ``GrpcRequestLogger`` reopen the log file and
+text-format every request on the calling thread, right in the middle of the
+install loop. ``logRequests(sw, path)`` replaces it: the interceptor only
+serializes the request (raw bytes from p4ctl.bulk are taken as they are) and
+queues it; a background thread writes the records in blocks, optionally
+zlib-compressed, and rotates the file once it reaches ``max_bytes``
+(``path`` -> ``path.1`` -> ... -> ``path.<backups>``).
+
+``sample_every=N`` keeps one Write in N; other RPCs are always logged. When the
+writer falls behind by ``queue_size`` records, new records are dropped and
+counted rather than slowing the controller down.
+
+File layout: the MAGIC header, then blocks of ``<BI`` (flags, length) followed
+by the payload, zlib-compressed if flags & 1. A payload is a run of records:
+``<dBI`` (UNIX time, method code, length) followed by the serialized request.
+
+Logs are rendered as text on demand:
+
+    python3 -m p4ctl.msglog logs/s1-p4runtime-requests.bin
+    python3 -m p4ctl.msglog --rotated --method Write logs/s1-p4runtime-requests.bin
+"""
+import argparse
+import atexit
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+from datetime import datetime, timezone
+from time import time
+
+import grpc
+from p4.v1 import p4runtime_pb2
+
+MAGIC = b'P4RTLOG1'
+BLOCK_HEADER = struct.Struct('<BI')
+RECORD_HEADER = struct.Struct('<dBI')
+FLAG_ZLIB = 1
+
+# Method codes, by position; UNKNOWN_METHOD for anything else
+METHODS = (
+    ('/p4.v1.P4Runtime/Write', p4runtime_pb2.WriteRequest),
+    ('/p4.v1.P4Runtime/Read', p4runtime_pb2.ReadRequest),
+    ('/p4.v1.P4Runtime/SetForwardingPipelineConfig',
+     p4runtime_pb2.SetForwardingPipelineConfigRequest),
+    ('/p4.v1.P4Runtime/GetForwardingPipelineConfig',
+     p4runtime_pb2.GetForwardingPipelineConfigRequest),
+    ('/p4.v1.P4Runtime/Capabilities', p4runtime_pb2.CapabilitiesRequest),
+)
+METHOD_CODES = {name: code for code, (name, _) in enumerate(METHODS)}
+UNKNOWN_METHOD = 255
+WRITE_CODE = METHOD_CODES['/p4.v1.P4Runtime/Write']
+
+# Same limit as GrpcRequestLogger for the text rendering
+MSG_LOG_MAX_LEN = 1024
+
+_open_loggers = []
+
+
+class MessageLogger(object):
+    """
+    Writes requests to a rotating binary log from a background thread.
+
+    :param path: the log file; existing content is replaced
+    :param max_bytes: rotate when the file would grow past this; 0 never rotates
+    :param backups: rotated files to keep
+    :param compress: zlib-compress the blocks
+    :param sample_every: log one Write request in this many
+    :param queue_size: records in flight before new ones are dropped
+    """
+
+    def __init__(self, path, max_bytes=64 << 20, backups=3, compress=False,
+                 sample_every=1, queue_size=100000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.sample_every = max(1, sample_every)
+        self.queue = queue.Queue(queue_size)
+        self.writes_seen = 0
+        self.logged = 0
+        self.dropped = 0
+        self.closed = False
+
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+        self.thread = threading.Thread(target=self._run, name='msglog-%s' % path,
+                                       daemon=True)
+        self.thread.start()
+        _open_loggers.append(self)
+
+    def log(self, method, request):
+        """Queues one request; called on the RPC thread, so kept short."""
+        code = METHOD_CODES.get(method, UNKNOWN_METHOD)
+        if code == WRITE_CODE:
+            self.writes_seen += 1
+            if (self.writes_seen - 1) % self.sample_every:
+                return
+        if not isinstance(request, bytes):
+            request = request.SerializeToString()
+        try:
+            self.queue.put_nowait(RECORD_HEADER.pack(time(), code, len(request)) + request)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            records = [record]
+            done = False
+            # Whatever piled up while we were writing goes into one block
+            while len(records) < 4096:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    done = True
+                    break
+                records.append(record)
+            self._writeBlock(b''.join(records))
+            self.logged += len(records)
+            if done:
+                return
+
+    def _writeBlock(self, payload):
+        flags = 0
+        if self.compress:
+            payload = zlib.compress(payload, 1)
+            flags |= FLAG_ZLIB
+        block = BLOCK_HEADER.pack(flags, len(payload)) + payload
+        if self.max_bytes and self.size > len(MAGIC) and self.size + len(block) > self.max_bytes:
+            self._rotate()
+        self.file.write(block)
+        self.file.flush()
+        self.size += len(block)
+
+    def _rotate(self):
+        self.file.close()
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                older = '%s.%d' % (self.path, i)
+                if os.path.exists(older):
+                    os.replace(older, '%s.%d' % (self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+        self.file = open(self.path, 'wb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+
+    def close(self):
+        """Writes out everything queued so far and closes the file."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.dropped:
+            print("%s: dropped %d requests, the writer fell behind" % (self.path,
+                                                                      self.dropped))
+
+
+@atexit.register
+def _closeAll():
+    for logger in _open_loggers:
+        logger.close()
+
+
+class MessageLogInterceptor(grpc.UnaryUnaryClientInterceptor,
+                            grpc.UnaryStreamClientInterceptor):
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        self.logger.log(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        self.logger.log(client_call_details.method, request)
+        return continuation(client_call_details, request)
+
+
+def logRequests(sw, path, **options):
+    """
+    Logs the requests of a switch connection to a binary log.
+
+    Use instead of proto_dump_file; options go to MessageLogger.
+
+    :returns: the MessageLogger
+    """
+    # Not at the top: the reader CLI runs without the tutorials' utils/
+    from p4ctl.switch import attachInterceptor
+
+    logger = MessageLogger(path, **options)
+    attachInterceptor(sw, MessageLogInterceptor(logger))
+    return logger
+
+
+def readLog(path):
+    """
+    Reads a binary request log.
+
+    :returns: generator of (timestamp, method name, request); the request is
+              the raw bytes for methods the log does not know
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a P4Runtime request log" % path)
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            flags, length = BLOCK_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                # The last block of a log that is still being written
+                return
+            if flags & FLAG_ZLIB:
+                payload = zlib.decompress(payload)
+            pos = 0
+            while pos < len(payload):
+                ts, code, size = RECORD_HEADER.unpack_from(payload, pos)
+                pos += RECORD_HEADER.size
+                body = payload[pos:pos + size]
+                pos += size
+                if code < len(METHODS):
+                    method, message_type = METHODS[code]
+                    yield ts, method, message_type.FromString(body)
+                else:
+                    yield ts, '(unknown)', body
+
+
+def rotatedPaths(path):
+    """The log and its rotated predecessors, oldest first."""
+    older = []
+    i = 1
+    while os.path.exists('%s.%d' % (path, i)):
+        older.append('%s.%d' % (path, i))
+        i += 1
+    return older[::-1] + [path]
+
+
+def formatRecord(ts, method, request, full=False):
+    """The text GrpcRequestLogger would have written for a request."""
+    ts = datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    msg = str(request) if not isinstance(request, bytes) else \
+        "%d bytes of an unknown request type\n" % len(request)
+    if not full and len(msg) >= MSG_LOG_MAX_LEN:
+        msg = "Message too long (%d bytes)! Skipping log...\n" % len(msg)
+    return "\n[%s] %s\n---\n%s---\n" % (ts, method, msg)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render binary P4Runtime request logs')
+    parser.add_argument('logs', nargs='+', help='log files')
+    parser.add_argument('--rotated', action='store_true',
+                        help='also read the rotated files of each log, oldest first')
+    parser.add_argument('--method', type=str, default=None,
+                        help='only this RPC, e.g. Write')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='stop after this many requests')
+    parser.add_argument('--full', action='store_true',
+                        help='print long messages instead of skipping them')
+    args = parser.parse_args()
+
+    shown = 0
+    try:
+        for log_path in args.logs:
+            for path in rotatedPaths(log_path) if args.rotated else [log_path]:
+                for ts, method, request in readLog(path):
+                    if args.method and method.rsplit('/', 1)[-1] != args.method:
+                        continue
+                    sys.stdout.write(formatRecord(ts, method, request, args.full))
+                    shown += 1
+                    if args.limit is not None and shown >= args.limit:
+                        sys.exit(0)
+    except BrokenPipeError:
+        pass
@@ -0,0 +1,659 @@
+"""
+Northbound route ingestion: route sources are programs that stream routes in.
+
+A ``RouteService`` owns one LPM route table on every switch and listens on a
+unix socket for route feeds (a converter of MRT dumps, a routing daemon's
+export, a generator for load tests). Feeds send batches of fixed-size binary
+records, ``ROUTE_DTYPE``: add or withdraw, switch, configuration, prefix,
+prefix length, egress port and next-hop MAC.
+
+Every batch is validated as a whole with NumPy: the switch and configuration
+have to exist, the prefix must be 1 to 32 bits long without host bits, and
+an added route must leave by a port the switch has in the topology. Valid
+routes join the pending routes of their switch, where a later route for the
+same (configuration, prefix) replaces an earlier one. A writer thread per
+switch takes everything pending at once, makes INSERTs, MODIFYs and DELETEs
+of it against what it knows is installed (read from the switch at start; a
+withdraw of a route that is not installed is dropped), encodes them with
+p4ctl.bulk and writes them ``batch_size`` updates per Write. Of a failed
+Write only the updates the switch refused count as failed; if it does not
+say which, or refuses an insert as existing or a delete as not found, the
+installed routes are read back from the switch. While a switch
+is busy writing, the next batches pile up and coalesce, so a feed slows down
+only when more than ``max_pending`` routes wait for one switch. Where a
+switch's writes go through a p4ctl.scheduler.UpdateScheduler, the routes are
+submitted to it as bulk work instead, so that failover updates overtake them.
+
+Wire protocol, little endian:
+
+    on connect, to the feed:  b'NBR1', u32 n, n bytes of JSON
+                              {"switches": [names], "configs": count}
+    feed -> service:          b'RTES', u32 count, count ROUTE_DTYPE records
+    service -> feed:          b'RTOK', u32 accepted, u32 rejected, u32 failed,
+                              then `rejected` REJECT_DTYPE records
+
+Switches are sent as their index in the hello's list. A batch of zero routes
+is a barrier: its reply comes once everything sent before it is written.
+``failed`` counts the updates the switches refused so far, from all feeds.
+
+    feed = RouteFeed()
+    feed.add('s1', '10.1.0.0/16', 2, '08:00:00:00:02:00')
+    feed.withdraw('s2', '10.2.0.0/16')
+    reply = feed.send()
+    feed.barrier()
+
+``python3 -m p4ctl.northbound dump.txt`` feeds a text dump, one route a line:
+
+    add s1 10.1.0.0/16 2 08:00:00:00:02:00 [config]
+    withdraw s1 10.2.0.0/16 [config]
+"""
+import argparse
+import collections
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from concurrent.futures import wait
+from time import perf_counter
+
+import grpc
+import numpy as np
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.bulk import DEFAULT_BATCH_SIZE, EntryTemplate, writeUpdates
+from p4ctl.scheduler import BULK
+from p4ctl.switch import updateCodes
+
+DEFAULT_SOCKET = '/tmp/p4ctl-routes.sock'
+
+ADD, WITHDRAW = 1, 2
+
+ROUTE_DTYPE = np.dtype([
+    ('op', '<u1'),
+    ('switch', '<u1'),
+    ('config', '<u1'),
+    ('prefix_len', '<u1'),
+    ('prefix', '<u4'),
+    ('port', '<u2'),
+    ('mac', '<u8'),
+])
+
+# Why a route was rejected; code i is REJECT_REASONS[i - 1]
+REJECT_REASONS = ('op', 'switch', 'config', 'prefix', 'port', 'next hop')
+REJECT_DTYPE = np.dtype([('index', '<u4'), ('reason', '<u1')])
+
+HELLO, BATCH, REPLY = b'NBR1', b'RTES', b'RTOK'
+_HEADER = struct.Struct('<4sI')
+_REPLY = struct.Struct('<4sIII')
+
+# Largest batch a feed may send, and routes waiting per switch before feeds block
+MAX_BATCH = 1 << 20
+DEFAULT_MAX_PENDING = 1 << 20
+
+# Egress ports are bit<9>
+_PORTS = 512
+
+# Refusals that mean the switch holds other routes than the writer thinks
+_STALE = {code_pb2.ALREADY_EXISTS, code_pb2.NOT_FOUND}
+
+Reply = collections.namedtuple('Reply', ['accepted', 'rejected', 'failed', 'rejections'])
+
+
+def routeKeys(routes):
+    """What identifies a route on its switch: configuration, prefix length, prefix."""
+    return (routes['config'].astype(np.uint64) << np.uint64(40) |
+            routes['prefix_len'].astype(np.uint64) << np.uint64(32) |
+            routes['prefix'].astype(np.uint64))
+
+
+def switchPorts(topo):
+    """Switch name -> the ports it has in a Topology, to hosts and to other switches."""
+    ports = collections.defaultdict(set)
+    for switch, port in topo.fabricPorts():
+        ports[switch].add(port)
+    for host in topo.hosts.values():
+        ports[host.switch].add(host.port)
+    return dict(ports)
+
+
+class RouteTable(object):
+    """
+    Where routes go: an LPM table whose action takes a next-hop MAC and port.
+
+    :param table_name: the table, e.g. "MyIngress.ipv4_lpm"
+    :param dst_field: its lpm destination field
+    :param action_name: the forwarding action
+    :param config_field: an exact field that tells configurations apart
+                         (e.g. MRC's diffserv), or None for a single one
+    :param config_values: the config_field value of every configuration
+    """
+
+    def __init__(self, p4info_helper, table_name, dst_field="hdr.ipv4.dstAddr",
+                 action_name="MyIngress.ipv4_forward", mac_param="dstAddr", port_param="port",
+                 config_field=None, config_values=(0,)):
+        self.table_name = table_name
+        self.dst_field = dst_field
+        self.mac_param = mac_param
+        self.port_param = port_param
+        self.config_field = config_field
+        self.config_values = np.asarray(config_values, dtype=np.uint64)
+        self.table_id = p4info_helper.get_tables_id(table_name)
+        self.dst_field_id = p4info_helper.get_match_field(table_name, dst_field).id
+        self.config_field_id = (p4info_helper.get_match_field(table_name, config_field).id
+                                if config_field else None)
+
+        match_fields = [dst_field] + ([config_field] if config_field else [])
+        self.templates = {}
+        for update_type in (p4runtime_pb2.Update.INSERT, p4runtime_pb2.Update.MODIFY):
+            self.templates[update_type] = EntryTemplate(
+                p4info_helper, table_name, match_fields, action_name,
+                [mac_param, port_param], update_type)
+        self.templates[p4runtime_pb2.Update.DELETE] = EntryTemplate(
+            p4info_helper, table_name, match_fields, update_type=p4runtime_pb2.Update.DELETE)
+
+    @property
+    def configs(self):
+        return len(self.config_values)
+
+    def encode(self, update_type, routes):
+        """An UpdateBatch writing the routes (a ROUTE_DTYPE array)."""
+        match = {self.dst_field: (routes['prefix'], routes['prefix_len'])}
+        if self.config_field:
+            match[self.config_field] = self.config_values[routes['config']]
+        params = None
+        if update_type != p4runtime_pb2.Update.DELETE:
+            params = {self.mac_param: routes['mac'], self.port_param: routes['port']}
+        return self.templates[update_type].encode(match, params)
+
+    def entryKey(self, entry):
+        """The routeKeys() value of a TableEntry of the table, or None."""
+        fields = {m.field_id: m for m in entry.match}
+        if self.dst_field_id not in fields:
+            return None
+        config = 0
+        if self.config_field_id is not None:
+            if self.config_field_id not in fields:
+                return None
+            value = int.from_bytes(fields[self.config_field_id].exact.value, 'big')
+            matching = np.flatnonzero(self.config_values == value)
+            if not len(matching):
+                return None
+            config = int(matching[0])
+        lpm = fields[self.dst_field_id].lpm
+        return config << 40 | lpm.prefix_len << 32 | int.from_bytes(lpm.value, 'big')
+
+
+class _SwitchWriter(object):
+    """The pending routes of one switch and the thread that writes them."""
+
+    def __init__(self, service, sw):
+        self.service = service
+        self.sw = sw
+        self.cond = threading.Condition()
+        self.pending = []
+        self.pending_rows = 0
+        self.busy = False
+        self.stopped = False
+        self.installed = np.empty(0, dtype=np.uint64)
+        self.resync = False
+
+    def readInstalled(self):
+        """Reads which routes of the table the switch holds."""
+        from p4ctl.reads import readEntries
+
+        table = self.service.table
+        keys = [table.entryKey(entry) for entry in readEntries(
+            self.sw, self.service.p4info_helper, [table.table_name], counters=False)]
+        self.installed = np.unique(np.array([k for k in keys if k is not None],
+                                            dtype=np.uint64))
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='northbound-%s' % self.sw.name,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def put(self, routes):
+        with self.cond:
+            self.cond.wait_for(lambda: self.stopped or
+                               self.pending_rows < self.service.max_pending)
+            self.pending.append(routes)
+            self.pending_rows += len(routes)
+            self.cond.notify_all()
+
+    def flush(self):
+        with self.cond:
+            self.cond.wait_for(lambda: not self.busy and not self.pending)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                pending, self.pending, self.pending_rows = self.pending, [], 0
+                self.busy = True
+                self.cond.notify_all()
+            self._write(np.concatenate(pending))
+
+    def _write(self, routes):
+        count = self.service.count
+        keys = routeKeys(routes)
+        # The last route sent for a key wins
+        _, last = np.unique(keys[::-1], return_index=True)
+        latest = len(routes) - 1 - last
+        count('coalesced', len(routes) - len(latest))
+        routes, keys = routes[latest], keys[latest]
+
+        installed = np.isin(keys, self.installed, assume_unique=True)
+        add = routes['op'] == ADD
+        count('dropped', np.count_nonzero(~add & ~installed))
+        written = {}
+        # Deletes first, so that a full table makes room
+        for update_type, rows, counter in (
+                (p4runtime_pb2.Update.DELETE, ~add & installed, 'deleted'),
+                (p4runtime_pb2.Update.MODIFY, add & installed, 'modified'),
+                (p4runtime_pb2.Update.INSERT, add & ~installed, 'inserted')):
+            if not rows.any():
+                continue
+            batch = self.service.table.encode(update_type, routes[rows])
+            ok = np.zeros(len(batch), dtype=bool)
+            for start in range(0, len(batch), self.service.batch_size):
+                end = start + self.service.batch_size
+                ok[start:end] = self._writeBatch(batch[start:end])
+                count('writes')
+            count(counter, np.count_nonzero(ok))
+            written[update_type] = keys[rows][ok]
+
+        if self.resync:
+            self.resync = False
+            try:
+                self.readInstalled()
+                return
+            except grpc.RpcError as e:
+                self.service.lastError(self.sw, e)
+        deleted = written.get(p4runtime_pb2.Update.DELETE)
+        inserted = written.get(p4runtime_pb2.Update.INSERT)
+        if deleted is not None:
+            self.installed = np.setdiff1d(self.installed, deleted, assume_unique=True)
+        if inserted is not None:
+            self.installed = np.union1d(self.installed, inserted)
+
+    def _writeBatch(self, batch):
+        """Writes part of an UpdateBatch; returns which of its rows were written."""
+        on_written = self.service.on_written
+        scheduler = self.service.schedulers.get(self.sw.name)
+        if scheduler is None:
+            ok = np.ones(len(batch), dtype=bool)
+            try:
+                writeUpdates(self.sw, batch, self.service.batch_size, self.service.election_id)
+            except grpc.RpcError as e:
+                codes = updateCodes(e, len(batch))
+                if codes is None or _STALE.intersection(codes):
+                    # Some of the Write may have applied, or the switch holds
+                    # other routes than we thought: ask it what it holds
+                    self.resync = True
+                ok = (np.array(codes) == code_pb2.OK if codes is not None
+                      else np.zeros(len(batch), dtype=bool))
+                self.service.count('failed', np.count_nonzero(~ok))
+                self.service.lastError(self.sw, e)
+            if on_written and ok.any():
+                on_written(self.sw.name, [update for update, done
+                                          in zip(batch.toUpdates(), ok) if done])
+            return ok
+
+        updates = batch.toUpdates()
+        futures = [scheduler.submit(update, BULK) for update in updates]
+        wait(futures)
+        errors = [future.exception() for future in futures]
+        ok = np.array([error is None for error in errors], dtype=bool)
+        if not ok.all():
+            # The futures only carry the error of the whole Write, so it is
+            # unknown whether the switch holds what it refused
+            self.resync = True
+            self.service.count('failed', np.count_nonzero(~ok))
+            self.service.lastError(self.sw, next(e for e in errors if e is not None))
+        if on_written:
+            on_written(self.sw.name, [update for update, done in zip(updates, ok) if done])
+        return ok
+
+
+class RouteService(object):
+    """
+    Validates routes and installs them on the switches.
+
+    :param switches: switch name -> connection, in the order feeds number them
+    :param table: a RouteTable
+    :param ports: switch name -> allowed egress ports (see switchPorts), or
+                  None to accept any port
+    :param batch_size: updates per Write
+    :param max_pending: routes that may wait for one switch before submit blocks
+    :param schedulers: switch name -> the UpdateScheduler that owns its
+                       writes, if any; routes go to it as BULK updates
+    :param on_written: called with a switch name and the p4runtime_pb2.Update
+                       messages written to it, e.g. Auditor.applyUpdates
+    """
+
+    def __init__(self, p4info_helper, switches, table, ports=None,
+                 batch_size=DEFAULT_BATCH_SIZE, max_pending=DEFAULT_MAX_PENDING,
+                 election_id=1, schedulers=None, on_written=None):
+        self.p4info_helper = p4info_helper
+        self.names = list(switches)
+        self.table = table
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.election_id = election_id
+        self.schedulers = schedulers or {}
+        self.on_written = on_written
+        self.writers = [_SwitchWriter(self, switches[name]) for name in self.names]
+        self.allowed = np.ones((len(self.names), _PORTS), dtype=bool)
+        if ports is not None:
+            self.allowed[:] = False
+            for s, name in enumerate(self.names):
+                self.allowed[s, sorted(p for p in ports.get(name, ()) if p < _PORTS)] = True
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.last_error = None
+
+    def start(self):
+        """Reads which routes the switches hold, then starts the writers."""
+        for writer in self.writers:
+            writer.readInstalled()
+            writer.start()
+
+    def stop(self):
+        """Writes out what is pending, then stops the writers."""
+        for writer in self.writers:
+            writer.stop()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += int(n)
+
+    def lastError(self, sw, error):
+        with self.lock:
+            self.stats['errors'] += 1
+            self.last_error = "%s: %s %s" % (sw.name, error.code().name, error.details())
+
+    def validate(self, routes):
+        """
+        :returns: the reason code of every route, 0 for a valid one
+        """
+        reasons = np.zeros(len(routes), dtype=np.uint8)
+
+        def reject(code, bad):
+            reasons[(reasons == 0) & bad] = code
+
+        op, switch = routes['op'], routes['switch']
+        prefix_len = routes['prefix_len'].astype(np.uint64)
+        add = op == ADD
+        reject(1, ~add & (op != WITHDRAW))
+        reject(2, switch >= len(self.names))
+        reject(3, routes['config'] >= self.table.configs)
+        mask = (np.uint64(0xffffffff) << (np.uint64(32) - np.minimum(prefix_len, 32))) \
+            & np.uint64(0xffffffff)
+        host_bits = routes['prefix'].astype(np.uint64) & ~mask & np.uint64(0xffffffff)
+        reject(4, (prefix_len == 0) | (prefix_len > 32) | (host_bits != 0))
+        port = routes['port']
+        has_port = self.allowed[np.minimum(switch, len(self.names) - 1),
+                                np.minimum(port, _PORTS - 1)] & (port < _PORTS)
+        reject(5, add & ~has_port)
+        reject(6, add & (routes['mac'] >> np.uint64(48) != 0))
+        return reasons
+
+    def submit(self, routes):
+        """
+        Validates a ROUTE_DTYPE array and queues its valid routes.
+
+        :returns: REJECT_DTYPE array of the rejected ones
+        """
+        reasons = self.validate(routes)
+        bad = np.flatnonzero(reasons)
+        rejections = np.empty(len(bad), dtype=REJECT_DTYPE)
+        rejections['index'] = bad
+        rejections['reason'] = reasons[bad]
+        valid = routes[reasons == 0] if len(bad) else routes
+        self.count('received', len(routes))
+        self.count('rejected', len(bad))
+        for s in np.unique(valid['switch']):
+            self.writers[s].put(valid[valid['switch'] == s])
+        return rejections
+
+    def barrier(self):
+        """Waits until every route submitted so far is written; returns stats['failed']."""
+        for writer in self.writers:
+            writer.flush()
+        return self.stats['failed']
+
+    def describe(self):
+        text = ("routes received: %(received)d, rejected: %(rejected)d, coalesced: "
+                "%(coalesced)d, inserted: %(inserted)d, modified: %(modified)d, deleted: "
+                "%(deleted)d, unknown withdraws: %(dropped)d, failed: %(failed)d in "
+                "%(writes)d Writes" % self.stats)
+        if self.stats['errors']:
+            text += "; last error: %s" % self.last_error
+        return text
+
+
+def _recvExactly(sock, size):
+    """size bytes from a socket, or None if it closes first."""
+    data = bytearray(size)
+    view = memoryview(data)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:])
+        if not n:
+            return None
+        got += n
+    return data
+
+
+class _FeedHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        service = self.server.service
+        sock = self.request
+        hello = json.dumps({"switches": service.names,
+                            "configs": service.table.configs}).encode()
+        sock.sendall(_HEADER.pack(HELLO, len(hello)) + hello)
+        while True:
+            header = _recvExactly(sock, _HEADER.size)
+            if header is None:
+                return
+            magic, count = _HEADER.unpack(header)
+            if magic != BATCH or count > MAX_BATCH:
+                return
+            if count == 0:
+                failed = service.barrier()
+                sock.sendall(_REPLY.pack(REPLY, 0, 0, failed))
+                continue
+            data = _recvExactly(sock, count * ROUTE_DTYPE.itemsize)
+            if data is None:
+                return
+            rejections = service.submit(np.frombuffer(data, dtype=ROUTE_DTYPE))
+            sock.sendall(_REPLY.pack(REPLY, count - len(rejections), len(rejections),
+                                     service.stats['failed']) + rejections.tobytes())
+
+
+class _FeedServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serveRoutes(service, path=DEFAULT_SOCKET):
+    """
+    Starts the service and serves feeds on a unix socket in the background.
+
+    :returns: the socketserver; shutdown() it, then service.stop()
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    service.start()
+    server = _FeedServer(path, _FeedHandler)
+    server.service = service
+    threading.Thread(target=server.serve_forever, name='northbound', daemon=True).start()
+    return server
+
+
+def stopServing(server, service):
+    server.shutdown()
+    server.server_close()
+    service.stop()
+    if os.path.exists(server.server_address):
+        os.unlink(server.server_address)
+
+
+def _ip2int(addr):
+    return struct.unpack('!I', socket.inet_aton(addr))[0]
+
+
+def _mac2int(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def _prefix(text):
+    addr, _, length = text.partition('/')
+    return _ip2int(addr), int(length or 32)
+
+
+class RouteFeed(object):
+    """
+    A connection to a RouteService.
+
+    add() and withdraw() collect routes until send(); sendArray() sends a
+    ROUTE_DTYPE array built elsewhere (switches numbered as in .switches).
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        magic, size = _HEADER.unpack(self._recv(_HEADER.size))
+        if magic != HELLO:
+            raise ValueError("%s is not a route service" % path)
+        hello = json.loads(bytes(self._recv(size)))
+        self.switches = {name: i for i, name in enumerate(hello['switches'])}
+        self.configs = hello['configs']
+        self.rows = []
+
+    def _recv(self, size):
+        data = _recvExactly(self.sock, size)
+        if data is None:
+            raise ConnectionError("the route service closed the connection")
+        return data
+
+    def close(self):
+        self.sock.close()
+
+    def switchIndex(self, name):
+        if name not in self.switches:
+            raise KeyError("the route service has no switch %r" % name)
+        return self.switches[name]
+
+    def add(self, switch, prefix, port, next_hop_mac, config=0):
+        """Queues a route; prefix is 'a.b.c.d/len'."""
+        addr, length = _prefix(prefix)
+        self.rows.append((ADD, self.switchIndex(switch), config, length, addr, port,
+                          _mac2int(next_hop_mac)))
+
+    def withdraw(self, switch, prefix, config=0):
+        addr, length = _prefix(prefix)
+        self.rows.append((WITHDRAW, self.switchIndex(switch), config, length, addr, 0, 0))
+
+    def send(self):
+        """Sends the queued routes as one batch; returns its Reply."""
+        routes = np.array(self.rows, dtype=ROUTE_DTYPE)
+        self.rows = []
+        return self.sendArray(routes)
+
+    def sendArray(self, routes):
+        if not len(routes):
+            return Reply(0, 0, 0, np.empty(0, dtype=REJECT_DTYPE))
+        self.sock.sendall(_HEADER.pack(BATCH, len(routes)) +
+                          np.ascontiguousarray(routes, dtype=ROUTE_DTYPE).tobytes())
+        return self._reply()
+
+    def barrier(self):
+        """Waits until the service has written everything sent; returns its Reply."""
+        self.sock.sendall(_HEADER.pack(BATCH, 0))
+        return self._reply()
+
+    def _reply(self):
+        magic, accepted, rejected, failed = _REPLY.unpack(self._recv(_REPLY.size))
+        if magic != REPLY:
+            raise ValueError("unexpected reply from the route service")
+        rejections = np.frombuffer(self._recv(rejected * REJECT_DTYPE.itemsize),
+                                   dtype=REJECT_DTYPE)
+        return Reply(accepted, rejected, failed, rejections)
+
+
+def feedDump(feed, lines, batch=DEFAULT_BATCH_SIZE * 10):
+    """
+    Sends a text dump (see the module docstring) in batches.
+
+    :returns: (routes sent, list of (line number, reason) of rejected ones)
+    """
+    sent, rejected, numbers = 0, [], []
+
+    def flush():
+        reply = feed.send()
+        for index, reason in reply.rejections:
+            rejected.append((numbers[index], REJECT_REASONS[reason - 1]))
+        del numbers[:]
+
+    for number, line in enumerate(lines, 1):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        try:
+            if fields[0] == 'add':
+                feed.add(fields[1], fields[2], int(fields[3]), fields[4],
+                         int(fields[5]) if len(fields) > 5 else 0)
+            elif fields[0] == 'withdraw':
+                feed.withdraw(fields[1], fields[2], int(fields[3]) if len(fields) > 3 else 0)
+            else:
+                raise ValueError(fields[0])
+        except (IndexError, KeyError, ValueError, OSError):
+            rejected.append((number, 'unparsable'))
+            continue
+        numbers.append(number)
+        sent += 1
+        if len(numbers) >= batch:
+            flush()
+    flush()
+    return sent, rejected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Feed routes to a running route service')
+    parser.add_argument('dump', nargs='?', help='text dump of routes (default: stdin)')
+    parser.add_argument('--socket', help='unix socket of the route service',
+                        type=str, action="store", default=DEFAULT_SOCKET)
+    parser.add_argument('--batch', help='routes per batch', type=int, action="store",
+                        default=DEFAULT_BATCH_SIZE * 10)
+    args = parser.parse_args()
+
+    feed = RouteFeed(args.socket)
+    start = perf_counter()
+    with (open(args.dump) if args.dump else sys.stdin) as lines:
+        sent, rejected = feedDump(feed, lines, args.batch)
+    reply = feed.barrier()
+    elapsed = perf_counter() - start
+    feed.close()
+    for number, reason in rejected[:20]:
+        print("line %d rejected: %s" % (number, reason))
+    if len(rejected) > 20:
+        print("... and %d more" % (len(rejected) - 20))
+    print("sent %d routes in %.3f s (%.0f routes/s), %d rejected; the switches refused "
+          "%d updates so far" % (sent, elapsed, sent / elapsed if elapsed else 0.0,
+                                 len(rejected), reply.failed))
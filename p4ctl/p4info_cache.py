@@ -0,0 +1,213 @@
+"""
+Cached, pre-indexed P4Info loading.
+
+``p4runtime_lib.helper.P4InfoHelper`` parses the text-format P4Info on every
+start and then answers each name/ID lookup by scanning the proto lists.
+``CachedP4InfoHelper`` is a drop-in replacement that
+
+* keeps dicts from names, aliases and IDs to entity positions, for every
+  top-level entity type, for the match fields of each table and for the
+  params of each action, and
+* persists the binary-encoded P4Info together with those dicts next to the
+  text file (``<p4info>.cache``), keyed by the SHA-256 of the text, so later
+  starts skip text parsing altogether.
+
+A stale, unreadable or foreign cache is simply rebuilt.
+
+The cache can be warmed ahead of time, e.g. right after ``make``:
+
+    python3 -m p4ctl.p4info_cache build/mrc.p4.p4info.txt
+"""
+import hashlib
+import os
+import pickle
+import sys
+
+import google.protobuf.text_format
+from p4.config.v1 import p4info_pb2
+
+from p4runtime_lib.helper import P4InfoHelper
+
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 1
+
+
+def _entityTypes():
+    """The repeated P4Info fields whose elements carry a preamble."""
+    types = []
+    for field in p4info_pb2.P4Info.DESCRIPTOR.fields:
+        if (field.label == field.LABEL_REPEATED and field.message_type is not None
+                and 'preamble' in field.message_type.fields_by_name):
+            types.append(field.name)
+    return types
+
+
+def buildIndex(p4info):
+    """
+    Builds the lookup dicts for a P4Info message.
+
+    Positions are stored rather than objects so the index is plain data that
+    can be persisted with the serialized P4Info.
+    """
+    by_name = {}
+    by_id = {}
+    for entity_type in _entityTypes():
+        names = by_name[entity_type] = {}
+        ids = by_id[entity_type] = {}
+        for pos, o in enumerate(getattr(p4info, entity_type)):
+            pre = o.preamble
+            # Same precedence as P4InfoHelper.get(): first entity wins
+            names.setdefault(pre.name, pos)
+            if pre.alias:
+                names.setdefault(pre.alias, pos)
+            ids.setdefault(pre.id, pos)
+
+    match_fields = {}
+    for t in p4info.tables:
+        names, ids = match_fields.setdefault(t.preamble.name, ({}, {}))
+        for pos, mf in enumerate(t.match_fields):
+            names.setdefault(mf.name, pos)
+            ids.setdefault(mf.id, pos)
+
+    params = {}
+    for a in p4info.actions:
+        names, ids = params.setdefault(a.preamble.name, ({}, {}))
+        for pos, p in enumerate(a.params):
+            names.setdefault(p.name, pos)
+            ids.setdefault(p.id, pos)
+
+    return {
+        'by_name': by_name,
+        'by_id': by_id,
+        'match_fields': match_fields,
+        'params': params,
+    }
+
+
+def _readCache(cache_filepath, digest):
+    try:
+        with open(cache_filepath, 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, pickle.UnpicklingError):
+        return None
+    if (not isinstance(cached, dict) or cached.get('version') != CACHE_VERSION
+            or cached.get('digest') != digest):
+        return None
+    p4info = p4info_pb2.P4Info()
+    p4info.ParseFromString(cached['p4info'])
+    return p4info, cached['index']
+
+
+def _writeCache(cache_filepath, digest, p4info, index):
+    tmp_filepath = '%s.%d.tmp' % (cache_filepath, os.getpid())
+    try:
+        with open(tmp_filepath, 'wb') as f:
+            pickle.dump({
+                'version': CACHE_VERSION,
+                'digest': digest,
+                'p4info': p4info.SerializeToString(),
+                'index': index,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filepath, cache_filepath)
+    except OSError:
+        # A read-only build dir only costs us the cache
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+
+
+def loadP4Info(p4_info_filepath, cache_filepath=None):
+    """
+    Loads a text-format P4Info, going through the binary cache.
+
+    :param p4_info_filepath: the p4info file from p4c
+    :param cache_filepath: where to keep the cache, defaults to
+                           <p4_info_filepath>.cache; False disables it
+    :returns: (P4Info message, index dict, True if served from cache)
+    """
+    with open(p4_info_filepath, 'rb') as p4info_f:
+        text = p4info_f.read()
+    digest = hashlib.sha256(text).hexdigest()
+    if cache_filepath is None:
+        cache_filepath = p4_info_filepath + CACHE_SUFFIX
+
+    if cache_filepath:
+        cached = _readCache(cache_filepath, digest)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    p4info = p4info_pb2.P4Info()
+    google.protobuf.text_format.Merge(text.decode('utf-8'), p4info)
+    index = buildIndex(p4info)
+    if cache_filepath:
+        _writeCache(cache_filepath, digest, p4info, index)
+    return p4info, index, False
+
+
+class CachedP4InfoHelper(P4InfoHelper):
+    """
+    P4InfoHelper with dict lookups and an on-disk P4Info cache.
+
+    All of P4InfoHelper's API (buildTableEntry, get_*_id/get_*_name, ...)
+    keeps working; the lookups it is built on just stop scanning.
+    """
+
+    def __init__(self, p4_info_filepath, cache_filepath=None):
+        # P4InfoHelper.__init__ would parse the text again
+        self.p4info, self.index, self.from_cache = loadP4Info(p4_info_filepath,
+                                                              cache_filepath)
+
+    def __getattr__(self, attr):
+        # Remember the synthesized get_<type>_id/get_<type>_name functions so
+        # that hot paths like buildTableEntry don't re-run the regex each time
+        fn = P4InfoHelper.__getattr__(self, attr)
+        setattr(self, attr, fn)
+        return fn
+
+    def get(self, entity_type, name=None, id=None):
+        if name is not None and id is not None:
+            raise AssertionError("name or id must be None")
+
+        if name:
+            pos = self.index['by_name'].get(entity_type, {}).get(name)
+        else:
+            pos = self.index['by_id'].get(entity_type, {}).get(id)
+        if pos is not None:
+            return getattr(self.p4info, entity_type)[pos]
+
+        if name:
+            raise AttributeError("Could not find %r of type %s" % (name, entity_type))
+        else:
+            raise AttributeError("Could not find id %r of type %s" % (id, entity_type))
+
+    def get_match_field(self, table_name, name=None, id=None):
+        names, ids = self.index['match_fields'].get(table_name, ({}, {}))
+        pos = names.get(name) if name is not None else ids.get(id)
+        if pos is None:
+            raise AttributeError("%r has no attribute %r" % (
+                table_name, name if name is not None else id))
+        table = self.p4info.tables[self.index['by_name']['tables'][table_name]]
+        return table.match_fields[pos]
+
+    def get_action_param(self, action_name, name=None, id=None):
+        names, ids = self.index['params'].get(action_name, ({}, {}))
+        pos = names.get(name) if name is not None else ids.get(id)
+        if pos is None:
+            raise AttributeError("action %r has no param %r" % (
+                action_name, name if name is not None else id))
+        action = self.p4info.actions[self.index['by_name']['actions'][action_name]]
+        return action.params[pos]
+
+
+if __name__ == '__main__':
+    from time import perf_counter
+
+    if len(sys.argv) < 2:
+        print("usage: python3 -m p4ctl.p4info_cache <p4info.txt>...")
+        sys.exit(1)
+    for p4info_filepath in sys.argv[1:]:
+        start = perf_counter()
+        helper = CachedP4InfoHelper(p4info_filepath)
+        print("%s: %s in %.1f ms (%d tables, %d actions)" % (
+            p4info_filepath, "loaded from cache" if helper.from_cache else "cache built",
+            (perf_counter() - start) * 1000, len(helper.p4info.tables),
+            len(helper.p4info.actions)))
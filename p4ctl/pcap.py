@@ -0,0 +1,182 @@
+"""
+Loading IPv4 flow tuples for the offline analysis tools.
+
+Flows are kept column-wise in a NumPy structured array (``FLOW_DTYPE``) so the
+classifiers can work on millions of them at once. They can come from a classic
+libpcap capture, from a ``.npy``/``.npz`` file written by ``saveFlows`` (or by
+any other tool producing the same columns), or be generated synthetically.
+"""
+import socket
+import struct
+
+import numpy as np
+
+FLOW_DTYPE = np.dtype([
+    ('src', np.uint32),
+    ('dst', np.uint32),
+    ('proto', np.uint8),
+    ('sport', np.uint16),
+    ('dport', np.uint16),
+])
+
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+
+_PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': '<',  # microsecond, little endian
+    b'\xa1\xb2\xc3\xd4': '>',  # microsecond, big endian
+    b'\x4d\x3c\xb2\xa1': '<',  # nanosecond, little endian
+    b'\xa1\xb2\x3c\x4d': '>',  # nanosecond, big endian
+}
+
+
+def ip2int(addr):
+    return struct.unpack('!I', socket.inet_aton(addr))[0]
+
+
+def int2ip(value):
+    return socket.inet_ntoa(struct.pack('!I', int(value)))
+
+
+def _be16(buf, offsets):
+    return (buf[offsets].astype(np.uint16) << 8) | buf[offsets + 1]
+
+
+def _be32(buf, offsets):
+    return ((buf[offsets].astype(np.uint32) << 24) |
+            (buf[offsets + 1].astype(np.uint32) << 16) |
+            (buf[offsets + 2].astype(np.uint32) << 8) |
+            buf[offsets + 3])
+
+
+def readPcap(path):
+    """
+    Reads the IPv4 flow tuples of every packet in a classic libpcap file.
+
+    Only the per-record headers are walked in Python; the Ethernet/IPv4/L4
+    fields are then gathered for all packets at once. Non-IPv4 frames and
+    truncated packets are skipped. Ports are 0 for protocols other than TCP
+    and UDP.
+
+    :param path: the capture file (Ethernet or raw-IP link type)
+    :returns: a FLOW_DTYPE array, one element per IPv4 packet
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 24 or data[:4] not in _PCAP_MAGIC:
+        raise ValueError("%s is not a libpcap capture (pcapng is not supported)" % path)
+    endian = _PCAP_MAGIC[data[:4]]
+    linktype = struct.unpack_from(endian + 'I', data, 20)[0]
+    if linktype == LINKTYPE_ETHERNET:
+        l2_len = 14
+    elif linktype == LINKTYPE_RAW:
+        l2_len = 0
+    else:
+        raise ValueError("%s: unsupported link type %d" % (path, linktype))
+
+    record = struct.Struct(endian + 'IIII')
+    starts = []
+    lengths = []
+    pos = 24
+    end = len(data)
+    while pos + 16 <= end:
+        _, _, caplen, _ = record.unpack_from(data, pos)
+        pos += 16
+        starts.append(pos)
+        lengths.append(caplen)
+        pos += caplen
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    keep = (lengths >= l2_len + 20) & (starts + lengths <= end)
+    starts, lengths = starts[keep], lengths[keep]
+
+    if l2_len:
+        is_ipv4 = _be16(buf, starts + 12) == 0x0800
+        starts, lengths = starts[is_ipv4], lengths[is_ipv4]
+    l3 = starts + l2_len
+    is_ipv4 = (buf[l3] >> 4) == 4
+    l3, starts, lengths = l3[is_ipv4], starts[is_ipv4], lengths[is_ipv4]
+
+    flows = np.zeros(len(l3), dtype=FLOW_DTYPE)
+    flows['proto'] = buf[l3 + 9]
+    flows['src'] = _be32(buf, l3 + 12)
+    flows['dst'] = _be32(buf, l3 + 16)
+
+    l4 = l3 + (buf[l3] & 0x0f).astype(np.int64) * 4
+    has_ports = (((flows['proto'] == PROTO_TCP) | (flows['proto'] == PROTO_UDP)) &
+                 (l4 + 4 <= starts + lengths))
+    l4 = l4[has_ports]
+    flows['sport'][has_ports] = _be16(buf, l4)
+    flows['dport'][has_ports] = _be16(buf, l4 + 2)
+    return flows
+
+
+def saveFlows(path, flows):
+    """Writes flows as a ``.npz`` with one array per column."""
+    np.savez(path, **{name: flows[name] for name in FLOW_DTYPE.names})
+
+
+def loadFlows(path):
+    """
+    Loads flow tuples from a pcap, ``.npy`` or ``.npz`` file.
+
+    A ``.npz`` must hold the FLOW_DTYPE columns as separate arrays (missing
+    port/protocol columns default to 0); a ``.npy`` must hold either a
+    structured array with those fields or a plain array of destination
+    addresses.
+    """
+    if path.endswith('.npz'):
+        with np.load(path) as columns:
+            if 'dst' not in columns:
+                raise ValueError("%s has no 'dst' column" % path)
+            flows = np.zeros(len(columns['dst']), dtype=FLOW_DTYPE)
+            for name in FLOW_DTYPE.names:
+                if name in columns:
+                    flows[name] = columns[name]
+        return flows
+    if path.endswith('.npy'):
+        array = np.load(path)
+        if array.dtype.names is None:
+            flows = np.zeros(len(array), dtype=FLOW_DTYPE)
+            flows['dst'] = array
+            return flows
+        flows = np.zeros(len(array), dtype=FLOW_DTYPE)
+        for name in FLOW_DTYPE.names:
+            if name in array.dtype.names:
+                flows[name] = array[name]
+        return flows
+    return readPcap(path)
+
+
+def syntheticFlows(count, dst_addrs=None, dst_ports=None, seed=0, udp_fraction=0.5):
+    """
+    Generates random flow tuples, e.g. for benchmarking.
+
+    :param count: the number of flows
+    :param dst_addrs: optional list of dotted-quad destinations to draw from;
+                      destinations are uniformly random otherwise
+    :param dst_ports: optional list of destination ports to draw from
+    :param seed: the random seed
+    :param udp_fraction: the share of UDP flows, the rest is TCP
+    """
+    rng = np.random.default_rng(seed)
+    flows = np.zeros(count, dtype=FLOW_DTYPE)
+    flows['src'] = rng.integers(0, 1 << 32, count, dtype=np.uint32)
+    if dst_addrs:
+        pool = np.array([ip2int(a) for a in dst_addrs], dtype=np.uint32)
+        flows['dst'] = pool[rng.integers(0, len(pool), count)]
+    else:
+        flows['dst'] = rng.integers(0, 1 << 32, count, dtype=np.uint32)
+    flows['proto'] = np.where(rng.random(count) < udp_fraction, PROTO_UDP, PROTO_TCP)
+    flows['sport'] = rng.integers(1024, 1 << 16, count, dtype=np.uint16)
+    if dst_ports:
+        pool = np.array(dst_ports, dtype=np.uint16)
+        flows['dport'] = pool[rng.integers(0, len(pool), count)]
+    else:
+        flows['dport'] = rng.integers(0, 1 << 16, count, dtype=np.uint16)
+    return flows
@@ -0,0 +1,430 @@
+"""
+A long-lived pool of switch connections, shared by short-lived tools.
+
+gRPC channels cannot be handed from one process to another, so the pool is a
+small local daemon: it holds one keepalive channel and stream channel per
+switch, stays master of every switch, and serves the P4Runtime API itself on
+a unix socket. Tools borrow a switch by connecting to that socket instead of
+the switch; arbitration is answered by the pool without a round trip, with
+the pool's own mastership of that switch, and every RPC is forwarded over
+the pool's already open channel:
+
+    python3 -m p4ctl.pool --switch s1=127.0.0.1:50051,0 --switch s2=127.0.0.1:50052,1
+
+    s1 = borrowConnection('s1', '127.0.0.1:50051', 0)
+    s1.MasterArbitrationUpdate()
+    s1.WriteTableEntries(entries)
+
+``borrowConnection`` falls back to a direct connection when no pool is
+running, so tools behave the same either way.
+
+The pool writes with its own election ID whatever a borrower sends. When a
+switch goes away (its stream channel fails, which the keepalive pings notice
+on an idle connection too) the pool reconnects with exponential backoff and
+re-arbitrates; meanwhile RPCs for that switch fail with UNAVAILABLE.
+Packet-ins, digests and idle-timeout notifications are passed to every
+borrower's stream channel; packet-outs from borrowers go to the switch.
+
+gRPC serves every open stream channel with a thread of its own, and each
+borrowed connection keeps one open. The pool therefore takes at most
+``--max-streams`` of them (more are refused with RESOURCE_EXHAUSTED) and
+keeps ``--workers`` threads beyond those for Writes and Reads, so borrowers
+that hold streams can never starve the RPCs.
+
+With ``--read-ttl``, identical reads from all borrowers are coalesced and
+served from a p4ctl.readcache.ReadCache for that long; writes through the
+pool invalidate the cache of their switch.
+"""
+import argparse
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+from concurrent import futures
+
+import grpc
+
+from p4ctl.readcache import ReadCache
+from p4ctl.shard import SwitchSpec
+
+DEFAULT_SOCKET = 'unix:/tmp/p4ctl-pool.sock'
+
+# Stream channels served at once (a p4ctl command holds one per switch), and
+# threads left for everything else
+DEFAULT_MAX_STREAMS = 64
+DEFAULT_WORKERS = 16
+
+MIN_BACKOFF = 0.1
+MAX_BACKOFF = 5.0
+
+# StreamMessageResponse fields passed on to borrowers
+FORWARDED_UPDATES = ('packet', 'digest', 'idle_timeout_notification')
+
+
+def socketPath(address):
+    return address[len('unix:'):] if address.startswith('unix:') else None
+
+
+def poolRunning(pool=DEFAULT_SOCKET):
+    """Whether a pool is listening on the unix socket (not just left its file)."""
+    path = socketPath(pool)
+    if path is None or not os.path.exists(path):
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def borrowConnection(name, address, device_id, pool=DEFAULT_SOCKET, **kwargs):
+    """
+    A ControllerConnection through the pool if one is running, else direct.
+
+    Keyword arguments go to ControllerConnection (e.g. election_id).
+    """
+    from p4ctl.switch import ControllerConnection
+
+    if poolRunning(pool):
+        address = pool
+    return ControllerConnection(name=name, address=address, device_id=device_id, **kwargs)
+
+
+class PooledSwitch(object):
+    """One switch of the pool: its connection and whether it is usable."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.sw = None
+        self.up = threading.Event()
+        self.borrowers = set()
+        self.lock = threading.Lock()
+
+    def arbitrationStatus(self):
+        """The status code and message a borrower's arbitration gets: the pool's."""
+        if not self.up.is_set():
+            return grpc.StatusCode.UNAVAILABLE, "%s is reconnecting" % self.spec.name
+        if not self.sw.is_master:
+            # As the switch answers a backup controller
+            return (grpc.StatusCode.ALREADY_EXISTS,
+                    "The pool is not master of %s" % self.spec.name)
+        return grpc.StatusCode.OK, ""
+
+    def forward(self, kind, message):
+        from p4.v1 import p4runtime_pb2
+
+        response = p4runtime_pb2.StreamMessageResponse()
+        getattr(response, kind).CopyFrom(message)
+        with self.lock:
+            for borrower in self.borrowers:
+                borrower.put(response)
+
+
+class ConnectionPool(object):
+    """
+    Keeps a master connection to every switch, reconnecting as needed.
+
+    :param specs: SwitchSpec list
+    :param election_id: election ID the pool arbitrates and writes with
+    :param heartbeat: seconds between arbitration updates re-sent on idle
+                      streams, which also tells the pool if it lost mastership
+    :param read_ttl: if set, reads are cached and coalesced for this long
+    """
+
+    def __init__(self, specs, election_id=1, heartbeat=5.0, read_ttl=0):
+        self.switches = {spec.name: PooledSwitch(spec) for spec in specs}
+        self.by_device_id = {spec.device_id: self.switches[spec.name] for spec in specs}
+        self.election_id = election_id
+        self.heartbeat = heartbeat
+        self.read_cache = ReadCache(read_ttl) if read_ttl else None
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for pooled in self.switches.values():
+            thread = threading.Thread(target=self._keepConnected, args=(pooled,),
+                                      name='pool-%s' % pooled.spec.name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        for pooled in self.switches.values():
+            if pooled.sw is not None:
+                pooled.sw.shutdown()
+
+    def _connect(self, pooled):
+        from p4ctl.stream import streamDispatcher
+        from p4ctl.switch import KEEPALIVE_OPTIONS, ControllerConnection
+
+        if pooled.sw is None:
+            spec = pooled.spec
+            pooled.sw = ControllerConnection(name=spec.name, address=spec.address,
+                                             device_id=spec.device_id,
+                                             election_id=self.election_id,
+                                             channel_options=KEEPALIVE_OPTIONS)
+            dispatcher = streamDispatcher(pooled.sw)
+            dispatcher.subscribe('arbitration', lambda arbitration:
+                                 self._handleArbitration(pooled, arbitration))
+            for kind in FORWARDED_UPDATES:
+                dispatcher.subscribe(kind, lambda message, kind=kind:
+                                     pooled.forward(kind, message))
+        else:
+            pooled.sw.reconnect()
+        if not pooled.sw.is_master:
+            pooled.sw.MasterArbitrationUpdate()
+        if not pooled.sw.is_master:
+            print("Pool is not master of %s; writes will be refused" % pooled.spec.name)
+        streamDispatcher(pooled.sw).restart()
+
+    def _handleArbitration(self, pooled, arbitration):
+        is_master = arbitration.status.code == 0
+        if is_master != pooled.sw.is_master:
+            print("Pool %s master of %s" % ("is again" if is_master else "is no longer",
+                                            pooled.spec.name))
+        pooled.sw.is_master = is_master
+
+    def _arbitrationRequest(self, pooled):
+        from p4.v1 import p4runtime_pb2
+
+        from p4ctl.switch import setElectionId
+
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = pooled.spec.device_id
+        setElectionId(request.arbitration.election_id, self.election_id)
+        return request
+
+    def _keepConnected(self, pooled):
+        backoff = MIN_BACKOFF
+        while not self.stopped.is_set():
+            try:
+                self._connect(pooled)
+            except grpc.RpcError as e:
+                print("Connecting to %s failed: %s, retrying in %.1fs" % (
+                    pooled.spec.name, e.code().name, backoff))
+                if self.stopped.wait(backoff):
+                    return
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = MIN_BACKOFF
+            print("Connected to %s at %s" % (pooled.spec.name, pooled.spec.address))
+            pooled.up.set()
+            # Servers refuse keepalive pings on connections that carry no
+            # data, so idle streams get an arbitration update now and then
+            while not pooled.sw.stream_dispatcher.closed.wait(self.heartbeat):
+                pooled.sw.requests_stream.put(self._arbitrationRequest(pooled))
+            pooled.up.clear()
+            if not self.stopped.is_set():
+                print("Lost %s, reconnecting" % pooled.spec.name)
+
+    def get(self, device_id, context):
+        """The live connection for a device ID, or aborts the RPC."""
+        pooled = self.by_device_id.get(device_id)
+        if pooled is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, "No switch with device ID %d" % device_id)
+        if not pooled.up.is_set():
+            context.abort(grpc.StatusCode.UNAVAILABLE, "%s is reconnecting" % pooled.spec.name)
+        return pooled
+
+
+def _servicer(pool, max_streams=DEFAULT_MAX_STREAMS):
+    """The P4Runtime servicer the pool exposes to borrowers."""
+    from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+    from p4ctl.switch import setElectionId
+
+    def forward(context, call):
+        # Borrowers see the switch's error, not one from the proxy
+        try:
+            return call()
+        except grpc.RpcError as e:
+            context.abort(e.code(), e.details())
+
+    streams = threading.BoundedSemaphore(max_streams)
+
+    def invalidate(device_id):
+        if pool.read_cache is not None:
+            pool.read_cache.invalidate(device_id)
+
+    class PoolServicer(p4runtime_pb2_grpc.P4RuntimeServicer):
+
+        def Write(self, request, context):
+            sw = pool.get(request.device_id, context).sw
+            setElectionId(request.election_id, pool.election_id)
+            try:
+                return forward(context, lambda: sw.client_stub.Write(request))
+            finally:
+                # Also after a failed write, which may have applied in part
+                invalidate(request.device_id)
+
+        def Read(self, request, context):
+            sw = pool.get(request.device_id, context).sw
+            try:
+                if pool.read_cache is None:
+                    responses = sw.client_stub.Read(request)
+                else:
+                    responses = pool.read_cache.read(request.device_id, request,
+                                                     lambda: sw.client_stub.Read(request))
+                for response in responses:
+                    yield response
+            except grpc.RpcError as e:
+                context.abort(e.code(), e.details())
+
+        def SetForwardingPipelineConfig(self, request, context):
+            sw = pool.get(request.device_id, context).sw
+            setElectionId(request.election_id, pool.election_id)
+            try:
+                return forward(context, lambda: sw.client_stub.SetForwardingPipelineConfig(request))
+            finally:
+                invalidate(request.device_id)
+
+        def GetForwardingPipelineConfig(self, request, context):
+            sw = pool.get(request.device_id, context).sw
+            return forward(context, lambda: sw.client_stub.GetForwardingPipelineConfig(request))
+
+        def Capabilities(self, request, context):
+            if not pool.switches:
+                context.abort(grpc.StatusCode.UNAVAILABLE, "The pool has no switches")
+            pooled = next(iter(pool.switches.values()))
+            sw = pool.get(pooled.spec.device_id, context).sw
+            return forward(context, lambda: sw.client_stub.Capabilities(request))
+
+        def StreamChannel(self, request_iterator, context):
+            # This handler holds a server thread until the stream closes
+            if not streams.acquire(blocking=False):
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                              "The pool serves at most %d stream channels" % max_streams)
+            try:
+                for response in self._streamChannel(request_iterator, context):
+                    yield response
+            finally:
+                streams.release()
+
+        def _streamChannel(self, request_iterator, context):
+            responses = queue.Queue()
+            attached = []
+
+            def readRequests():
+                try:
+                    for request in request_iterator:
+                        kind = request.WhichOneof('update')
+                        if kind == 'arbitration':
+                            pooled = pool.by_device_id.get(request.arbitration.device_id)
+                            response = p4runtime_pb2.StreamMessageResponse()
+                            response.arbitration.CopyFrom(request.arbitration)
+                            if pooled is None:
+                                response.arbitration.status.code = grpc.StatusCode.NOT_FOUND.value[0]
+                            else:
+                                code, message = pooled.arbitrationStatus()
+                                response.arbitration.status.code = code.value[0]
+                                response.arbitration.status.message = message
+                                if pooled not in attached:
+                                    with pooled.lock:
+                                        pooled.borrowers.add(responses)
+                                    attached.append(pooled)
+                            responses.put(response)
+                        elif kind == 'packet' and attached and attached[0].up.is_set():
+                            attached[0].sw.requests_stream.put(request)
+                except grpc.RpcError:
+                    pass
+                finally:
+                    responses.put(None)
+
+            threading.Thread(target=readRequests, daemon=True).start()
+            try:
+                while True:
+                    response = responses.get()
+                    if response is None:
+                        return
+                    yield response
+            finally:
+                for pooled in attached:
+                    with pooled.lock:
+                        pooled.borrowers.discard(responses)
+
+    return PoolServicer()
+
+
+def serve(pool, address=DEFAULT_SOCKET, max_workers=DEFAULT_WORKERS,
+          max_streams=DEFAULT_MAX_STREAMS):
+    """
+    Starts the pool and its P4Runtime server; returns the grpc.Server.
+
+    :param max_workers: threads for unary RPCs
+    :param max_streams: stream channels served at once, each on a thread of its own
+    """
+    from p4.v1 import p4runtime_pb2_grpc
+
+    path = socketPath(address)
+    if path is not None and os.path.exists(path):
+        os.unlink(path)
+    pool.start()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers + max_streams))
+    p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(_servicer(pool, max_streams), server)
+    server.add_insecure_port(address)
+    server.start()
+    return server
+
+
+def parseSwitch(text):
+    """name=address[,device_id] -> SwitchSpec"""
+    name, _, rest = text.partition('=')
+    address, _, device_id = rest.partition(',')
+    if not name or not address:
+        raise argparse.ArgumentTypeError("expected name=address[,device_id]: %r" % text)
+    return SwitchSpec(name, address, int(device_id or 0))
+
+
+def main(switches, address, election_id, read_ttl, max_streams=DEFAULT_MAX_STREAMS,
+         workers=DEFAULT_WORKERS):
+    pool = ConnectionPool(switches, election_id=election_id, read_ttl=read_ttl)
+    server = serve(pool, address, workers, max_streams)
+    print("Pooling %d switches on %s" % (len(switches), address))
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(0))
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    pool.stop()
+    server.stop(0)
+    if pool.read_cache is not None:
+        print("Reads: %(hits)d cached, %(coalesced)d coalesced, %(misses)d sent to "
+              "the switches" % pool.read_cache.stats)
+    path = socketPath(address)
+    if path is not None and os.path.exists(path):
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    # Default: the s1..s3 of the exercises, on the usual 5005x ports
+    default_switches = [SwitchSpec('s%d' % i, '127.0.0.1:%d' % (50050 + i), i - 1)
+                        for i in (1, 2, 3)]
+
+    parser = argparse.ArgumentParser(description='P4Runtime connection pool')
+    parser.add_argument('--switch', help='name=address[,device_id], repeatable',
+                        type=parseSwitch, action='append', dest='switches')
+    parser.add_argument('--socket', help='Address borrowers connect to',
+                        type=str, action="store", required=False,
+                        default=DEFAULT_SOCKET)
+    parser.add_argument('--election-id', help='Election ID the pool is master with',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--read-ttl', help='Serve identical reads from a cache for this '
+                        'many seconds (default: no caching)',
+                        type=float, action="store", required=False, default=0)
+    parser.add_argument('--max-streams', help='borrowed connections (stream channels) '
+                        'served at once; more are refused', type=int, action="store",
+                        required=False, default=DEFAULT_MAX_STREAMS)
+    parser.add_argument('--workers', help='threads for Writes, Reads and other RPCs, '
+                        'besides those of the streams', type=int, action="store",
+                        required=False, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+    main(args.switches or default_switches, args.socket, args.election_id, args.read_ttl,
+         args.max_streams, args.workers)
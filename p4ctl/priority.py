@@ -0,0 +1,187 @@
+"""
+Sparse priorities for ordered (ternary, range) tables.
+
+Entries of a ternary table are ordered by their P4Runtime ``priority``,
+higher first. Numbering rules 1, 2, 3, ... means that putting a rule in
+between renumbers every rule below it. ``PriorityAllocator`` instead keeps
+the rules in order with gaps between their priorities:
+
+* a new rule takes the middle of the gap between its neighbours,
+* only when that gap is used up does it respace a window of rules around
+  the insertion point, doubling the window until it has room to spare; the
+  larger the window, the more room it must leave, so respacing stays rare
+  and local,
+* removing a rule never moves anything.
+
+The priority is part of an entry's identity, so a rule cannot be MODIFYed to
+a new priority. A moved rule is inserted at its new priority and then
+deleted at the old one, which never leaves a hole in the policy.
+``moveUpdates`` orders these so that the rules keep their relative order
+after every single update, as long as the switch applies the updates of a
+WriteRequest in order (BMv2 does).
+
+    allocator = PriorityAllocator()
+    allocator.extend(["deny-udp-80", "deny-10.0.1.4"])       # highest first
+    priority, moves = allocator.insert("allow-dns", 0)     # before both
+    sw.WriteUpdates(moveUpdates(entries, moves) + [insertUpdate(entries["allow-dns"], priority)])
+"""
+from p4.v1 import p4runtime_pb2
+
+# P4Runtime priorities are positive int32
+MAX_PRIORITY = (1 << 31) - 1
+
+# Gap between rules when there is room for it
+DEFAULT_GAP = 1 << 16
+
+
+class PriorityAllocator(object):
+    """
+    Keeps rules (any hashable keys) in precedence order with sparse priorities.
+
+    :param max_priority: the highest priority handed out; 1 is the lowest
+    :param gap: the spacing aimed for when (re)numbering
+    """
+
+    def __init__(self, max_priority=MAX_PRIORITY, gap=DEFAULT_GAP):
+        self.max_priority = max_priority
+        self.gap = gap
+        self.order = []
+        self.priorities = {}
+
+    def __len__(self):
+        return len(self.order)
+
+    def index(self, key):
+        """Position of a rule, 0 being the highest priority."""
+        return self.order.index(key)
+
+    def load(self, priorities):
+        """Takes over existing rules as they are, e.g. read back from a switch."""
+        self.priorities = dict(priorities)
+        self.order = sorted(self.priorities, key=lambda key: -self.priorities[key])
+
+    def extend(self, keys):
+        """
+        Appends rules below all others.
+
+        :returns: (added, moves): (key, priority) of the new rules, and the
+                  earlier rules that had to be respaced, as for insert()
+        """
+        before = dict(self.priorities)
+        keys = list(keys)
+        for key in keys:
+            self.insert(key, len(self.order))
+        moves = [(key, before[key], self.priorities[key]) for key in self.order
+                 if key in before and before[key] != self.priorities[key]]
+        return [(key, self.priorities[key]) for key in keys], _safeOrder(moves)
+
+    def insert(self, key, index):
+        """
+        Puts a rule at a position, 0 being the highest priority.
+
+        :returns: (priority, moves): the new rule's priority and the rules
+                  that had to be respaced, as (key, old priority, new priority)
+                  in the order moveUpdates() needs
+        :raises ValueError: if the key is already there, or no priorities
+                            are left at all
+        """
+        if key in self.priorities:
+            raise ValueError("%r is already allocated" % (key,))
+        index = max(0, min(index, len(self.order)))
+        above = self._bound(index - 1, self.max_priority + 1)
+        below = self._bound(index, 0)
+        if above - below > 1:
+            priority = self._between(above, below, index)
+            self.order.insert(index, key)
+            self.priorities[key] = priority
+            return priority, []
+        return self._respace(key, index)
+
+    def remove(self, key):
+        del self.order[self.index(key)]
+        return self.priorities.pop(key)
+
+    def _bound(self, position, default):
+        if 0 <= position < len(self.order):
+            return self.priorities[self.order[position]]
+        return default
+
+    def _between(self, above, below, index):
+        # At the ends, step by the usual gap rather than halving what is left
+        if index == len(self.order) and above - self.gap > below:
+            return above - self.gap
+        if index == 0 and below + self.gap < above:
+            return below + self.gap
+        return (above + below) // 2
+
+    def _respace(self, key, index):
+        level = 0
+        while True:
+            radius = 1 << level
+            start = max(0, index - radius)
+            stop = min(len(self.order), index + radius)
+            above = self._bound(start - 1, self.max_priority + 1)
+            below = self._bound(stop, 0)
+            count = stop - start + 1
+            spacing = (above - below) // (count + 1)
+            whole = start == 0 and stop == len(self.order)
+            # Bigger windows must end up sparser, or the next insert nearby
+            # would respace them again
+            if spacing >= min(self.gap, 2 << level) or (whole and spacing >= 1):
+                break
+            if whole:
+                raise ValueError("no priorities left for %d rules" % count)
+            level += 1
+
+        keys = self.order[start:index] + [key] + self.order[index:stop]
+        moves = []
+        for position, k in enumerate(keys):
+            priority = above - spacing * (position + 1)
+            old = self.priorities.get(k)
+            if k != key and old != priority:
+                moves.append((k, old, priority))
+            self.priorities[k] = priority
+        self.order[start:stop] = keys
+        return self.priorities[key], _safeOrder(moves)
+
+
+def _safeOrder(moves):
+    """
+    Orders moves (given highest rule first) so that carrying them out one at
+    a time never puts a rule above one it should be below: rules moving down
+    go bottom-up, then rules moving up top-down.
+    """
+    down = [move for move in reversed(moves) if move[2] < move[1]]
+    up = [move for move in moves if move[2] > move[1]]
+    return down + up
+
+
+def _update(update_type, table_entry, priority):
+    update = p4runtime_pb2.Update()
+    update.type = update_type
+    update.entity.table_entry.CopyFrom(table_entry)
+    update.entity.table_entry.priority = priority
+    return update
+
+
+def moveUpdates(table_entries, moves):
+    """
+    The updates that carry out respacing moves without a gap in the policy.
+
+    :param table_entries: key -> TableEntry (its priority is ignored)
+    :param moves: as returned by PriorityAllocator.insert()
+    :returns: list of p4runtime_pb2.Update, to be sent in this order
+    """
+    updates = []
+    for key, old, new in moves:
+        updates.append(_update(p4runtime_pb2.Update.INSERT, table_entries[key], new))
+        updates.append(_update(p4runtime_pb2.Update.DELETE, table_entries[key], old))
+    return updates
+
+
+def insertUpdate(table_entry, priority):
+    return _update(p4runtime_pb2.Update.INSERT, table_entry, priority)
+
+
+def deleteUpdate(table_entry, priority):
+    return _update(p4runtime_pb2.Update.DELETE, table_entry, priority)
@@ -0,0 +1,104 @@
+"""
+Coalescing cache for P4Runtime reads.
+
+Tools that poll the same counters or tables each send their own ReadRequest,
+and the switch agent answers every one of them. ``ReadCache`` sits in front
+of a switch (it is used by the ``p4ctl.pool`` proxy, ``--read-ttl``):
+
+* identical reads (same serialized ReadRequest) of a device within ``ttl``
+  seconds are answered from the responses of the first one,
+* identical reads that arrive while that first read is still running wait
+  for it instead of issuing their own,
+* a write to a device invalidates everything cached for it; reads that were
+  running during the write still complete, but are not cached.
+
+Errors are not cached; the callers waiting on a failed read get its error.
+"""
+import collections
+import threading
+from time import monotonic
+
+# Expired entries are swept when the cache grows past this many reads
+SWEEP_SIZE = 1024
+
+
+class _PendingRead(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.responses = None
+        self.error = None
+
+
+class ReadCache(object):
+    """
+    :param ttl: seconds a read result is served from the cache
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (device_id, request) -> (expiry, generation, responses)
+        self.cached = {}
+        # (device_id, generation, request) -> _PendingRead
+        self.pending = {}
+        self.generations = collections.Counter()
+        self.stats = collections.Counter()
+
+    def read(self, device_id, request, fetch):
+        """
+        The ReadResponses for a ReadRequest.
+
+        :param fetch: issues the read, returning an iterable of ReadResponse;
+                      called at most once per TTL window for equal requests
+        :returns: list of ReadResponse, shared between callers: do not modify
+        """
+        key = request.SerializeToString(deterministic=True)
+        now = monotonic()
+        with self.lock:
+            generation = self.generations[device_id]
+            cached = self.cached.get((device_id, key))
+            if cached is not None and cached[0] > now and cached[1] == generation:
+                self.stats['hits'] += 1
+                return cached[2]
+            pending = self.pending.get((device_id, generation, key))
+            leader = pending is None
+            if leader:
+                pending = self.pending[(device_id, generation, key)] = _PendingRead()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.responses
+
+        try:
+            pending.responses = list(fetch())
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[(device_id, generation, key)]
+                if pending.error is None and self.generations[device_id] == generation:
+                    if len(self.cached) >= SWEEP_SIZE:
+                        self._sweep(now)
+                    self.cached[(device_id, key)] = (now + self.ttl, generation,
+                                                     pending.responses)
+            pending.done.set()
+        return pending.responses
+
+    def invalidate(self, device_id):
+        """Forgets every read of a device, e.g. after a write to it."""
+        with self.lock:
+            self.generations[device_id] += 1
+            self.stats['invalidations'] += 1
+            for key in [key for key in self.cached if key[0] == device_id]:
+                del self.cached[key]
+
+    def _sweep(self, now):
+        for key in [key for key, (expiry, _, _) in self.cached.items() if expiry <= now]:
+            del self.cached[key]
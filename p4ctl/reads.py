@@ -0,0 +1,195 @@
+"""
+Filtered table reads with the direct counters of each entry inline.
+
+``sw.ReadTableEntries()`` reads one table or all of them, and counters are a
+separate read per index. ``readEntries`` instead sends one ReadRequest for
+just the tables asked for, with ``counter_data`` set on those that have a
+direct counter, so each entry comes back with its packet and byte counts:
+
+    for entry in readEntries(sw, p4info_helper, tables=["MyIngress.ipv4_lpm"],
+                             match_filter=MatchFilter.parse("hdr.ipv4.dstAddr=10.0.3.0/24")):
+        print(entry.counter_data.packet_count)
+
+A ``MatchFilter`` keeps the entries whose key field can match an address in
+a prefix (an exact value, or a covering or covered LPM prefix or ternary
+mask), and drops the tables without that field from the request altogether.
+P4Runtime can only filter reads on a complete key, so the prefix itself is
+applied to the entries as they arrive.
+
+``CounterWatch`` repeats such a read and returns only the entries that are
+new or whose counters moved since the previous one.
+
+A switch may answer with the shortest encoding of a value (a bit<9> port
+written as ``b'\x00\x01'`` reads back as ``b'\x01'``); compare entries read
+back with what was written through ``canonicalValue``/``canonicalEntry``.
+"""
+import socket
+
+from p4.v1 import p4runtime_pb2
+
+
+def _parseValue(text):
+    if '.' in text:
+        return int.from_bytes(socket.inet_aton(text), 'big')
+    if ':' in text:
+        return int(text.replace(':', ''), 16)
+    return int(text, 0)
+
+
+def canonicalValue(value):
+    """A match value or action param in the shortest encoding a switch may read back."""
+    return value.lstrip(b'\x00') or b'\x00'
+
+
+def _canonicalBytes(message):
+    for field, value in message.ListFields():
+        if isinstance(value, bytes):
+            setattr(message, field.name, canonicalValue(value))
+
+
+def canonicalEntry(entry, action=True):
+    """
+    The table, match, priority and (unless action is False) action of a
+    TableEntry, with match fields and params sorted by id and every value in
+    its shortest encoding: an entry read back equals the one written.
+    """
+    canonical = p4runtime_pb2.TableEntry(table_id=entry.table_id, priority=entry.priority)
+    for match in sorted(entry.match, key=lambda m: m.field_id):
+        field = canonical.match.add()
+        field.CopyFrom(match)
+        _canonicalBytes(getattr(field, field.WhichOneof('field_match_type')))
+    if action:
+        canonical.action.CopyFrom(entry.action)
+        params = sorted(canonical.action.action.params, key=lambda p: p.param_id)
+        del canonical.action.action.params[:]
+        for param in params:
+            canonical.action.action.params.add(param_id=param.param_id,
+                                               value=canonicalValue(param.value))
+    return canonical
+
+
+class MatchFilter(object):
+    """
+    Entries whose `field_name` can match a value within `prefix_len` leading
+    bits of `value` (all bits if None).
+    """
+
+    def __init__(self, field_name, value, prefix_len=None):
+        self.field_name = field_name
+        self.value = value
+        self.prefix_len = prefix_len
+
+    @classmethod
+    def parse(cls, text):
+        """From ``field=value[/prefix length]``, e.g. ``hdr.ipv4.dstAddr=10.0.3.0/24``."""
+        field_name, sep, value = text.partition('=')
+        if not sep or not value:
+            raise ValueError("expected field=value[/len]: %r" % text)
+        value, _, prefix_len = value.partition('/')
+        return cls(field_name, _parseValue(value), int(prefix_len) if prefix_len else None)
+
+    def field(self, table):
+        """The (id, bitwidth) of the filtered field in a p4info table, or None."""
+        for match_field in table.match_fields:
+            if match_field.name == self.field_name:
+                return match_field.id, match_field.bitwidth
+        return None
+
+    def matches(self, entry, field_id, bitwidth):
+        ones = (1 << bitwidth) - 1
+        prefix_len = bitwidth if self.prefix_len is None else self.prefix_len
+        mask = ones ^ (ones >> prefix_len)
+        for match in entry.match:
+            if match.field_id != field_id:
+                continue
+            kind = match.WhichOneof('field_match_type')
+            if kind == 'range':
+                low = self.value & mask
+                high = low | (ones ^ mask)
+                return (int.from_bytes(match.range.low, 'big') <= high and
+                        int.from_bytes(match.range.high, 'big') >= low)
+            value = int.from_bytes(getattr(match, kind).value, 'big')
+            if kind == 'lpm':
+                entry_mask = ones ^ (ones >> match.lpm.prefix_len)
+            elif kind == 'ternary':
+                entry_mask = int.from_bytes(match.ternary.mask, 'big')
+            else:
+                entry_mask = ones
+            # Some value agrees with both wherever both care
+            return (value ^ self.value) & entry_mask & mask == 0
+        # Field left out of the entry: don't care
+        return True
+
+
+def readRequest(p4info_helper, device_id, table_ids, counters=True):
+    """One ReadRequest for several tables, asking for their direct counters."""
+    direct = set(c.direct_table_id for c in p4info_helper.p4info.direct_counters)
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = device_id
+    for table_id in table_ids:
+        table_entry = request.entities.add().table_entry
+        table_entry.table_id = table_id
+        if counters and table_id in direct:
+            table_entry.counter_data.SetInParent()
+    return request
+
+
+def readEntries(sw, p4info_helper, tables=None, match_filter=None, counters=True):
+    """
+    Reads the entries of some tables in one pass.
+
+    :param tables: table names; all tables if None
+    :param match_filter: a MatchFilter, or None for every entry
+    :param counters: have entries of tables with a direct counter carry its
+                     counts in ``counter_data``
+    :returns: generator of TableEntry
+    """
+    wanted = set(p4info_helper.get_tables_id(name) for name in tables) if tables else None
+    fields = {}
+    for table in p4info_helper.p4info.tables:
+        table_id = table.preamble.id
+        if wanted is not None and table_id not in wanted:
+            continue
+        field = match_filter.field(table) if match_filter else (None, None)
+        if field is not None:
+            fields[table_id] = field
+    if not fields:
+        return
+
+    request = readRequest(p4info_helper, sw.device_id, sorted(fields), counters)
+    for response in sw.client_stub.Read(request):
+        for entity in response.entities:
+            entry = entity.table_entry
+            if match_filter is None or match_filter.matches(entry, *fields[entry.table_id]):
+                yield entry
+
+
+def _entryKey(entry):
+    return (entry.table_id, entry.priority,
+            tuple(sorted(m.SerializeToString(deterministic=True) for m in entry.match)))
+
+
+class CounterWatch(object):
+    """
+    Repeated readEntries() that returns only what changed: entries that are
+    new, or whose direct counters moved, since the previous poll(). The first
+    poll() returns every entry.
+    """
+
+    def __init__(self, sw, p4info_helper, tables=None, match_filter=None):
+        self.sw = sw
+        self.p4info_helper = p4info_helper
+        self.tables = tables
+        self.match_filter = match_filter
+        self.last = {}
+
+    def poll(self):
+        """:returns: list of TableEntry"""
+        changed, seen = [], {}
+        for entry in readEntries(self.sw, self.p4info_helper, self.tables, self.match_filter):
+            key = _entryKey(entry)
+            seen[key] = (entry.counter_data.packet_count, entry.counter_data.byte_count)
+            if self.last.get(key) != seen[key]:
+                changed.append(entry)
+        self.last = seen
+        return changed
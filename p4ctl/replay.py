@@ -0,0 +1,322 @@
+"""
+Replay of recorded controller workloads, for write-path benchmarks.
+
+A workload is what a controller sent to one switch: a binary request log
+(``logRequests``, see p4ctl.msglog) or a text dump written by
+``proto_dump_file`` (``logs/sN-p4runtime-requests.txt``). Text dumps leave
+out requests of 1024 characters or more, such as the pipeline config and
+large batches; those are skipped and counted.
+
+``replay`` sends several workloads at once, one thread and connection per
+target switch, either at their recorded pace (``speed=1``, or a multiple of
+it) or back to back (``speed=0``), and reports the updates per second and
+the latency percentiles each target achieved:
+
+    python3 -m p4ctl.replay --speed 0 \\
+        logs/s1-p4runtime-requests.bin=127.0.0.1:50051,0 \\
+        logs/s2-p4runtime-requests.txt=127.0.0.1:50052,1
+
+Requests are rewritten to the device ID of their target and the election ID
+of the replayer, and serialized before the clock starts; they are sent as
+raw bytes, like p4ctl.bulk does. Failed RPCs (e.g. ALREADY_EXISTS when the
+switch still holds the entries) are counted per status code.
+
+``StandIn`` is a P4Runtime server that answers arbitration and accepts every
+request without keeping anything, so that a replay against it measures the
+controller side alone: ``--stand-in`` serves the targets in-process, and
+``--serve ADDRESS`` only runs stand-ins, for replays from another process.
+"""
+import argparse
+import collections
+import os
+import re
+import sys
+import threading
+from concurrent import futures
+from datetime import datetime, timezone
+from time import perf_counter, sleep
+
+import grpc
+from google.protobuf import text_format
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+from p4ctl.msglog import MAGIC, METHODS, readLog, rotatedPaths
+
+Target = collections.namedtuple('Target', ['path', 'address', 'device_id'])
+
+# One request of a proto_dump_file text dump
+_TEXT_RECORD = re.compile(r'^\[([0-9-]+ [0-9:.]+)\] (\S+)\n---\n(.*?)^---\n', re.M | re.S)
+_MESSAGE_TYPES = dict(METHODS)
+
+# Streaming RPCs, whose responses have to be drained
+_STREAMING = ('/p4.v1.P4Runtime/Read',)
+
+
+def readTextDump(path):
+    """
+    Reads a proto_dump_file text dump.
+
+    :returns: (list of (timestamp, method name, request), requests skipped
+              because the dump left out their body)
+    """
+    with open(path) as f:
+        text = f.read()
+    records, skipped = [], 0
+    for ts, method, body in _TEXT_RECORD.findall(text):
+        message_type = _MESSAGE_TYPES.get(method)
+        if message_type is None or body.startswith('Message too long'):
+            skipped += 1
+            continue
+        ts = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f').replace(tzinfo=timezone.utc)
+        records.append((ts.timestamp(), method, text_format.Parse(body, message_type())))
+    return records, skipped
+
+
+def readWorkload(path, methods=None, rotated=False):
+    """
+    Reads a binary request log or a text dump.
+
+    :param methods: only these RPCs, by short name (e.g. ``['Write']``)
+    :param rotated: with a binary log, also read its rotated files first
+    :returns: (list of (timestamp, method name, request), requests skipped)
+    """
+    with open(path, 'rb') as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+    if binary:
+        records, skipped = [], 0
+        for log_path in rotatedPaths(path) if rotated else [path]:
+            for record in readLog(log_path):
+                if isinstance(record[2], bytes):
+                    skipped += 1
+                else:
+                    records.append(record)
+    else:
+        records, skipped = readTextDump(path)
+    if methods:
+        records = [r for r in records if r[1].rsplit('/', 1)[-1] in methods]
+    return records, skipped
+
+
+def prepare(records, device_id, election_id=1):
+    """
+    Rewrites requests for another device and controller and serializes them.
+
+    :returns: list of (timestamp, method name, updates, request bytes)
+    """
+    prepared = []
+    for ts, method, request in records:
+        request.device_id = device_id
+        if 'election_id' in request.DESCRIPTOR.fields_by_name:
+            request.election_id.high = election_id >> 64
+            request.election_id.low = election_id & ((1 << 64) - 1)
+        updates = len(request.updates) if isinstance(request, p4runtime_pb2.WriteRequest) else 0
+        prepared.append((ts, method, updates, request.SerializeToString()))
+    return prepared
+
+
+class ReplayStats(object):
+    """What one target achieved."""
+
+    def __init__(self, name, skipped=0):
+        self.name = name
+        self.skipped = skipped
+        self.latencies = []
+        self.updates = 0
+        self.errors = collections.Counter()
+        self.seconds = 0.0
+
+    def percentile(self, q):
+        """The q-quantile of the RPC latencies, in seconds."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def describe(self):
+        text = "%s: %d requests, %d updates in %.3f s, %.0f updates/s, " \
+               "p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, max %.3f ms" % (
+                   self.name, len(self.latencies), self.updates, self.seconds,
+                   self.updates / self.seconds if self.seconds else 0.0,
+                   1000 * self.percentile(0.5), 1000 * self.percentile(0.9),
+                   1000 * self.percentile(0.99), 1000 * max(self.latencies or [0.0]))
+        if self.errors:
+            text += ", errors: " + ", ".join(
+                "%s %d" % item for item in sorted(self.errors.items()))
+        if self.skipped:
+            text += ", %d not replayable" % self.skipped
+        return text
+
+
+def _replayOne(sw, prepared, stats, start, speed):
+    calls = {}
+    for method in set(method for _, method, _, _ in prepared):
+        make = sw.channel.unary_stream if method in _STREAMING else sw.channel.unary_unary
+        calls[method] = make(method, request_serializer=None, response_deserializer=None)
+    first_ts = prepared[0][0] if prepared else 0.0
+    for ts, method, updates, request in prepared:
+        if speed:
+            delay = start + (ts - first_ts) / speed - perf_counter()
+            if delay > 0:
+                sleep(delay)
+        sent = perf_counter()
+        try:
+            response = calls[method](request)
+            if method in _STREAMING:
+                for _ in response:
+                    pass
+            stats.updates += updates
+        except grpc.RpcError as e:
+            stats.errors[e.code().name] += 1
+        stats.latencies.append(perf_counter() - sent)
+    stats.seconds = perf_counter() - start
+
+
+def replay(targets, speed=0, methods=None, election_id=1, rotated=False):
+    """
+    Replays workloads against their targets concurrently.
+
+    :param targets: list of Target
+    :param speed: 1 replays at the recorded pace, 2 twice as fast, ...;
+                  0 sends every request as soon as the previous one returned
+    :param methods: only these RPCs, by short name
+    :returns: (list of ReplayStats, wall-clock seconds of the whole replay)
+    """
+    # Not at the top: the stand-in runs without the tutorials' utils/
+    from p4ctl.switch import ControllerConnection
+
+    jobs = []
+    for target in targets:
+        records, skipped = readWorkload(target.path, methods, rotated)
+        sw = ControllerConnection(name=os.path.basename(target.path), address=target.address,
+                                  device_id=target.device_id, election_id=election_id)
+        sw.MasterArbitrationUpdate()
+        jobs.append((sw, prepare(records, target.device_id, election_id),
+                     ReplayStats(sw.name, skipped)))
+
+    start = perf_counter()
+    threads = [threading.Thread(target=_replayOne, args=(sw, prepared, stats, start, speed),
+                                name='replay-%s' % sw.name)
+               for sw, prepared, stats in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    for sw, _, _ in jobs:
+        sw.shutdown()
+    return [stats for _, _, stats in jobs], elapsed
+
+
+class StandIn(p4runtime_pb2_grpc.P4RuntimeServicer):
+    """A P4Runtime server that accepts everything and keeps nothing."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.updates = 0
+
+    def _count(self, updates=0):
+        with self.lock:
+            self.requests += 1
+            self.updates += updates
+
+    def Write(self, request, context):
+        self._count(len(request.updates))
+        return p4runtime_pb2.WriteResponse()
+
+    def Read(self, request, context):
+        self._count()
+        yield p4runtime_pb2.ReadResponse()
+
+    def SetForwardingPipelineConfig(self, request, context):
+        self._count()
+        return p4runtime_pb2.SetForwardingPipelineConfigResponse()
+
+    def GetForwardingPipelineConfig(self, request, context):
+        self._count()
+        return p4runtime_pb2.GetForwardingPipelineConfigResponse()
+
+    def Capabilities(self, request, context):
+        return p4runtime_pb2.CapabilitiesResponse(p4runtime_api_version='1.3.0')
+
+    def StreamChannel(self, request_iterator, context):
+        # Every controller is master; packet-outs are dropped
+        for request in request_iterator:
+            if request.WhichOneof('update') == 'arbitration':
+                response = p4runtime_pb2.StreamMessageResponse()
+                response.arbitration.CopyFrom(request.arbitration)
+                yield response
+
+
+def serveStandIn(addresses, max_workers=16):
+    """
+    Serves one StandIn on all the addresses.
+
+    :returns: (grpc.Server, StandIn)
+    """
+    stand_in = StandIn()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(stand_in, server)
+    for address in addresses:
+        server.add_insecure_port(address)
+    server.start()
+    return server, stand_in
+
+
+def parseTarget(text):
+    """workload=address[,device_id] -> Target"""
+    path, _, rest = text.rpartition('=')
+    address, _, device_id = rest.partition(',')
+    if not path or not address:
+        raise argparse.ArgumentTypeError("expected workload=address[,device_id]: %r" % text)
+    return Target(path, address, int(device_id or 0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded P4Runtime workloads')
+    parser.add_argument('targets', nargs='*', type=parseTarget,
+                        help='workload=address[,device_id]: a binary request log or '
+                             'text dump, and the switch to replay it against')
+    parser.add_argument('--speed', help='multiple of the recorded pace; 0 replays '
+                        'flat-out (default)', type=float, default=0)
+    parser.add_argument('--method', help='only this RPC, e.g. Write; repeatable',
+                        action='append', dest='methods')
+    parser.add_argument('--election-id', help='election ID to replay with',
+                        type=int, default=1)
+    parser.add_argument('--rotated', action='store_true',
+                        help='also replay the rotated files of each binary log, oldest first')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='serve the target addresses with an in-process stand-in')
+    parser.add_argument('--serve', help='only run a stand-in on this address; repeatable',
+                        action='append', default=[])
+    args = parser.parse_args()
+
+    if args.serve:
+        server, stand_in = serveStandIn(args.serve)
+        print("Standing in on %s" % ", ".join(args.serve))
+        try:
+            server.wait_for_termination()
+        except KeyboardInterrupt:
+            print(" Shutting down.")
+        server.stop(0)
+        print("Received %d requests, %d updates" % (stand_in.requests, stand_in.updates))
+        sys.exit(0)
+    if not args.targets:
+        parser.error("nothing to replay")
+
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../utils/'))
+    server = None
+    if args.stand_in:
+        server, _ = serveStandIn(sorted(set(t.address for t in args.targets)))
+    try:
+        results, elapsed = replay(args.targets, args.speed, args.methods,
+                                  args.election_id, args.rotated)
+    finally:
+        if server is not None:
+            server.stop(0)
+    for stats in results:
+        print(stats.describe())
+    updates = sum(stats.updates for stats in results)
+    print("total: %d updates in %.3f s, %.0f updates/s" % (
+        updates, elapsed, updates / elapsed if elapsed else 0.0))
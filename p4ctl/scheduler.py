@@ -0,0 +1,256 @@
+"""
+Per-switch update scheduling with priority classes.
+
+Controllers write in program order, so a reroute issued during a large
+install waits for every insert queued before it. An ``UpdateScheduler`` owns
+the writes to one switch instead: updates are submitted with a class,
+``FAILOVER``, ``POLICY`` or ``BULK``, and a background thread always sends
+the most urgent class first, in Writes of at most ``max_in_flight`` updates
+from a single class. Only one Write is outstanding at a time, so a failover
+update waits for at most one such Write of background work, however much of
+it is queued:
+
+    scheduler = UpdateScheduler(s1)
+    scheduler.start()
+    scheduler.submitEntries(routes, priority=BULK)
+    ...
+    done = scheduler.submitEntries([steering], update_type=MODIFY, priority=FAILOVER)
+    waitAll(done)
+
+Pending updates of the same entry (table, match and priority) are coalesced:
+a MODIFY after an INSERT becomes that INSERT with the new action, an INSERT
+and its DELETE cancel out, a DELETE then INSERT becomes a MODIFY, and so on;
+the result takes the more urgent class. Updates to one entry are never
+reordered; updates to different entries of different classes are, so
+writes that depend on each other (e.g. routes and the steering onto them)
+belong in the same class, or the later one is submitted after waitAll().
+
+``submit`` returns a ``concurrent.futures.Future`` that completes when the
+update, or what it was coalesced into, has been written; it fails with the
+grpc.RpcError of its Write if the switch refused it (all updates of a failed
+Write count as refused unless the switch reports them one by one). ``waitAll`` waits for several and returns the
+first error.
+"""
+import collections
+import threading
+from concurrent.futures import Future, wait
+
+import grpc
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2
+
+from p4ctl.switch import updateCodes
+
+FAILOVER, POLICY, BULK = range(3)
+CLASS_NAMES = ('failover', 'policy', 'bulk')
+
+# Updates per Write, and so the background work a failover update can queue behind
+DEFAULT_IN_FLIGHT = 100
+
+_INSERT = p4runtime_pb2.Update.INSERT
+_MODIFY = p4runtime_pb2.Update.MODIFY
+_DELETE = p4runtime_pb2.Update.DELETE
+
+# (pending type, new type) -> type of the coalesced update, None if they
+# cancel out; pairs not listed are queued one after the other
+_COALESCED = {
+    (_INSERT, _MODIFY): _INSERT,
+    (_INSERT, _DELETE): None,
+    (_MODIFY, _MODIFY): _MODIFY,
+    (_MODIFY, _DELETE): _DELETE,
+    (_DELETE, _INSERT): _MODIFY,
+}
+
+
+def updateKey(update):
+    """What identifies the entity an update writes, or None for other entities."""
+    if update.entity.WhichOneof('entity') != 'table_entry':
+        return None
+    entry = update.entity.table_entry
+    return (entry.table_id, entry.priority, entry.is_default_action,
+            tuple(sorted(m.SerializeToString(deterministic=True) for m in entry.match)))
+
+
+class _Pending(object):
+
+    def __init__(self, update, priority, futures):
+        self.update = update
+        self.priority = priority
+        self.futures = futures
+        self.live = True
+
+
+class UpdateScheduler(object):
+    """
+    Writes the updates submitted for one switch, most urgent class first.
+
+    :param sw: a ControllerConnection
+    :param max_in_flight: updates per Write
+    """
+
+    def __init__(self, sw, max_in_flight=DEFAULT_IN_FLIGHT):
+        self.sw = sw
+        self.max_in_flight = max_in_flight
+        self.cond = threading.Condition()
+        self.queues = [collections.deque() for _ in CLASS_NAMES]
+        self.by_key = {}
+        self.busy = False
+        self.stopped = False
+        self.stats = {'submitted': 0, 'coalesced': 0, 'written': 0, 'writes': 0, 'failed': 0}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='scheduler-%s' % self.sw.name,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Writes out what is queued, then stops the thread."""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def pending(self, priority=None):
+        """Updates queued, in one class or all of them."""
+        with self.cond:
+            queues = self.queues if priority is None else [self.queues[priority]]
+            return sum(1 for queue in queues for pending in queue if pending.live)
+
+    def submit(self, update, priority=BULK):
+        """
+        Queues a p4runtime_pb2.Update.
+
+        :returns: a Future for its write
+        """
+        future = Future()
+        futures = [future]
+        key = updateKey(update)
+        with self.cond:
+            self.stats['submitted'] += 1
+            queued = self.by_key.get(key, []) if key is not None else []
+            if queued and (queued[-1].update.type, update.type) in _COALESCED:
+                last = queued[-1]
+                merged = _COALESCED[(last.update.type, update.type)]
+                self.stats['coalesced'] += 1
+                self._remove(key, last)
+                futures = last.futures + futures
+                if merged is None:
+                    for done in futures:
+                        done.set_result(None)
+                    return future
+                coalesced = p4runtime_pb2.Update()
+                coalesced.CopyFrom(update)
+                coalesced.type = merged
+                update, priority = coalesced, min(priority, last.priority)
+                queued = self.by_key.get(key, [])
+            if any(pending.priority > priority for pending in queued):
+                # Earlier updates of the entry go first, so they move up with it
+                moved = list(queued)
+                for pending in moved:
+                    self._remove(key, pending)
+                for pending in moved:
+                    self._enqueue(key, pending.update, priority, pending.futures)
+            self._enqueue(key, update, priority, futures)
+        return future
+
+    def submitEntries(self, table_entries, update_type=None, priority=BULK):
+        """
+        Queues table entries, like ControllerConnection.WriteTableEntries.
+
+        :returns: list of Future
+        """
+        futures = []
+        for table_entry in table_entries:
+            update = p4runtime_pb2.Update()
+            if update_type is not None:
+                update.type = update_type
+            elif table_entry.is_default_action:
+                update.type = _MODIFY
+            else:
+                update.type = _INSERT
+            update.entity.table_entry.CopyFrom(table_entry)
+            futures.append(self.submit(update, priority))
+        return futures
+
+    def flush(self):
+        """Waits until everything submitted so far has been written."""
+        with self.cond:
+            self.cond.wait_for(lambda: not self.busy and not any(
+                pending.live for queue in self.queues for pending in queue))
+
+    def _enqueue(self, key, update, priority, futures):
+        pending = _Pending(update, priority, futures)
+        self.queues[priority].append(pending)
+        if key is not None:
+            self.by_key.setdefault(key, []).append(pending)
+        self.cond.notify_all()
+
+    def _remove(self, key, pending):
+        # Left in its queue and skipped there; only the key index drops it
+        pending.live = False
+        queued = self.by_key[key]
+        queued.remove(pending)
+        if not queued:
+            del self.by_key[key]
+
+    def _take(self):
+        """The next Write's worth of one class; called with the lock held."""
+        for queue in self.queues:
+            batch = []
+            while queue and len(batch) < self.max_in_flight:
+                pending = queue.popleft()
+                if pending.live:
+                    key = updateKey(pending.update)
+                    if key is not None:
+                        self._remove(key, pending)
+                    batch.append(pending)
+            if batch:
+                return batch
+        return []
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+                batch = self._take()
+                while not batch and not self.stopped:
+                    self.cond.wait()
+                    batch = self._take()
+                if not batch:
+                    return
+                self.busy = True
+            try:
+                self.sw.WriteUpdates([pending.update for pending in batch],
+                                     batch_size=len(batch))
+            except grpc.RpcError as e:
+                codes = updateCodes(e, len(batch))
+                refused = ([code != code_pb2.OK for code in codes] if codes is not None
+                           else [True] * len(batch))
+                self.stats['failed'] += sum(refused)
+                self.stats['written'] += len(batch) - sum(refused)
+                for pending, failed in zip(batch, refused):
+                    for future in pending.futures:
+                        if failed:
+                            future.set_exception(e)
+                        else:
+                            future.set_result(None)
+            else:
+                self.stats['written'] += len(batch)
+                for pending in batch:
+                    for future in pending.futures:
+                        future.set_result(None)
+            self.stats['writes'] += 1
+
+
+def waitAll(futures):
+    """
+    Waits for the futures of submitted updates.
+
+    :returns: the first grpc.RpcError among them, or None
+    """
+    wait(futures)
+    for future in futures:
+        if future.exception() is not None:
+            return future.exception()
+    return None
@@ -0,0 +1,148 @@
+"""
+Sharded, multi-process installation of precomputed entries.
+
+A controller computes its entries once, as ``buildTableEntry`` keyword dicts
+per switch (picklable, unlike protobuf-backed UpdateBatches), and hands them to
+``installSharded``. The supervisor splits the switches into one shard per
+worker process, balancing by entry count; each worker opens its own
+connections, becomes master of its switches with its own election ID,
+optionally pushes the pipeline, installs its entries in batched writes and
+reports back. The supervisor itself never opens a gRPC channel.
+
+With ``metrics`` set, every worker instruments its connections (see
+``p4ctl.metrics``) and the supervisor merges what they recorded.
+
+Workers are started with the ``spawn`` method so that no gRPC state is
+inherited across ``fork``; the calling script must therefore guard its entry
+point with ``if __name__ == '__main__'``, as all controllers here do.
+"""
+import collections
+import multiprocessing
+import os
+from time import perf_counter
+
+import grpc
+
+SwitchSpec = collections.namedtuple('SwitchSpec', ['name', 'address', 'device_id'])
+
+ShardResult = collections.namedtuple(
+    'ShardResult', ['switch', 'pid', 'election_id', 'entries', 'rpcs', 'seconds', 'error'])
+
+
+def assignShards(switches, entries_by_switch, workers):
+    """
+    Splits switches into at most `workers` shards of similar entry counts.
+
+    Largest switch first onto the least loaded shard; shards keep at least one
+    switch each.
+    """
+    shards = [[] for _ in range(min(workers, len(switches)))]
+    loads = [0] * len(shards)
+    ordered = sorted(switches, key=lambda s: -len(entries_by_switch.get(s.name, ())))
+    for spec in ordered:
+        target = loads.index(min(loads))
+        shards[target].append(spec)
+        loads[target] += len(entries_by_switch.get(spec.name, ()))
+    return [shard for shard in shards if shard]
+
+
+def _installShard(job):
+    """Worker body: owns the switches of one shard until they are installed."""
+    # Imported here so the supervisor never loads the P4Runtime stack
+    from p4runtime_lib.switch import ShutdownAllSwitchConnections
+    from p4ctl.metrics import Metrics, instrument
+    from p4ctl.msglog import logRequests
+    from p4ctl.p4info_cache import CachedP4InfoHelper
+    from p4ctl.switch import ControllerConnection
+
+    results = []
+    loggers = []
+    metrics = Metrics() if job['metrics'] else None
+    p4info_helper = CachedP4InfoHelper(job['p4info'])
+    try:
+        for spec in job['switches']:
+            start = perf_counter()
+            entries = job['entries'].get(spec.name, [])
+            rpcs = 0
+            error = None
+            try:
+                sw = ControllerConnection(
+                    name=spec.name,
+                    address=spec.address,
+                    device_id=spec.device_id,
+                    election_id=job['election_id'])
+                if job['request_log']:
+                    loggers.append(logRequests(sw, job['request_log'] % spec.name))
+                if metrics is not None:
+                    instrument(sw, metrics, p4info_helper)
+                sw.MasterArbitrationUpdate()
+                if not sw.is_master:
+                    raise RuntimeError("not master for %s with election ID %d" % (
+                        spec.name, job['election_id']))
+                if job['bmv2_json']:
+                    sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                                   bmv2_json_file_path=job['bmv2_json'])
+                table_entries = [p4info_helper.buildTableEntry(**e) for e in entries]
+                rpcs = sw.WriteTableEntries(table_entries, batch_size=job['batch_size'])
+            except grpc.RpcError as e:
+                error = "gRPC Error: %s (%s)" % (e.details(), e.code().name)
+            except (RuntimeError, AttributeError) as e:
+                error = str(e)
+            results.append(ShardResult(spec.name, os.getpid(), job['election_id'],
+                                       0 if error else len(entries), rpcs,
+                                       perf_counter() - start, error))
+    finally:
+        ShutdownAllSwitchConnections()
+        # The pool terminates its workers, so atexit never flushes the logs
+        for logger in loggers:
+            logger.close()
+    return results, metrics.toDict() if metrics is not None else None
+
+
+def installSharded(switches, entries_by_switch, p4info_file_path, bmv2_file_path=None,
+                   workers=4, election_id=1, batch_size=500,
+                   request_log='logs/%s-p4runtime-requests.bin', metrics=None):
+    """
+    Installs precomputed entries with a pool of worker processes.
+
+    :param switches: SwitchSpec list
+    :param entries_by_switch: switch name -> list of buildTableEntry kwargs
+    :param p4info_file_path: the p4info file, loaded by every worker
+    :param bmv2_file_path: if given, workers push the pipeline first
+    :param workers: the number of worker processes
+    :param election_id: election ID of the first shard; shard i uses
+                        election_id + i so every worker is a distinct client
+    :param batch_size: updates per WriteRequest
+    :param request_log: per-switch binary request log path pattern, or None
+    :param metrics: a p4ctl.metrics.Metrics to merge the workers' RPC
+                    statistics into, or None
+    :returns: list of ShardResult, one per switch
+    """
+    shards = assignShards(switches, entries_by_switch, workers)
+    jobs = [{
+        'switches': shard,
+        'entries': {s.name: entries_by_switch.get(s.name, []) for s in shard},
+        'p4info': p4info_file_path,
+        'bmv2_json': bmv2_file_path,
+        'election_id': election_id + i,
+        'batch_size': batch_size,
+        'request_log': request_log,
+        'metrics': metrics is not None,
+    } for i, shard in enumerate(shards)]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(len(jobs)) as pool:
+        for shard_results, shard_metrics in pool.imap_unordered(_installShard, jobs):
+            if shard_metrics is not None:
+                metrics.merge(shard_metrics)
+            for result in shard_results:
+                if result.error:
+                    print("Failed on %s (worker %d): %s" % (result.switch, result.pid,
+                                                           result.error))
+                else:
+                    print("Installed %d entries on %s in %d writes, %.3f s (worker %d)" % (
+                        result.entries, result.switch, result.rpcs, result.seconds,
+                        result.pid))
+                results.append(result)
+    return results
@@ -0,0 +1,148 @@
+"""
+Harvesting a count-min sketch kept by the data plane in counter arrays.
+
+Each row of the sketch is an indexed counter (``packets_and_bytes``) that the
+program counts every packet into at ``hash(flow key) % width``, each row with a
+different v1model ``hash()`` (see lab5/acl/acl.p4). CRCs are linear, so rows
+that only differ by a constant salted into the key collide on exactly the
+same flows; use another algorithm or another field order per row instead,
+and give ``index()`` the same hashes computed here.
+
+The switch only ever adds. The controller reads all rows in one request each
+epoch and keeps the previous reading, so the counts of an epoch are the
+difference of two readings and nothing is lost between a read and a reset.
+
+The estimate of a flow is the minimum over the rows of its cells. Given the
+candidate flows as NumPy columns, ``SketchHarvester.estimate`` computes them
+all at once, and ``topK`` picks the heaviest.
+
+    harvester = SketchHarvester(sw, p4info_helper, "MyIngress.cms_row")
+    key = packColumns([(dst, 4), (dport, 2)])
+    index = harvester.index([crc32(key), crc16(key)])   # once per candidate set
+    harvester.harvest()                                   # start of the epoch
+    sleep(epoch)
+    packets, octets = harvester.harvest()
+    top = topK(harvester.estimate(octets, index), 10)
+"""
+import numpy as np
+
+from p4.v1 import p4runtime_pb2
+
+
+def _crcTable(polynomial):
+    # Reflected, byte at a time
+    table = np.arange(256, dtype=np.uint32)
+    for _ in range(8):
+        table = np.where(table & 1, (table >> 1) ^ np.uint32(polynomial), table >> 1)
+    return table.astype(np.uint32)
+
+
+_CRC32_TABLE = _crcTable(0xEDB88320)
+_CRC16_TABLE = _crcTable(0xA001)
+
+
+def packColumns(columns):
+    """
+    Concatenates integer columns into one byte row per element, big endian.
+
+    :param columns: list of (array, width in bytes), all of the same length
+    :returns: uint8 array of shape (n, total width)
+    """
+    parts = []
+    for values, width in columns:
+        values = np.asarray(values, dtype=np.uint64)
+        shifts = np.arange(8 * (width - 1), -1, -8, dtype=np.uint64)
+        parts.append(((values[:, None] >> shifts) & np.uint64(0xff)).astype(np.uint8))
+    return np.concatenate(parts, axis=1)
+
+
+def crc32(data):
+    """CRC-32 (as zlib and BMv2 compute it) of every row of a uint8 array."""
+    crc = np.full(len(data), 0xFFFFFFFF, dtype=np.uint32)
+    for column in range(data.shape[1]):
+        crc = _CRC32_TABLE[(crc ^ data[:, column]) & np.uint32(0xff)] ^ (crc >> np.uint32(8))
+    return crc ^ np.uint32(0xFFFFFFFF)
+
+
+def crc16(data):
+    """CRC-16 (ARC, as BMv2's crc16) of every row of a uint8 array."""
+    crc = np.zeros(len(data), dtype=np.uint32)
+    for column in range(data.shape[1]):
+        crc = _CRC16_TABLE[(crc ^ data[:, column]) & np.uint32(0xff)] ^ (crc >> np.uint32(8))
+    return crc
+
+
+def topK(estimates, k):
+    """Indices of the k largest estimates, largest first."""
+    k = min(k, len(estimates))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(estimates, len(estimates) - k)[len(estimates) - k:]
+    return top[np.argsort(estimates[top])[::-1]]
+
+
+class SketchHarvester(object):
+    """
+    Reads the rows of a count-min sketch from one switch.
+
+    :param sw: the switch connection
+    :param counter_prefix: the rows are the counters whose names start with
+                           this, in name order
+    """
+
+    def __init__(self, sw, p4info_helper, counter_prefix):
+        self.sw = sw
+        counters = sorted((c for c in p4info_helper.p4info.counters
+                           if c.preamble.name.startswith(counter_prefix)),
+                          key=lambda c: c.preamble.name)
+        if not counters:
+            raise ValueError("no counters named %s*" % counter_prefix)
+        self.counter_ids = [c.preamble.id for c in counters]
+        self.width = counters[0].size
+        self.previous = None
+
+    @property
+    def rows(self):
+        return len(self.counter_ids)
+
+    def index(self, hashes):
+        """
+        The cell of every candidate flow in every row.
+
+        :param hashes: per row, the hash of every candidate as the program
+                       computes it for that row
+        :returns: int array of shape (rows, n)
+        """
+        if len(hashes) != self.rows:
+            raise ValueError("%d hashes for %d rows" % (len(hashes), self.rows))
+        return np.stack([np.asarray(h) % self.width for h in hashes]).astype(np.intp)
+
+    def read(self):
+        """All rows in one ReadRequest: (packets, bytes) arrays of shape (rows, width)."""
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.sw.device_id
+        for counter_id in self.counter_ids:
+            request.entities.add().counter_entry.counter_id = counter_id
+        row = {counter_id: i for i, counter_id in enumerate(self.counter_ids)}
+        packets = np.zeros((self.rows, self.width), dtype=np.int64)
+        octets = np.zeros((self.rows, self.width), dtype=np.int64)
+        for response in self.sw.client_stub.Read(request):
+            for entity in response.entities:
+                entry = entity.counter_entry
+                packets[row[entry.counter_id], entry.index.index] = entry.data.packet_count
+                octets[row[entry.counter_id], entry.index.index] = entry.data.byte_count
+        return packets, octets
+
+    def harvest(self):
+        """
+        The counts since the previous harvest: (packets, bytes) arrays of
+        shape (rows, width); everything counted so far on the first call.
+        """
+        current = self.read()
+        previous = self.previous or (0, 0)
+        self.previous = current
+        return current[0] - previous[0], current[1] - previous[1]
+
+    def estimate(self, counts, index):
+        """Count-min estimate of every candidate: the minimum of its cells."""
+        return counts[np.arange(self.rows)[:, None], index].min(axis=0)
@@ -0,0 +1,69 @@
+"""
+Shared reader for a switch's stream channel.
+
+A connection has a single ``stream_msg_resp`` iterator, so packet-ins,
+idle-timeout notifications and digests must be read by one thread and handed
+to whoever wants them. ``streamDispatcher(sw)`` returns that reader, created
+on first use; components subscribe to the StreamMessageResponse fields they
+handle:
+
+    streamDispatcher(s1).subscribe('packet', lambda packet: ...)
+    streamDispatcher(s1).subscribe('idle_timeout_notification', lambda n: ...)
+    streamDispatcher(s1).start()
+
+Start it only after MasterArbitrationUpdate, which reads its response from
+the same iterator. ``closed`` is set once the stream ends; after
+``sw.reconnect()`` call ``restart()`` to read the new stream with the same
+subscribers.
+"""
+import threading
+
+import grpc
+
+
+class StreamDispatcher(object):
+
+    def __init__(self, sw):
+        self.sw = sw
+        self.handlers = {}
+        self.thread = None
+        self.closed = threading.Event()
+
+    def subscribe(self, kind, handler):
+        """
+        :param kind: the StreamMessageResponse field, e.g. 'packet'
+        :param handler: called with that field's message, on the reader thread
+        """
+        self.handlers.setdefault(kind, []).append(handler)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='stream-%s' % self.sw.name,
+                                           daemon=True)
+            self.thread.start()
+
+    def restart(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.closed.clear()
+        self.start()
+
+    def _run(self):
+        try:
+            for response in self.sw.stream_msg_resp:
+                kind = response.WhichOneof('update')
+                for handler in self.handlers.get(kind, ()):
+                    handler(getattr(response, kind))
+        except grpc.RpcError:
+            # Cancelled by ShutdownAllSwitchConnections, or the switch went away
+            pass
+        finally:
+            self.closed.set()
+
+
+def streamDispatcher(sw):
+    dispatcher = getattr(sw, 'stream_dispatcher', None)
+    if dispatcher is None:
+        dispatcher = sw.stream_dispatcher = StreamDispatcher(sw)
+    return dispatcher
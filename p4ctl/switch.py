@@ -0,0 +1,237 @@
+"""
+Switch connection with a configurable election ID and batched writes.
+
+``p4runtime_lib.switch.SwitchConnection`` always arbitrates with election ID 1
+and sends one update per Write RPC. ``ControllerConnection`` keeps its API and
+adds what the multi-controller and bulk tools need:
+
+* an ``election_id`` used for arbitration, pipeline config and every write,
+* ``WriteTableEntries``/``DeleteTableEntries``/``WriteUpdates``, which pack up
+  to ``batch_size`` updates into each WriteRequest, and
+  ``UpsertTableEntries`` for entries the switch may already hold or miss,
+* ``reconnect()``, which replaces a dead channel and stream (keeping the
+  interceptors, and mastership if it had it), and gRPC ``channel_options``
+  such as KEEPALIVE_OPTIONS for connections that are kept open for long.
+
+A Write of several updates that fails may still have applied some of them;
+``updateCodes`` tells which ones the switch refused, and why.
+"""
+import grpc
+from google.rpc import code_pb2, status_pb2
+from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
+
+from p4runtime_lib.bmv2 import Bmv2SwitchConnection
+from p4runtime_lib.switch import IterableQueue
+
+DEFAULT_BATCH_SIZE = 500
+
+# (update type, refusal) -> the update type that makes it go in anyway,
+# None if the switch is already where the update would take it
+_UPSERT = {
+    (p4runtime_pb2.Update.INSERT, code_pb2.ALREADY_EXISTS): p4runtime_pb2.Update.MODIFY,
+    (p4runtime_pb2.Update.MODIFY, code_pb2.NOT_FOUND): p4runtime_pb2.Update.INSERT,
+    (p4runtime_pb2.Update.DELETE, code_pb2.NOT_FOUND): None,
+}
+
+# HTTP/2 pings on idle connections, so a dead switch is noticed without traffic
+KEEPALIVE_OPTIONS = [
+    ('grpc.keepalive_time_ms', 10000),
+    ('grpc.keepalive_timeout_ms', 5000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+]
+
+
+def setElectionId(election_id_pb, election_id):
+    election_id_pb.high = election_id >> 64
+    election_id_pb.low = election_id & ((1 << 64) - 1)
+
+
+def updateCodes(error, count):
+    """
+    The status of every update of a failed Write of count updates.
+
+    A switch answers a Write it applied only in part with a p4.v1.Error per
+    update in the binary status details, OK for the ones it applied.
+
+    :param error: the grpc.RpcError of the Write
+    :returns: list of count google.rpc.code_pb2 codes, or None if the error
+              says nothing per update
+    """
+    metadata = getattr(error, 'trailing_metadata', lambda: None)() or ()
+    for key, value in metadata:
+        if key != 'grpc-status-details-bin':
+            continue
+        codes = []
+        for detail in status_pb2.Status.FromString(value).details:
+            update_error = p4runtime_pb2.Error()
+            if not detail.Unpack(update_error):
+                return None
+            codes.append(update_error.canonical_code)
+        return codes if len(codes) == count else None
+    return None
+
+
+def attachInterceptor(sw, interceptor):
+    """
+    Puts a client interceptor in front of an existing switch connection.
+
+    The stream channel opened in the constructor keeps using the old stub,
+    which is fine: interceptors only see unary and server-streaming calls.
+    """
+    sw.channel = grpc.intercept_channel(sw.channel, interceptor)
+    sw.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(sw.channel)
+    if isinstance(getattr(sw, 'interceptors', None), list):
+        sw.interceptors.append(interceptor)
+
+
+class ControllerConnection(Bmv2SwitchConnection):
+
+    def __init__(self, name=None, address='127.0.0.1:50051', device_id=0,
+                 proto_dump_file=None, election_id=1, channel_options=None):
+        super(ControllerConnection, self).__init__(name=name, address=address,
+                                                   device_id=device_id,
+                                                   proto_dump_file=proto_dump_file)
+        self.election_id = election_id
+        self.is_master = False
+        self.channel_options = channel_options
+        self.interceptors = []
+        if channel_options:
+            # SwitchConnection always opens a plain channel
+            self.reconnect()
+
+    def reconnect(self):
+        """
+        Opens a new channel and stream channel in place of the current ones.
+
+        Interceptors attached with attachInterceptor are put back in front of
+        the new channel, and a master re-arbitrates. The proto_dump_file
+        logger is not.
+
+        :returns: True unless mastership was lost on the way
+        """
+        self.requests_stream.close()
+        self.stream_msg_resp.cancel()
+        self.channel.close()
+
+        self.channel = grpc.insecure_channel(self.address, options=self.channel_options)
+        for interceptor in self.interceptors:
+            self.channel = grpc.intercept_channel(self.channel, interceptor)
+        self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
+        self.requests_stream = IterableQueue()
+        self.stream_msg_resp = self.client_stub.StreamChannel(iter(self.requests_stream))
+        if self.is_master:
+            self.MasterArbitrationUpdate()
+            return self.is_master
+        return True
+
+    def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
+        request = p4runtime_pb2.StreamMessageRequest()
+        request.arbitration.device_id = self.device_id
+        setElectionId(request.arbitration.election_id, self.election_id)
+
+        if dry_run:
+            print("P4Runtime MasterArbitrationUpdate: ", request)
+        else:
+            self.requests_stream.put(request)
+            for item in self.stream_msg_resp:
+                # OK for the master, ALREADY_EXISTS for a backup controller
+                self.is_master = (item.HasField('arbitration')
+                                  and item.arbitration.status.code == 0)
+                return item
+
+    def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
+        device_config = self.buildDeviceConfig(**kwargs)
+        request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
+        setElectionId(request.election_id, self.election_id)
+        request.device_id = self.device_id
+        config = request.config
+
+        config.p4info.CopyFrom(p4info)
+        config.p4_device_config = device_config.SerializeToString()
+
+        request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
+        if dry_run:
+            print("P4Runtime SetForwardingPipelineConfig:", request)
+        else:
+            self.client_stub.SetForwardingPipelineConfig(request)
+
+    def WriteTableEntry(self, table_entry, dry_run=False):
+        self.WriteTableEntries([table_entry], dry_run=dry_run)
+
+    def WriteUpdates(self, updates, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        """
+        Sends p4runtime_pb2.Update messages, batch_size per WriteRequest.
+
+        :returns: the number of Write RPCs issued
+        """
+        rpcs = 0
+        for start in range(0, len(updates), batch_size):
+            request = p4runtime_pb2.WriteRequest()
+            request.device_id = self.device_id
+            setElectionId(request.election_id, self.election_id)
+            request.updates.extend(updates[start:start + batch_size])
+            if dry_run:
+                print("P4Runtime Write:", request)
+            else:
+                self.client_stub.Write(request)
+                rpcs += 1
+        return rpcs
+
+    def WriteTableEntries(self, table_entries, update_type=None,
+                          batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        """
+        Writes table entries in batches.
+
+        :param update_type: the Update type for all entries; by default,
+                            like WriteTableEntry, INSERT for regular entries
+                            and MODIFY for default actions
+        """
+        updates = []
+        for table_entry in table_entries:
+            update = p4runtime_pb2.Update()
+            if update_type is not None:
+                update.type = update_type
+            elif table_entry.is_default_action:
+                update.type = p4runtime_pb2.Update.MODIFY
+            else:
+                update.type = p4runtime_pb2.Update.INSERT
+            update.entity.table_entry.CopyFrom(table_entry)
+            updates.append(update)
+        return self.WriteUpdates(updates, batch_size, dry_run)
+
+    def DeleteTableEntries(self, table_entries, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        return self.WriteTableEntries(table_entries, p4runtime_pb2.Update.DELETE,
+                                      batch_size, dry_run)
+
+    def UpsertTableEntries(self, table_entries, update_type=p4runtime_pb2.Update.INSERT,
+                           batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Writes table entries the switch may already hold, or miss, e.g. after
+        a Write that failed partway: an INSERT refused as existing is sent
+        again as a MODIFY, a MODIFY refused as missing as an INSERT, and a
+        DELETE of a missing entry counts as done. Other refusals raise.
+        """
+        table_entries = list(table_entries)
+        for start in range(0, len(table_entries), batch_size):
+            chunk = table_entries[start:start + batch_size]
+            try:
+                self.WriteTableEntries(chunk, update_type, batch_size)
+            except grpc.RpcError as e:
+                codes = updateCodes(e, len(chunk))
+                if codes is None and len(chunk) > 1:
+                    # The switch does not say which ones it refused
+                    for table_entry in chunk:
+                        self.UpsertTableEntries([table_entry], update_type)
+                    continue
+                again, retry_type = [], None
+                for table_entry, code in zip(chunk, codes or [e.code().value[0]]):
+                    if code == code_pb2.OK:
+                        continue
+                    if (update_type, code) not in _UPSERT:
+                        raise
+                    retry_type = _UPSERT[update_type, code]
+                    if retry_type is not None:
+                        again.append(table_entry)
+                if again:
+                    self.WriteTableEntries(again, retry_type, batch_size)
@@ -0,0 +1,147 @@
+"""
+Counter time series in a memory-mapped file.
+
+A ``TimeSeries`` is a ring of samples in a ``.npy`` file, each a timestamp and
+two cumulative count arrays (packets, bytes) of a fixed shape, e.g. (switch,
+destination, configuration). The labels of the axes are kept next to it in
+``<path>.json``. Since the file is a plain memory-mapped NumPy array, other
+processes can read it while the writer appends, without any parsing:
+
+    series = TimeSeries.openOrCreate('logs/mrc-traffic.npy',
+                                     [('switch', ['s1', ...]), ('dst', [...])])
+    series.append(time(), packets, octets)
+
+    times, packet_rates, byte_rates = TimeSeries.open('logs/mrc-traffic.npy').rates()
+
+Render the latest rates with ``python3 -m p4ctl.timeseries <file>``.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+DEFAULT_CAPACITY = 8640
+
+
+class TimeSeries(object):
+
+    def __init__(self, path, samples, axes):
+        self.path = path
+        self.samples = samples
+        self.axes = axes
+        times = samples['time']
+        self.next = (int(np.argmax(times)) + 1) % len(samples) if times.any() else 0
+
+    @property
+    def shape(self):
+        return tuple(len(labels) for _, labels in self.axes)
+
+    @classmethod
+    def create(cls, path, axes, capacity=DEFAULT_CAPACITY):
+        """
+        :param axes: list of (name, labels) giving the shape of the counts
+        :param capacity: samples kept; the oldest are overwritten
+        """
+        axes = [(name, list(labels)) for name, labels in axes]
+        shape = tuple(len(labels) for _, labels in axes)
+        dtype = np.dtype([('time', 'f8'), ('packets', 'u8', shape), ('bytes', 'u8', shape)])
+        samples = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(capacity,))
+        with open(path + '.json', 'w') as f:
+            json.dump({'axes': axes}, f)
+        return cls(path, samples, axes)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        with open(path + '.json') as f:
+            axes = [(name, labels) for name, labels in json.load(f)['axes']]
+        return cls(path, np.load(path, mmap_mode=mode), axes)
+
+    @classmethod
+    def openOrCreate(cls, path, axes, capacity=DEFAULT_CAPACITY):
+        """Appends to an existing file with the same axes, else starts a new one."""
+        axes = [(name, list(labels)) for name, labels in axes]
+        try:
+            series = cls.open(path, mode='r+')
+            if series.axes == axes:
+                return series
+        except (OSError, ValueError):
+            pass
+        return cls.create(path, axes, capacity)
+
+    def append(self, timestamp, packets, octets):
+        """
+        Overwrites the oldest sample. Readers skip samples with a zero time,
+        so the slot is marked unwritten while its counts change and gets its
+        time only once they are flushed; a reader never sees a torn sample.
+        """
+        sample = self.samples[self.next]
+        sample['time'] = 0
+        self.samples.flush()
+        sample['packets'] = packets
+        sample['bytes'] = octets
+        self.samples.flush()
+        sample['time'] = timestamp
+        self.samples.flush()
+        self.next = (self.next + 1) % len(self.samples)
+
+    def ordered(self):
+        """The samples written so far, oldest first."""
+        written = self.samples[self.samples['time'] > 0]
+        return written[np.argsort(written['time'])]
+
+    def latest(self):
+        """The newest sample, or None."""
+        ordered = self.ordered()
+        return ordered[-1] if len(ordered) else None
+
+    def totals(self):
+        """Copies of the newest counts (zeros if none) to keep adding to."""
+        latest = self.latest()
+        if latest is None:
+            return np.zeros(self.shape, dtype='u8'), np.zeros(self.shape, dtype='u8')
+        return latest['packets'].copy(), latest['bytes'].copy()
+
+    def rates(self):
+        """
+        Rates between consecutive samples.
+
+        :returns: (end time of each interval, packets/s, bytes/s), the rates
+                  with an interval axis in front of the counts' shape
+        """
+        ordered = self.ordered()
+        elapsed = np.diff(ordered['time'])
+        elapsed = elapsed.reshape(elapsed.shape + (1,) * len(self.shape))
+        packets = np.diff(ordered['packets'].astype(np.int64), axis=0) / elapsed
+        octets = np.diff(ordered['bytes'].astype(np.int64), axis=0) / elapsed
+        return ordered['time'][1:], packets, octets
+
+
+def _label(axes, index):
+    return ' '.join(str(labels[i]) for (_, labels), i in zip(axes, index))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the latest rates of a counter time series')
+    parser.add_argument('path', help='.npy time series file')
+    parser.add_argument('--window', help='average over this many intervals',
+                        type=int, default=1)
+    parser.add_argument('--limit', help='print at most this many rows',
+                        type=int, default=20)
+    args = parser.parse_args()
+
+    series = TimeSeries.open(args.path)
+    times, packets, octets = series.rates()
+    if not len(times):
+        sys.exit("%s: fewer than two samples" % args.path)
+    window = min(args.window, len(times))
+    packet_rates = packets[-window:].mean(axis=0)
+    byte_rates = octets[-window:].mean(axis=0)
+    print("%s over the last %d intervals" % (
+        ' / '.join(name for name, _ in series.axes), window))
+    for flat in np.argsort(byte_rates, axis=None)[::-1][:args.limit]:
+        index = np.unravel_index(flat, byte_rates.shape)
+        if byte_rates[index] <= 0 and packet_rates[index] <= 0:
+            break
+        print("%-30s %12.1f pkt/s %14.1f B/s" % (
+            _label(series.axes, index), packet_rates[index], byte_rates[index]))
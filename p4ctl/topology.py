@@ -0,0 +1,60 @@
+"""
+The exercises' topology.json, as the controllers need it.
+
+    {"hosts": {"h1": {"ip": "10.0.1.1/24", "mac": "08:00:00:00:01:11", ...}},
+     "switches": {"s1": {}, ...},
+     "links": [["s1-p2", "s2-p2", "0", 1], ["h1", "s1-p1", "0", 1], ...]}
+
+Link ends are ``<node>-p<port>`` for switches and the bare name for hosts;
+the optional latency and bandwidth columns are ignored here.
+"""
+import collections
+import json
+
+HostPort = collections.namedtuple('HostPort', ['name', 'ip', 'mac', 'switch', 'port'])
+Link = collections.namedtuple('Link', ['switch1', 'port1', 'switch2', 'port2'])
+
+
+def _linkEnd(end):
+    node, _, port = end.partition('-p')
+    return node, int(port) if port else None
+
+
+class Topology(object):
+
+    def __init__(self, topo):
+        self.switches = sorted(topo.get('switches', {}))
+        self.hosts = {}
+        self.links = []
+        host_params = topo.get('hosts', {})
+        for link in topo.get('links', []):
+            (node1, port1), (node2, port2) = _linkEnd(link[0]), _linkEnd(link[1])
+            if node1 in host_params or node2 in host_params:
+                host, (switch, port) = ((node1, (node2, port2)) if node1 in host_params
+                                        else (node2, (node1, port1)))
+                params = host_params[host]
+                self.hosts[host] = HostPort(host, params['ip'].split('/')[0],
+                                            params['mac'], switch, port)
+            else:
+                self.links.append(Link(node1, port1, node2, port2))
+
+    @classmethod
+    def load(cls, topo_file_path):
+        with open(topo_file_path) as f:
+            return cls(json.load(f))
+
+    def fabricPorts(self):
+        """(switch, port) of every end of an inter-switch link."""
+        ports = set()
+        for link in self.links:
+            ports.add((link.switch1, link.port1))
+            ports.add((link.switch2, link.port2))
+        return ports
+
+    def hostPorts(self):
+        """(switch, port) of every port a host is attached to."""
+        return set((host.switch, host.port) for host in self.hosts.values())
+
+    def edgeSwitches(self):
+        """Host IP -> the switch it is attached to."""
+        return {host.ip: host.switch for host in self.hosts.values()}
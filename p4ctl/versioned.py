@@ -0,0 +1,80 @@
+"""
+Make-before-break (versioned) reprogramming of many entries at once.
+
+Rewriting routes in place leaves the fabric half old, half new while the
+writes run, and packets that cross both halves get dropped or loop. A
+versioned program instead carries a route version in every packet: the
+switch where a packet enters stamps it with the version it currently uses,
+and every table entry on the way matches on that version. An update then
+goes through three phases:
+
+1. install: the new entries, tagged with the next version, are written to
+   every switch next to the old ones; nothing uses them yet,
+2. flip: each ingress switch starts stamping the new version, one default
+   entry per switch; a packet sees only old or only new entries,
+3. after ``drain`` seconds, when the packets stamped with the old version
+   have left the fabric, the old entries are deleted in bulk.
+
+Each phase finishes on all switches before the next starts. If the install
+fails, the switches that got all their new entries are cleaned up again and
+the old version stays in use; anything left over is never matched, since no
+switch stamps that version. If a flip fails, both versions stay installed,
+which is consistent; run the update again.
+
+Two versions are enough; they alternate between 1 and 2, and the initial
+install already uses the first. 0 is never installed: it means no switch has
+stamped the packet yet, so a switch can tell a host packet from one that
+another switch stamped with a version that it has not flipped to yet.
+
+    makeBeforeBreak(switches, install={"s1": [...], ...},
+                    flip={"s1": stamp_entry, ...}, remove={"s1": [...], ...})
+
+See final/mrc.p4 (``mrc_version``) and ``mrc_controller.py --update``.
+"""
+from time import sleep
+
+import grpc
+
+VERSIONS = (1, 2)
+
+DEFAULT_DRAIN = 1.0
+
+
+def otherVersion(version):
+    """The version an update moves to from `version`."""
+    return VERSIONS[1] if version == VERSIONS[0] else VERSIONS[0]
+
+
+def makeBeforeBreak(switches, install, flip, remove, drain=DEFAULT_DRAIN):
+    """
+    Runs one versioned update over a set of switches.
+
+    :param switches: switch name -> ControllerConnection, already master
+    :param install: switch name -> TableEntry list of the new version
+    :param flip: switch name -> the default TableEntry that makes the switch
+                 stamp the new version
+    :param remove: switch name -> TableEntry list of the old version
+    :param drain: seconds between the flip and removing the old entries
+    """
+    installed = []
+    try:
+        for name, entries in install.items():
+            if entries:
+                switches[name].WriteTableEntries(entries)
+                installed.append(name)
+    except grpc.RpcError:
+        for name in installed:
+            switches[name].DeleteTableEntries(install[name])
+        raise
+    print("Installed %d new entries on %d switches" % (
+        sum(len(entries) for entries in install.values()), len(installed)))
+
+    for name, entry in flip.items():
+        switches[name].WriteTableEntry(entry)
+    print("Flipped %d ingress switches to the new version" % len(flip))
+
+    sleep(drain)
+    for name, entries in remove.items():
+        if entries:
+            switches[name].DeleteTableEntries(entries)
+    print("Removed %d old entries" % sum(len(entries) for entries in remove.values()))